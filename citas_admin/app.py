@@ -6,11 +6,12 @@ import rq
 from flask import Flask
 from redis import Redis
 
-from config.settings import Settings
+from citas_admin import models  # Cargar todos los modelos antes que las vistas
 from citas_admin.blueprints.autoridades.views import autoridades
 from citas_admin.blueprints.bitacoras.views import bitacoras
 from citas_admin.blueprints.cit_categorias.views import cit_categorias
 from citas_admin.blueprints.cit_citas.views import cit_citas
+from citas_admin.blueprints.cit_citas_diarias.views import cit_citas_diarias
 from citas_admin.blueprints.cit_clientes.views import cit_clientes
 from citas_admin.blueprints.cit_clientes_recuperaciones.views import cit_clientes_recuperaciones
 from citas_admin.blueprints.cit_clientes_registros.views import cit_clientes_registros
@@ -31,11 +32,12 @@ from citas_admin.blueprints.permisos.views import permisos
 from citas_admin.blueprints.roles.views import roles
 from citas_admin.blueprints.sistemas.views import sistemas
 from citas_admin.blueprints.tareas.views import tareas
-from citas_admin.blueprints.usuarios.views import usuarios
 from citas_admin.blueprints.usuarios.models import Usuario
+from citas_admin.blueprints.usuarios.views import usuarios
 from citas_admin.blueprints.usuarios_oficinas.views import usuarios_oficinas
 from citas_admin.blueprints.usuarios_roles.views import usuarios_roles
 from citas_admin.extensions import csrf, database, login_manager, moment
+from config.settings import Settings
 
 
 def create_app():
@@ -55,6 +57,7 @@ def create_app():
     app.register_blueprint(bitacoras)
     app.register_blueprint(cit_categorias)
     app.register_blueprint(cit_citas)
+    app.register_blueprint(cit_citas_diarias)
     app.register_blueprint(cit_clientes)
     app.register_blueprint(cit_clientes_recuperaciones)
     app.register_blueprint(cit_clientes_registros)
@@ -104,4 +107,4 @@ def authentication(user_model):
 
     @login_manager.user_loader
     def load_user(uid):
-        return user_model.query.get(uid)
+        return user_model.get_cached(uid)
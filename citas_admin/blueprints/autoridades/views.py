@@ -6,6 +6,7 @@ import json
 
 from flask import Blueprint, flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
+from sqlalchemy.orm import joinedload
 
 from citas_admin.blueprints.autoridades.forms import AutoridadForm
 from citas_admin.blueprints.autoridades.models import Autoridad
@@ -70,7 +71,9 @@ def datatable_json():
         if distrito_nombre != "":
             consulta = consulta.join(Distrito).filter(Distrito.nombre.contains(distrito_nombre))
     # Ordenar y paginar
-    registros = consulta.order_by(Autoridad.clave).offset(start).limit(rows_per_page).all()
+    registros = (
+        consulta.options(joinedload(Autoridad.distrito)).order_by(Autoridad.clave).offset(start).limit(rows_per_page).all()
+    )
     total = consulta.count()
     # Elaborar datos para DataTable
     data = []
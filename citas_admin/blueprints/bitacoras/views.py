@@ -4,15 +4,17 @@ Bitácoras
 
 import json
 
-from flask import Blueprint, render_template, request, url_for
+from flask import Blueprint, flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
+from sqlalchemy.orm import joinedload
 
 from citas_admin.blueprints.bitacoras.models import Bitacora
 from citas_admin.blueprints.modulos.models import Modulo
 from citas_admin.blueprints.permisos.models import Permiso
 from citas_admin.blueprints.usuarios.decorators import permission_required
 from citas_admin.blueprints.usuarios.models import Usuario
-from lib.datatables import get_datatable_parameters, output_datatable_json
+from lib.datatables import count_datatable, get_datatable_parameters, output_datatable_json, paginate_datatable
+from lib.exports import FORMATOS
 from lib.safe_string import safe_email, safe_string
 
 MODULO = "BITACORAS"
@@ -27,33 +29,54 @@ def before_request():
     """Permiso por defecto"""
 
 
-@bitacoras.route("/bitacoras/datatable_json", methods=["GET", "POST"])
-def datatable_json():
-    """DataTable JSON para listado de Bitacoras"""
-    # Tomar parámetros de Datatables
-    draw, start, rows_per_page = get_datatable_parameters()
+def filtrar_datatable(formulario):
+    """Consulta de Bitacoras con los filtros del listado, se usa en datatable_json y al exportar"""
     # Consultar
     consulta = Bitacora.query
     # Primero filtrar por columnas propias
-    if "estatus" in request.form:
-        consulta = consulta.filter(Bitacora.estatus == request.form["estatus"])
+    if "estatus" in formulario:
+        consulta = consulta.filter(Bitacora.estatus == formulario["estatus"])
     else:
         consulta = consulta.filter(Bitacora.estatus == "A")
-    if "modulo_id" in request.form:
+    if "modulo_id" in formulario:
         try:
-            modulo_id = int(request.form["modulo_id"])
+            modulo_id = int(formulario["modulo_id"])
             consulta = consulta.filter(Bitacora.modulo_id == modulo_id)
         except ValueError:
             pass
-    if "usuario_id" in request.form:
+    if "usuario_id" in formulario:
         try:
-            usuario_id = int(request.form["usuario_id"])
+            usuario_id = int(formulario["usuario_id"])
             consulta = consulta.filter(Bitacora.usuario_id == usuario_id)
         except ValueError:
             pass
+    return consulta
+
+
+def exportar_datatable(formulario):
+    """Cabeceras y consulta con las columnas para exportar el listado con los mismos filtros"""
+    consulta = (
+        filtrar_datatable(formulario)
+        .with_entities(Bitacora.id, Bitacora.creado, Usuario.email, Modulo.nombre, Bitacora.descripcion, Bitacora.url)
+        .join(Usuario, Usuario.id == Bitacora.usuario_id)
+        .join(Modulo, Modulo.id == Bitacora.modulo_id)
+        .order_by(Bitacora.id)
+    )
+    return ["ID", "CREADO", "USUARIO", "MODULO", "DESCRIPCION", "URL"], consulta
+
+
+@bitacoras.route("/bitacoras/datatable_json", methods=["GET", "POST"])
+def datatable_json():
+    """DataTable JSON para listado de Bitacoras"""
+    # Tomar parámetros de Datatables
+    draw, start, rows_per_page = get_datatable_parameters()
+    # Consultar con los filtros
+    consulta = filtrar_datatable(request.form)
     # Ordenar y paginar
-    registros = consulta.order_by(Bitacora.id.desc()).offset(start).limit(rows_per_page).all()
-    total = consulta.count()
+    registros, keyset = paginate_datatable(
+        consulta.options(joinedload(Bitacora.modulo), joinedload(Bitacora.usuario)), [Bitacora.id], start, rows_per_page
+    )
+    total, estimado = count_datatable(consulta)
     # Elaborar datos para DataTable
     data = []
     for resultado in registros:
@@ -77,7 +100,24 @@ def datatable_json():
             }
         )
     # Entregar JSON
-    return output_datatable_json(draw, total, data)
+    return output_datatable_json(draw, total, data, keyset, estimado)
+
+
+@bitacoras.route("/bitacoras/exportar/<formato>")
+def export(formato):
+    """Lanzar la tarea para exportar el listado de Bitácoras con los filtros dados"""
+    if formato not in FORMATOS:
+        flash("Formato de exportación no válido.", "warning")
+        return redirect(url_for("bitacoras.list_active"))
+    tarea = current_user.launch_task(
+        comando="tareas.tasks.lanzar_exportar_listado",
+        mensaje=f"Exportando Bitácoras a {formato.upper()}",
+        listado="bitacoras",
+        formato=formato,
+        filtros=request.args.to_dict(),
+    )
+    flash(f"Se está exportando el listado de Bitácoras a {formato.upper()}.", "info")
+    return redirect(url_for("tareas.detail", tarea_id=tarea.id))
 
 
 @bitacoras.route("/bitacoras")
@@ -5,7 +5,8 @@ Cit Citas, modelos
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import Enum, ForeignKey, String, Text
+import pytz
+from sqlalchemy import Enum, ForeignKey, Index, String, Text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from citas_admin.extensions import database
@@ -24,6 +25,10 @@ class CitCita(database.Model, UniversalMixin):
 
     # Nombre de la tabla
     __tablename__ = "cit_citas"
+    __table_args__ = (
+        Index("cit_citas_oficina_id_inicio", "oficina_id", "inicio"),
+        Index("cit_citas_modificado", "modificado"),  # Para encontrar las citas modificadas desde la última actualización
+    )
 
     # Clave primaria
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -37,7 +42,7 @@ class CitCita(database.Model, UniversalMixin):
     oficina: Mapped["Oficina"] = relationship(back_populates="cit_citas")
 
     # Columnas
-    inicio: Mapped[datetime]
+    inicio: Mapped[datetime] = mapped_column(index=True, active_history=True)  # Conservar el anterior al cambiar de día
     termino: Mapped[datetime]
     notas: Mapped[str] = mapped_column(Text)
     estado: Mapped[str] = mapped_column(Enum(*ESTADOS, name="cit_citas_estados", native_enum=False), index=True)
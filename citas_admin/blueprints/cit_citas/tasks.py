@@ -1,24 +1,46 @@
 """
 Cit Citas, tareas para ejecutar en el fondo
+
+Cada noche marcar_inasistencias cambia a INASISTENCIA las citas PENDIENTES de los días anteriores con una sola
+sentencia UPDATE ... RETURNING, deja el resumen en la bitácora y encola los mensajes por lotes de ENVIAR_LOTE citas.
+Cada lote se envía con enviar_inasistencias en varios hilos y con un límite de mensajes por segundo.
+
+Cada día enviar_recordatorios manda un recordatorio de las citas PENDIENTES del día siguiente, en una sola tarea. Las
+citas a las que ya se les envió se guardan en Redis en RECORDATORIOS_KEY, si la tarea se interrumpe y se vuelve a
+lanzar continúa con las que faltan.
 """
 
 import logging
 import os
-from datetime import datetime
+from datetime import date, datetime, time, timedelta
 
-import sendgrid
+import pytz
 from dotenv import load_dotenv
-from jinja2 import Environment, FileSystemLoader
-from sendgrid.helpers.mail import Content, Email, Mail, To
+from rq import Queue
+from sqlalchemy import insert, update
+from sqlalchemy.orm import contains_eager, joinedload
 
 from citas_admin.app import create_app
+from citas_admin.blueprints.bitacoras.models import Bitacora
 from citas_admin.blueprints.cit_citas.models import CitCita
+from citas_admin.blueprints.cit_clientes.models import CitCliente
+from citas_admin.blueprints.modulos.models import Modulo
+from citas_admin.blueprints.usuarios.models import Usuario
 from citas_admin.extensions import database
+from lib.disponibilidad import descartar_dias
 from lib.exceptions import MyAnyError, MyIsDeletedError, MyNotExistsError, MyNotValidParamError
-from lib.tasks import set_task_error, set_task_progress
+from lib.mailer import get_template, is_configured, send_each, send_email
+from lib.tasks import TaskProgress, set_task_error, set_task_progress
 
 # Constantes
+ENVIAR_HILOS = 8  # Hilos que envían mensajes a la vez
+ENVIAR_LOTE = 500  # Citas por cada tarea de envío
+ENVIAR_POR_SEGUNDO = 20  # Límite de mensajes por segundo
 JINJA2_TEMPLATES_DIR = "citas_admin/blueprints/cit_citas/templates/cit_citas"
+MODULO = "CIT CITAS"
+RECORDATORIOS_KEY = "cit_citas:recordatorios:{fecha}"  # Conjunto en Redis con las citas a las que ya se les envió
+RECORDATORIOS_LOTE = 100  # Enviados que se guardan a la vez en RECORDATORIOS_KEY
+RECORDATORIOS_TTL = 3 * 24 * 60 * 60  # Segundos que se conserva RECORDATORIOS_KEY
 TIMEZONE = "America/Mexico_City"
 
 # Bitácora logs/cit_citas.log
@@ -32,8 +54,6 @@ bitacora.addHandler(empunadura)
 # Cargar variables de entorno
 load_dotenv()
 HOST = os.getenv("HOST", "http://localhost:5000")
-SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY", "")
-SENDGRID_FROM_EMAIL = os.getenv("SENDGRID_FROM_EMAIL", "citas@pjecz.gob.mx")
 
 # Cargar la aplicación para tener acceso a la base de datos
 app = create_app()
@@ -48,9 +68,9 @@ def enviar_pendiente(cit_cita_id: int, to_email: str = None) -> str:
     mensaje = f"Inicia el envío de mensaje de una cita agendada a {to_email}"
     bitacora.info(mensaje)
 
-    # Validar que esté configurado el API Key de SendGrid
-    if SENDGRID_API_KEY == "":
-        mensaje = "No está configurado el API Key de SendGrid"
+    # Validar que esté configurado el envío de mensajes
+    if not is_configured():
+        mensaje = "No está configurado el envío de mensajes"
         bitacora.error(mensaje)
         raise MyNotExistsError(mensaje)
 
@@ -76,8 +96,7 @@ def enviar_pendiente(cit_cita_id: int, to_email: str = None) -> str:
         raise MyIsDeletedError(mensaje)
 
     # Cargar la plantilla
-    entorno = Environment(loader=FileSystemLoader(JINJA2_TEMPLATES_DIR), trim_blocks=True, lstrip_blocks=True)
-    plantilla = entorno.get_template("email_pending.jinja2")
+    plantilla = get_template(JINJA2_TEMPLATES_DIR, "email_pending.jinja2")
 
     # Elaborar el asunto del mensaje
     asunto_str = f"PJECZ Sistema de Citas: Cita agendada"
@@ -90,12 +109,7 @@ def enviar_pendiente(cit_cita_id: int, to_email: str = None) -> str:
         to_email = cit_cita.cit_cliente.email
 
     # Enviar el mensaje
-    send_grid = sendgrid.SendGridAPIClient(api_key=SENDGRID_API_KEY)
-    remitente_email = Email(SENDGRID_FROM_EMAIL)
-    destinatario_email = To(to_email)
-    contenido = Content("text/html", contenidos)
-    mail = Mail(remitente_email, destinatario_email, asunto_str, contenido)
-    send_grid.client.mail.send.post(request_body=mail.get())
+    send_email(to_email, asunto_str, contenidos)
 
     # Entregar mensaje de término
     mensaje = f"Mensaje enviado a {to_email} sobre una cita agendada"
@@ -110,9 +124,9 @@ def enviar_cancelado(cit_cita_id: int, to_email: str = None) -> str:
     mensaje = f"Inicia enviar vía email de una cita cancelada a {to_email}"
     bitacora.info(mensaje)
 
-    # Validar que esté configurado el API Key de SendGrid
-    if SENDGRID_API_KEY == "":
-        mensaje = "No está configurado el API Key de SendGrid"
+    # Validar que esté configurado el envío de mensajes
+    if not is_configured():
+        mensaje = "No está configurado el envío de mensajes"
         bitacora.error(mensaje)
         raise MyNotExistsError(mensaje)
 
@@ -138,8 +152,7 @@ def enviar_cancelado(cit_cita_id: int, to_email: str = None) -> str:
         raise MyIsDeletedError(mensaje)
 
     # Cargar la plantilla
-    entorno = Environment(loader=FileSystemLoader(JINJA2_TEMPLATES_DIR), trim_blocks=True, lstrip_blocks=True)
-    plantilla = entorno.get_template("email_cancelled.jinja2")
+    plantilla = get_template(JINJA2_TEMPLATES_DIR, "email_cancelled.jinja2")
 
     # Elaborar el asunto del mensaje
     asunto_str = f"PJECZ Sistema de Citas: Cita cancelada"
@@ -152,12 +165,7 @@ def enviar_cancelado(cit_cita_id: int, to_email: str = None) -> str:
         to_email = cit_cita.cit_cliente.email
 
     # Enviar el mensaje
-    send_grid = sendgrid.SendGridAPIClient(api_key=SENDGRID_API_KEY)
-    remitente_email = Email(SENDGRID_FROM_EMAIL)
-    destinatario_email = To(to_email)
-    contenido = Content("text/html", contenidos)
-    mail = Mail(remitente_email, destinatario_email, asunto_str, contenido)
-    send_grid.client.mail.send.post(request_body=mail.get())
+    send_email(to_email, asunto_str, contenidos)
 
     # Entregar mensaje de término
     mensaje = f"Mensaje enviado a {to_email} sobre una cita cancelada"
@@ -172,9 +180,9 @@ def enviar_asistio(cit_cita_id: int, to_email: str = None) -> str:
     mensaje = f"Inicia enviar vía email de una cita a la que asistió a {to_email}"
     bitacora.info(mensaje)
 
-    # Validar que esté configurado el API Key de SendGrid
-    if SENDGRID_API_KEY == "":
-        mensaje = "No está configurado el API Key de SendGrid"
+    # Validar que esté configurado el envío de mensajes
+    if not is_configured():
+        mensaje = "No está configurado el envío de mensajes"
         bitacora.error(mensaje)
         raise MyNotExistsError(mensaje)
 
@@ -200,8 +208,7 @@ def enviar_asistio(cit_cita_id: int, to_email: str = None) -> str:
         raise MyIsDeletedError(mensaje)
 
     # Cargar la plantilla
-    entorno = Environment(loader=FileSystemLoader(JINJA2_TEMPLATES_DIR), trim_blocks=True, lstrip_blocks=True)
-    plantilla = entorno.get_template("email_assistance.jinja2")
+    plantilla = get_template(JINJA2_TEMPLATES_DIR, "email_assistance.jinja2")
 
     # Elaborar el asunto del mensaje
     asunto_str = f"PJECZ Sistema de Citas: Confirmación de asistencia"
@@ -214,12 +221,7 @@ def enviar_asistio(cit_cita_id: int, to_email: str = None) -> str:
         to_email = cit_cita.cit_cliente.email
 
     # Enviar el mensaje
-    send_grid = sendgrid.SendGridAPIClient(api_key=SENDGRID_API_KEY)
-    remitente_email = Email(SENDGRID_FROM_EMAIL)
-    destinatario_email = To(to_email)
-    contenido = Content("text/html", contenidos)
-    mail = Mail(remitente_email, destinatario_email, asunto_str, contenido)
-    send_grid.client.mail.send.post(request_body=mail.get())
+    send_email(to_email, asunto_str, contenidos)
 
     # Entregar mensaje de término
     mensaje = f"Mensaje enviado a {to_email} sobre una cita a la que asistió"
@@ -234,9 +236,9 @@ def enviar_inasistencia(cit_cita_id: int, to_email: str = None) -> str:
     mensaje = f"Inicia enviar vía email de una inasistencia a {to_email}"
     bitacora.info(mensaje)
 
-    # Validar que esté configurado el API Key de SendGrid
-    if SENDGRID_API_KEY == "":
-        mensaje = "No está configurado el API Key de SendGrid"
+    # Validar que esté configurado el envío de mensajes
+    if not is_configured():
+        mensaje = "No está configurado el envío de mensajes"
         bitacora.error(mensaje)
         raise MyNotExistsError(mensaje)
 
@@ -262,8 +264,7 @@ def enviar_inasistencia(cit_cita_id: int, to_email: str = None) -> str:
         raise MyIsDeletedError(mensaje)
 
     # Cargar la plantilla
-    entorno = Environment(loader=FileSystemLoader(JINJA2_TEMPLATES_DIR), trim_blocks=True, lstrip_blocks=True)
-    plantilla = entorno.get_template("email_no_assistance.jinja2")
+    plantilla = get_template(JINJA2_TEMPLATES_DIR, "email_no_assistance.jinja2")
 
     # Elaborar el asunto del mensaje
     asunto_str = f"PJECZ Sistema de Citas: Aviso de inasistencia"
@@ -276,12 +277,7 @@ def enviar_inasistencia(cit_cita_id: int, to_email: str = None) -> str:
         to_email = cit_cita.cit_cliente.email
 
     # Enviar el mensaje
-    send_grid = sendgrid.SendGridAPIClient(api_key=SENDGRID_API_KEY)
-    remitente_email = Email(SENDGRID_FROM_EMAIL)
-    destinatario_email = To(to_email)
-    contenido = Content("text/html", contenidos)
-    mail = Mail(remitente_email, destinatario_email, asunto_str, contenido)
-    send_grid.client.mail.send.post(request_body=mail.get())
+    send_email(to_email, asunto_str, contenidos)
 
     # Entregar mensaje de término
     mensaje = f"Mensaje enviado a {to_email} sobre aviso de inasistencia"
@@ -289,6 +285,211 @@ def enviar_inasistencia(cit_cita_id: int, to_email: str = None) -> str:
     return mensaje
 
 
+def marcar_inasistencias(usuario_id: int, notificar: bool = True) -> str:
+    """Cambiar a INASISTENCIA las citas PENDIENTES de los días anteriores y encolar sus mensajes por lotes"""
+
+    # Agregar mensaje de inicio
+    bitacora.info("Inicia marcar como INASISTENCIA las citas pendientes de los días anteriores")
+
+    # Validar el usuario y el módulo para la bitácora
+    usuario = Usuario.query.get(usuario_id)
+    if usuario is None:
+        mensaje = f"El usuario con ID {usuario_id} no existe"
+        bitacora.error(mensaje)
+        raise MyNotExistsError(mensaje)
+    modulo = Modulo.query.filter_by(nombre=MODULO).first()
+    if modulo is None:
+        mensaje = f"No existe el módulo {MODULO}"
+        bitacora.error(mensaje)
+        raise MyNotExistsError(mensaje)
+
+    # Las citas que iniciaron antes de hoy, con la hora local de las oficinas
+    hoy = datetime.now(tz=pytz.timezone(TIMEZONE)).date()
+    limite = datetime.combine(hoy, time.min)
+
+    # Cambiar el estado y escribir el resumen en la bitácora en la misma transacción
+    with database.engine.begin() as conexion:
+        cambios = conexion.execute(
+            update(CitCita)
+            .where(CitCita.estado == "PENDIENTE")
+            .where(CitCita.estatus == "A")
+            .where(CitCita.inicio < limite)
+            .values(estado="INASISTENCIA")
+            .returning(CitCita.id, CitCita.oficina_id, CitCita.inicio)
+        ).all()
+        if len(cambios) > 0:
+            conexion.execute(
+                insert(Bitacora).values(
+                    modulo_id=modulo.id,
+                    usuario_id=usuario.id,
+                    descripcion=f"Se marcaron {len(cambios)} citas como INASISTENCIA antes del {hoy}",
+                    url="/cit_citas",
+                )
+            )
+
+    # Si no hubo citas, terminar
+    if len(cambios) == 0:
+        mensaje = f"No hay citas pendientes antes del {hoy}"
+        bitacora.info(mensaje)
+        return mensaje
+
+    # Descartar los días de la disponibilidad, las inasistencias ya no ocupan lugar
+    descartar_dias((oficina_id, inicio.date()) for _, oficina_id, inicio in cambios)
+
+    # Encolar los mensajes por lotes, no una tarea por cita
+    lotes = 0
+    if notificar:
+        cit_citas_ids = sorted(cit_cita_id for cit_cita_id, _, _ in cambios)
+        trabajos = [
+            Queue.prepare_data(
+                "citas_admin.blueprints.cit_citas.tasks.enviar_inasistencias",
+                kwargs={"cit_citas_ids": cit_citas_ids[inicio : inicio + ENVIAR_LOTE]},
+            )
+            for inicio in range(0, len(cit_citas_ids), ENVIAR_LOTE)
+        ]
+        app.task_queue.enqueue_many(trabajos)
+        lotes = len(trabajos)
+
+    # Entregar mensaje de término
+    mensaje = f"Se marcaron {len(cambios)} citas como INASISTENCIA antes del {hoy} y se encolaron {lotes} lotes de mensajes"
+    bitacora.info(mensaje)
+    return mensaje
+
+
+def enviar_inasistencias(cit_citas_ids: list) -> str:
+    """Enviar los mensajes de inasistencia de un lote de citas, en varios hilos y con límite por segundo"""
+
+    # Agregar mensaje de inicio
+    bitacora.info("Inicia enviar %d mensajes de inasistencia", len(cit_citas_ids))
+
+    # Validar que esté configurado el envío de mensajes
+    if not is_configured():
+        mensaje = "No está configurado el envío de mensajes"
+        bitacora.error(mensaje)
+        raise MyNotExistsError(mensaje)
+
+    # Cargar la plantilla una sola vez
+    plantilla = get_template(JINJA2_TEMPLATES_DIR, "email_no_assistance.jinja2")
+    asunto_str = "PJECZ Sistema de Citas: Aviso de inasistencia"
+    fecha_elaboracion = datetime.now().strftime("%d/%b/%Y %I:%M %p")
+
+    # Consultar las citas del lote con sus clientes en una sola consulta, omitiendo las que ya cambiaron
+    cit_citas = (
+        CitCita.query.options(joinedload(CitCita.cit_cliente))
+        .join(CitCita.cit_cliente)
+        .filter(CitCita.id.in_(cit_citas_ids))
+        .filter(CitCita.estado == "INASISTENCIA")
+        .filter(CitCita.estatus == "A")
+        .filter(CitCliente.estatus == "A")
+        .all()
+    )
+    mensajes = (
+        (
+            cit_cita.id,
+            cit_cita.cit_cliente.email,
+            asunto_str,
+            plantilla.render(cit_cita=cit_cita, fecha_elaboracion=fecha_elaboracion),
+        )
+        for cit_cita in cit_citas
+    )
+
+    # Enviar
+    contador = 0
+    for cit_cita_id, error in send_each(mensajes, hilos=ENVIAR_HILOS, por_segundo=ENVIAR_POR_SEGUNDO):
+        if error is not None:
+            bitacora.warning("Cita %d: %s", cit_cita_id, error)
+            continue
+        contador += 1
+
+    # Entregar mensaje de término
+    mensaje = f"Se enviaron {contador} de {len(cit_citas_ids)} mensajes de inasistencia"
+    bitacora.info(mensaje)
+    return mensaje
+
+
+def enviar_recordatorios(fecha: str = None) -> str:
+    """Enviar un recordatorio de las citas PENDIENTES del día, por defecto mañana, a los clientes que autorizan mensajes"""
+
+    # Agregar mensaje de inicio
+    bitacora.info("Inicia enviar recordatorios de citas")
+
+    # Validar que esté configurado el envío de mensajes
+    if not is_configured():
+        mensaje = "No está configurado el envío de mensajes"
+        bitacora.error(mensaje)
+        raise MyNotExistsError(mensaje)
+
+    # Validar la fecha, por defecto es mañana con la hora local de las oficinas
+    if fecha is None:
+        dia = datetime.now(tz=pytz.timezone(TIMEZONE)).date() + timedelta(days=1)
+    else:
+        try:
+            dia = date.fromisoformat(fecha)
+        except ValueError as error:
+            mensaje = f"La fecha {fecha} no es válida"
+            bitacora.error(mensaje)
+            raise MyNotValidParamError(mensaje) from error
+    desde = datetime.combine(dia, time.min)
+
+    # Consultar las citas del día con sus clientes, oficinas y servicios en una sola consulta
+    cit_citas = (
+        CitCita.query.join(CitCita.cit_cliente)
+        .options(contains_eager(CitCita.cit_cliente), joinedload(CitCita.oficina), joinedload(CitCita.cit_servicio))
+        .filter(CitCita.inicio >= desde, CitCita.inicio < desde + timedelta(days=1))
+        .filter(CitCita.estado == "PENDIENTE")
+        .filter(CitCita.estatus == "A")
+        .filter(CitCliente.autoriza_mensajes.is_(True))
+        .filter(CitCliente.estatus == "A")
+        .order_by(CitCita.id)
+        .all()
+    )
+
+    # Omitir las citas a las que ya se les envió en una ejecución anterior
+    llave = RECORDATORIOS_KEY.format(fecha=dia.isoformat())
+    ya_enviados = {int(cit_cita_id) for cit_cita_id in app.redis.smembers(llave)}
+    pendientes = [cit_cita for cit_cita in cit_citas if cit_cita.id not in ya_enviados]
+    if len(pendientes) == 0:
+        mensaje = f"No hay recordatorios por enviar de las citas del {dia}"
+        bitacora.info(mensaje)
+        return mensaje
+
+    # Cargar la plantilla una sola vez
+    plantilla = get_template(JINJA2_TEMPLATES_DIR, "email_reminder.jinja2")
+    asunto_str = "PJECZ Sistema de Citas: Recordatorio de su cita"
+    fecha_elaboracion = datetime.now().strftime("%d/%b/%Y %I:%M %p")
+    mensajes = (
+        (
+            cit_cita.id,
+            cit_cita.cit_cliente.email,
+            asunto_str,
+            plantilla.render(cit_cita=cit_cita, fecha_elaboracion=fecha_elaboracion),
+        )
+        for cit_cita in pendientes
+    )
+
+    # Enviar, guardando por lotes en Redis las citas a las que ya se les envió
+    contador = 0
+    enviados_ids = []
+    with TaskProgress(len(pendientes), "Enviando recordatorios") as progreso:
+        for cit_cita_id, error in send_each(mensajes, hilos=ENVIAR_HILOS, por_segundo=ENVIAR_POR_SEGUNDO):
+            progreso.advance()
+            if error is not None:
+                bitacora.warning("Cita %d: %s", cit_cita_id, error)
+                continue
+            enviados_ids.append(cit_cita_id)
+            contador += 1
+            if len(enviados_ids) >= RECORDATORIOS_LOTE:
+                app.redis.pipeline().sadd(llave, *enviados_ids).expire(llave, RECORDATORIOS_TTL).execute()
+                enviados_ids = []
+    if len(enviados_ids) > 0:
+        app.redis.pipeline().sadd(llave, *enviados_ids).expire(llave, RECORDATORIOS_TTL).execute()
+
+    # Entregar mensaje de término
+    mensaje = f"Se enviaron {contador} de {len(pendientes)} recordatorios de las citas del {dia}"
+    bitacora.info(mensaje)
+    return mensaje
+
+
 def lanzar_enviar_pendiente(cit_cita_id: int, to_email: str = None) -> str:
     """Lanzar tarea para enviar mensaje vía email de una cita agendada"""
 
@@ -363,3 +564,41 @@ def lanzar_enviar_inasistencia(cit_cita_id: int, to_email: str = None):
     # Terminar la tarea en el fondo y entregar el mensaje de termino
     set_task_progress(100, mensaje_termino)
     return mensaje_termino
+
+
+def lanzar_marcar_inasistencias(usuario_id: int, notificar: bool = True):
+    """Lanzar tarea para marcar como INASISTENCIA las citas pendientes de los días anteriores"""
+
+    # Iniciar la tarea en el fondo
+    set_task_progress(0, "Inicia tarea para marcar como INASISTENCIA las citas pendientes de los días anteriores")
+
+    # Ejecutar
+    try:
+        mensaje_termino = marcar_inasistencias(usuario_id, notificar)
+    except MyAnyError as error:
+        mensaje_error = str(error)
+        set_task_error(mensaje_error)
+        return mensaje_error
+
+    # Terminar la tarea en el fondo y entregar el mensaje de termino
+    set_task_progress(100, mensaje_termino)
+    return mensaje_termino
+
+
+def lanzar_enviar_recordatorios(fecha: str = None):
+    """Lanzar tarea para enviar recordatorios de las citas del día siguiente"""
+
+    # Iniciar la tarea en el fondo
+    set_task_progress(0, "Inicia tarea para enviar recordatorios de las citas del día siguiente")
+
+    # Ejecutar
+    try:
+        mensaje_termino = enviar_recordatorios(fecha)
+    except MyAnyError as error:
+        mensaje_error = str(error)
+        set_task_error(mensaje_error)
+        return mensaje_error
+
+    # Terminar la tarea en el fondo y entregar el mensaje de termino
+    set_task_progress(100, mensaje_termino)
+    return mensaje_termino
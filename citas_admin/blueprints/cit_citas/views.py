@@ -6,6 +6,7 @@ import json
 
 from flask import Blueprint, flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
+from sqlalchemy.orm import aliased
 
 from citas_admin.blueprints.bitacoras.models import Bitacora
 from citas_admin.blueprints.cit_citas.models import CitCita
@@ -15,10 +16,33 @@ from citas_admin.blueprints.modulos.models import Modulo
 from citas_admin.blueprints.oficinas.models import Oficina
 from citas_admin.blueprints.permisos.models import Permiso
 from citas_admin.blueprints.usuarios.decorators import permission_required
-from lib.datatables import get_datatable_parameters, output_datatable_json
+from lib.datatables import count_datatable, get_datatable_parameters, output_datatable_json, paginate_datatable, url_template
+from lib.exports import FORMATOS
 from lib.safe_string import safe_email, safe_message, safe_string
 
 MODULO = "CIT CITAS"
+# Columnas que entrega el listado, se consultan como tuplas en lugar de cargar las entidades completas
+DATATABLE_CIT_CLIENTE = aliased(CitCliente)
+DATATABLE_CIT_SERVICIO = aliased(CitServicio)
+DATATABLE_OFICINA = aliased(Oficina)
+DATATABLE_CIT_CLIENTE_NOMBRE = (
+    DATATABLE_CIT_CLIENTE.nombres + " " + DATATABLE_CIT_CLIENTE.apellido_primero + " " + DATATABLE_CIT_CLIENTE.apellido_segundo
+).label("cit_cliente_nombre")
+DATATABLE_COLUMNS = [
+    CitCita.id,
+    CitCita.creado,
+    CitCita.inicio,
+    CitCita.termino,
+    CitCita.estado,
+    CitCita.cit_cliente_id,
+    DATATABLE_CIT_CLIENTE_NOMBRE,
+    CitCita.cit_servicio_id,
+    DATATABLE_CIT_SERVICIO.clave.label("cit_servicio_clave"),
+    DATATABLE_CIT_SERVICIO.descripcion.label("cit_servicio_descripcion"),
+    CitCita.oficina_id,
+    DATATABLE_OFICINA.clave.label("oficina_clave"),
+    DATATABLE_OFICINA.descripcion.label("oficina_descripcion"),
+]
 
 cit_citas = Blueprint("cit_citas", __name__, template_folder="templates")
 
@@ -30,63 +54,103 @@ def before_request():
     """Permiso por defecto"""
 
 
-@cit_citas.route("/cit_citas/datatable_json", methods=["GET", "POST"])
-def datatable_json():
-    """DataTable JSON para listado de Cit Citas"""
-    # Tomar parámetros de Datatables
-    draw, start, rows_per_page = get_datatable_parameters()
+def filtrar_datatable(formulario, unir_cit_cliente: bool = False):
+    """Consulta de Cit Citas con los filtros del listado, se usa en datatable_json y al exportar"""
     # Consultar
     consulta = CitCita.query
     # Primero filtrar por columnas propias
-    if "estatus" in request.form:
-        consulta = consulta.filter(CitCita.estatus == request.form["estatus"])
+    if "estatus" in formulario:
+        consulta = consulta.filter(CitCita.estatus == formulario["estatus"])
     else:
         consulta = consulta.filter(CitCita.estatus == "A")
-    if "id" in request.form:
+    if "id" in formulario:
         try:
-            cit_cita_id = int(request.form["id"])
+            cit_cita_id = int(formulario["id"])
             consulta = consulta.filter(CitCita.id == cit_cita_id)
         except ValueError:
             pass
-    if "cit_cliente_id" in request.form:
+    if "cit_cliente_id" in formulario:
         try:
-            cit_cliente_id = int(request.form["cit_cliente_id"])
+            cit_cliente_id = int(formulario["cit_cliente_id"])
             consulta = consulta.filter(CitCita.cit_cliente_id == cit_cliente_id)
         except ValueError:
             pass
-    if "cit_servicio_id" in request.form:
+    if "cit_servicio_id" in formulario:
         try:
-            cit_servicio_id = int(request.form["cit_servicio_id"])
+            cit_servicio_id = int(formulario["cit_servicio_id"])
             consulta = consulta.filter(CitCita.cit_servicio_id == cit_servicio_id)
         except ValueError:
             pass
-    if "oficina_id" in request.form:
+    if "oficina_id" in formulario:
         try:
-            oficina_id = int(request.form["oficina_id"])
+            oficina_id = int(formulario["oficina_id"])
             consulta = consulta.filter(CitCita.oficina_id == oficina_id)
         except ValueError:
             pass
     # Luego filtrar por columnas de otras tablas
     cit_cliente_email = ""
-    if "cit_cliente_email" in request.form:
-        cit_cliente_email = safe_email(request.form["cit_cliente_email"], search_fragment=True)
+    if "cit_cliente_email" in formulario:
+        cit_cliente_email = safe_email(formulario["cit_cliente_email"], search_fragment=True)
     cit_cliente_nombres = ""
-    if "cit_cliente_nombres" in request.form:
-        cit_cliente_nombres = safe_string(request.form["cit_cliente_nombres"], save_enie=True)
+    if "cit_cliente_nombres" in formulario:
+        cit_cliente_nombres = safe_string(formulario["cit_cliente_nombres"], save_enie=True)
     cit_cliente_primer_apellido = ""
-    if "cit_cliente_primer_apellido" in request.form:
-        cit_cliente_primer_apellido = safe_string(request.form["cit_cliente_primer_apellido"], save_enie=True)
-    if cit_cliente_email != "" or cit_cliente_nombres != "" or cit_cliente_primer_apellido != "":
-        consulta = consulta.join(CitCliente)
+    if "cit_cliente_primer_apellido" in formulario:
+        cit_cliente_primer_apellido = safe_string(formulario["cit_cliente_primer_apellido"], save_enie=True)
+    # El cliente se une una sola vez, si se filtra por él o si se piden sus columnas
+    if unir_cit_cliente or cit_cliente_email != "" or cit_cliente_nombres != "" or cit_cliente_primer_apellido != "":
+        consulta = consulta.join(DATATABLE_CIT_CLIENTE, CitCita.cit_cliente)
         if cit_cliente_email != "":
-            consulta = consulta.filter(CitCliente.email.contains(cit_cliente_email))
+            consulta = consulta.filter(DATATABLE_CIT_CLIENTE.email.contains(cit_cliente_email))
         if cit_cliente_nombres != "":
-            consulta = consulta.filter(CitCliente.nombres.contains(cit_cliente_nombres))
+            consulta = consulta.filter(DATATABLE_CIT_CLIENTE.nombres.contains(cit_cliente_nombres))
         if cit_cliente_primer_apellido != "":
-            consulta = consulta.filter(CitCliente.primer_apellido.contains(cit_cliente_primer_apellido))
-    # Ordenar y paginar
-    registros = consulta.order_by(CitCita.id.desc()).offset(start).limit(rows_per_page).all()
-    total = consulta.count()
+            consulta = consulta.filter(DATATABLE_CIT_CLIENTE.apellido_primero.contains(cit_cliente_primer_apellido))
+    return consulta
+
+
+def exportar_datatable(formulario):
+    """Cabeceras y consulta con las columnas para exportar el listado con los mismos filtros"""
+    consulta = (
+        filtrar_datatable(formulario, unir_cit_cliente=True)
+        .with_entities(
+            CitCita.id,
+            CitCita.inicio,
+            CitCita.termino,
+            DATATABLE_CIT_CLIENTE_NOMBRE,
+            DATATABLE_CIT_CLIENTE.email,
+            DATATABLE_CIT_SERVICIO.clave,
+            DATATABLE_OFICINA.clave,
+            CitCita.estado,
+        )
+        .join(DATATABLE_CIT_SERVICIO, CitCita.cit_servicio)
+        .join(DATATABLE_OFICINA, CitCita.oficina)
+        .order_by(CitCita.id)
+    )
+    return ["ID", "INICIO", "TERMINO", "CLIENTE", "EMAIL", "SERVICIO", "OFICINA", "ESTADO"], consulta
+
+
+@cit_citas.route("/cit_citas/datatable_json", methods=["GET", "POST"])
+def datatable_json():
+    """DataTable JSON para listado de Cit Citas"""
+    # Tomar parámetros de Datatables
+    draw, start, rows_per_page = get_datatable_parameters()
+    # Consultar con los filtros, para contar el cliente sólo se une si se filtra por él
+    consulta = filtrar_datatable(request.form)
+    # Ordenar y paginar, consultando sólo las columnas que se van a entregar
+    consulta_columnas = (
+        filtrar_datatable(request.form, unir_cit_cliente=True)
+        .with_entities(*DATATABLE_COLUMNS)
+        .join(DATATABLE_CIT_SERVICIO, CitCita.cit_servicio)
+        .join(DATATABLE_OFICINA, CitCita.oficina)
+    )
+    registros, keyset = paginate_datatable(consulta_columnas, [CitCita.id], start, rows_per_page)
+    total, estimado = count_datatable(consulta)
+    # Elaborar las plantillas de los URL una sola vez, en lugar de usar url_for en cada fila
+    detalle_url = url_template("cit_citas.detail", "cit_cita_id")
+    cit_cliente_url = url_template("cit_clientes.detail", "cit_cliente_id") if current_user.can_view("CIT CLIENTES") else ""
+    cit_servicio_url = url_template("cit_servicios.detail", "cit_servicio_id") if current_user.can_view("CIT SERVICIOS") else ""
+    oficina_url = url_template("oficinas.detail", "oficina_id") if current_user.can_view("OFICINAS") else ""
     # Elaborar datos para DataTable
     data = []
     for resultado in registros:
@@ -94,41 +158,31 @@ def datatable_json():
             {
                 "detalle": {
                     "id": resultado.id,
-                    "url": url_for("cit_citas.detail", cit_cita_id=resultado.id),
+                    "url": detalle_url.format(resultado.id),
                 },
                 "cit_cliente": {
-                    "nombre": resultado.cit_cliente.nombre,
-                    "url": (
-                        url_for("cit_clientes.detail", cit_cliente_id=resultado.cit_cliente.id)
-                        if current_user.can_view("CIT CLIENTES")
-                        else ""
-                    ),
+                    "nombre": resultado.cit_cliente_nombre,
+                    "url": cit_cliente_url.format(resultado.cit_cliente_id),
                 },
                 "cit_servicio": {
-                    "clave": resultado.cit_servicio.clave,
-                    "descripcion": resultado.cit_servicio.descripcion,
-                    "url": (
-                        url_for("cit_servicios.detail", cit_servicio_id=resultado.cit_servicio.id)
-                        if current_user.can_view("CIT SERVICIOS")
-                        else ""
-                    ),
+                    "clave": resultado.cit_servicio_clave,
+                    "descripcion": resultado.cit_servicio_descripcion,
+                    "url": cit_servicio_url.format(resultado.cit_servicio_id),
                 },
                 "oficina": {
-                    "clave": resultado.oficina.clave,
-                    "descripcion": resultado.oficina.descripcion,
-                    "url": (
-                        url_for("oficinas.detail", oficina_id=resultado.oficina.id) if current_user.can_view("OFICINAS") else ""
-                    ),
+                    "clave": resultado.oficina_clave,
+                    "descripcion": resultado.oficina_descripcion,
+                    "url": oficina_url.format(resultado.oficina_id),
                 },
-                "creado": resultado.creado.strftime("%Y-%m-%dT%H:%M:%S"),
-                "fecha": resultado.inicio.strftime("%Y-%m-%d 00:00:00"),
-                "inicio": resultado.inicio.strftime("%H:%M"),
-                "termino": resultado.termino.strftime("%H:%M"),
+                "creado": resultado.creado.isoformat(timespec="seconds"),
+                "fecha": resultado.inicio.date().isoformat() + " 00:00:00",
+                "inicio": resultado.inicio.time().isoformat(timespec="minutes"),
+                "termino": resultado.termino.time().isoformat(timespec="minutes"),
                 "estado": resultado.estado,
             }
         )
     # Entregar JSON
-    return output_datatable_json(draw, total, data)
+    return output_datatable_json(draw, total, data, keyset, estimado)
 
 
 @cit_citas.route("/cit_citas")
@@ -154,6 +208,23 @@ def list_inactive():
     )
 
 
+@cit_citas.route("/cit_citas/exportar/<formato>")
+def export(formato):
+    """Lanzar la tarea para exportar el listado de Cit Citas con los filtros dados"""
+    if formato not in FORMATOS:
+        flash("Formato de exportación no válido.", "warning")
+        return redirect(url_for("cit_citas.list_active"))
+    tarea = current_user.launch_task(
+        comando="tareas.tasks.lanzar_exportar_listado",
+        mensaje=f"Exportando Cit Citas a {formato.upper()}",
+        listado="cit_citas",
+        formato=formato,
+        filtros=request.args.to_dict(),
+    )
+    flash(f"Se está exportando el listado de Cit Citas a {formato.upper()}.", "info")
+    return redirect(url_for("tareas.detail", tarea_id=tarea.id))
+
+
 @cit_citas.route("/cit_citas/<int:cit_cita_id>")
 def detail(cit_cita_id):
     """Detalle de un Cit Cita"""
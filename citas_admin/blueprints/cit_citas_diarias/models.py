@@ -0,0 +1,82 @@
+"""
+Cit Citas Diarias, modelos
+"""
+
+from datetime import date
+
+from flask import current_app, has_app_context
+from redis.exceptions import RedisError
+from sqlalchemy import ForeignKey, String, UniqueConstraint, event, inspect
+from sqlalchemy.orm import Mapped, Session, mapped_column, relationship
+
+from citas_admin.blueprints.cit_citas.models import CitCita
+from citas_admin.extensions import database
+from lib.universal_mixin import UniversalMixin
+
+FECHAS_KEY = "cit_citas_diarias:fechas"  # Conjunto en Redis con los días marcados para recalcular
+
+
+class CitCitaDiaria(database.Model, UniversalMixin):
+    """CitCitaDiaria, cantidad de citas por día, oficina, servicio y estado"""
+
+    # Nombre de la tabla
+    __tablename__ = "cit_citas_diarias"
+    __table_args__ = (UniqueConstraint("fecha", "oficina_id", "cit_servicio_id", "estado", name="cit_citas_diarias_unico"),)
+
+    # Clave primaria
+    id: Mapped[int] = mapped_column(primary_key=True)
+
+    # Claves foráneas
+    cit_servicio_id: Mapped[int] = mapped_column(ForeignKey("cit_servicios.id"))
+    cit_servicio: Mapped["CitServicio"] = relationship(back_populates="cit_citas_diarias")
+    oficina_id: Mapped[int] = mapped_column(ForeignKey("oficinas.id"))
+    oficina: Mapped["Oficina"] = relationship(back_populates="cit_citas_diarias")
+
+    # Columnas
+    fecha: Mapped[date] = mapped_column(index=True)
+    estado: Mapped[str] = mapped_column(String(16))
+    cantidad: Mapped[int] = mapped_column(default=0)
+
+    @classmethod
+    def marcar_fechas(cls, fechas) -> None:
+        """Marcar días para recalcular en la siguiente actualización, para los cambios que no cambian modificado del día"""
+        fechas = [fecha.isoformat() for fecha in set(fechas)]
+        if fechas:
+            current_app.redis.sadd(FECHAS_KEY, *fechas)
+
+    def __repr__(self):
+        """Representación"""
+        return f"<CitCitaDiaria {self.fecha} {self.oficina_id} {self.cit_servicio_id} {self.estado}>"
+
+
+@event.listens_for(Session, "after_flush")
+def _registrar_fechas_anteriores(session, flush_context):
+    """Anotar los días que dejan las citas que cambian de día o se eliminan, el día nuevo se toma por modificado"""
+    fechas = session.info.setdefault("cit_citas_diarias_fechas", set())
+    for registro in session.dirty:
+        if isinstance(registro, CitCita):
+            historia = inspect(registro).attrs.inicio.history
+            for inicio in historia.deleted:
+                if inicio is not None and inicio.date() != registro.inicio.date():
+                    fechas.add(inicio.date())
+    for registro in session.deleted:
+        if isinstance(registro, CitCita) and registro.inicio is not None:
+            fechas.add(registro.inicio.date())
+
+
+@event.listens_for(Session, "after_commit")
+def _marcar_fechas_anteriores(session):
+    """Al confirmar, marcar los días anotados para recalcularlos en la siguiente actualización"""
+    fechas = session.info.pop("cit_citas_diarias_fechas", set())
+    if not fechas or not has_app_context():
+        return
+    try:
+        CitCitaDiaria.marcar_fechas(fechas)
+    except RedisError:
+        current_app.logger.warning("No se pudieron marcar %d días de cit_citas_diarias", len(fechas))
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_fechas_anteriores(session):
+    """Al revertir, olvidar los días anotados"""
+    session.info.pop("cit_citas_diarias_fechas", None)
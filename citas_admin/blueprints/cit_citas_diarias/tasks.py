@@ -0,0 +1,133 @@
+"""
+Cit Citas Diarias, tareas para ejecutar en el fondo
+
+La tabla cit_citas_diarias tiene la cantidad de citas por día, oficina, servicio y estado. Se actualiza por días:
+
+- Los días de las citas modificadas desde la marca de la última actualización, con un traslape por las transacciones
+  que confirmaron después
+- Los días que se marcaron con CitCitaDiaria.marcar_fechas, por ejemplo al mover citas de un día a otro en lote; los
+  días que dejan las citas que cambian de día o se eliminan con la sesión se marcan al confirmar
+- Cada grupo de días se borra y se vuelve a sumar desde cit_citas en una sola transacción, las citas se buscan por
+  rangos de inicio (inicio >= día y inicio < día siguiente) para aprovechar el índice
+
+Si no hay marca en Redis, se reconstruye toda la tabla.
+"""
+
+import logging
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import Date, and_, delete, func, insert, or_, select
+
+from citas_admin.app import create_app
+from citas_admin.blueprints.cit_citas.models import CitCita
+from citas_admin.blueprints.cit_citas_diarias.models import FECHAS_KEY, CitCitaDiaria
+from citas_admin.extensions import database
+from lib.exceptions import MyAnyError
+from lib.tasks import TaskProgress, set_task_error, set_task_progress
+
+# Constantes
+ACTUALIZAR_LOTE = 31  # Días que se recalculan por transacción
+MARCA_KEY = "cit_citas_diarias:marca"  # Modificado más reciente que ya se sumó
+TRASLAPE = timedelta(minutes=5)
+
+# Bitácora logs/cit_citas_diarias.log
+bitacora = logging.getLogger(__name__)
+bitacora.setLevel(logging.INFO)
+formato = logging.Formatter("%(asctime)s:%(levelname)s:%(message)s")
+empunadura = logging.FileHandler("logs/cit_citas_diarias.log")
+empunadura.setFormatter(formato)
+bitacora.addHandler(empunadura)
+
+# Cargar la aplicación para tener acceso a la base de datos
+app = create_app()
+app.app_context().push()
+database.app = app
+
+
+def actualizar(desde_cero: bool = False) -> str:
+    """Actualizar cit_citas_diarias con los días que cambiaron desde la última vez"""
+
+    # Tomar la marca y el modificado más reciente antes de consultar los días
+    marca = None if desde_cero else app.redis.get(MARCA_KEY)
+    nueva_marca = database.session.execute(select(func.max(CitCita.modificado))).scalar()
+    fecha_inicio = func.date(CitCita.inicio, type_=Date)  # Igual a inicio::date, también en SQLite
+
+    # Determinar los días a recalcular
+    consulta = select(fecha_inicio).distinct()
+    if marca is not None:
+        consulta = consulta.filter(CitCita.modificado > datetime.fromisoformat(marca.decode()) - TRASLAPE)
+    fechas = set(database.session.execute(consulta).scalars())
+    marcadas = app.redis.smembers(FECHAS_KEY)
+    fechas |= {date.fromisoformat(marcada.decode()) for marcada in marcadas}
+    fechas = sorted(fechas)
+    bitacora.info("Inicia actualizar %d días de cit_citas_diarias", len(fechas))
+
+    # Recalcular por grupos de días, cada grupo en su propia transacción
+    with TaskProgress(len(fechas), "Actualizando cit_citas_diarias") as progreso:
+        for inicio in range(0, len(fechas), ACTUALIZAR_LOTE):
+            lote = fechas[inicio : inicio + ACTUALIZAR_LOTE]
+            sumas = (
+                select(
+                    fecha_inicio,
+                    CitCita.oficina_id,
+                    CitCita.cit_servicio_id,
+                    CitCita.estado,
+                    func.count(CitCita.id),
+                )
+                .filter(or_(*(and_(CitCita.inicio >= desde, CitCita.inicio < hasta) for desde, hasta in _rangos(lote))))
+                .filter(CitCita.estatus == "A")
+                .group_by(fecha_inicio, CitCita.oficina_id, CitCita.cit_servicio_id, CitCita.estado)
+            )
+            with database.engine.begin() as conexion:
+                conexion.execute(delete(CitCitaDiaria).where(CitCitaDiaria.fecha.in_(lote)))
+                conexion.execute(
+                    insert(CitCitaDiaria).from_select(
+                        ["fecha", "oficina_id", "cit_servicio_id", "estado", "cantidad"],
+                        sumas,
+                    )
+                )
+            progreso.advance(len(lote))
+
+    # Guardar la marca y quitar los días marcados que ya se recalcularon
+    tuberia = app.redis.pipeline()
+    if nueva_marca is not None:
+        tuberia.set(MARCA_KEY, nueva_marca.isoformat())
+    if marcadas:
+        tuberia.srem(FECHAS_KEY, *marcadas)
+    tuberia.execute()
+
+    # Entregar mensaje de termino
+    mensaje = f"Se actualizaron {len(fechas)} días de cit_citas_diarias"
+    bitacora.info(mensaje)
+    return mensaje
+
+
+def _rangos(fechas: list) -> list:
+    """Juntar los días ordenados en rangos [desde, hasta) de días consecutivos"""
+    rangos = []
+    for fecha in fechas:
+        desde = datetime.combine(fecha, time.min)
+        if rangos and rangos[-1][1] == desde:
+            rangos[-1][1] = desde + timedelta(days=1)
+        else:
+            rangos.append([desde, desde + timedelta(days=1)])
+    return [tuple(rango) for rango in rangos]
+
+
+def lanzar_actualizar(desde_cero: bool = False) -> str:
+    """Lanzar tarea para actualizar cit_citas_diarias"""
+
+    # Iniciar la tarea en el fondo
+    set_task_progress(0, "Inicia actualizar cit_citas_diarias")
+
+    # Ejecutar
+    try:
+        mensaje_termino = actualizar(desde_cero)
+    except MyAnyError as error:
+        mensaje_error = str(error)
+        set_task_error(mensaje_error)
+        return mensaje_error
+
+    # Terminar la tarea en el fondo y entregar el mensaje de termino
+    set_task_progress(100, mensaje_termino)
+    return mensaje_termino
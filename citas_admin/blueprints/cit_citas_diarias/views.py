@@ -0,0 +1,108 @@
+"""
+Cit Citas Diarias, vistas
+"""
+
+import json
+from datetime import date, timedelta
+
+from flask import Blueprint, flash, redirect, render_template, request, url_for
+from flask_login import current_user, login_required
+from sqlalchemy import func
+
+from citas_admin.blueprints.cit_citas_diarias.models import CitCitaDiaria
+from citas_admin.blueprints.oficinas.models import Oficina
+from citas_admin.blueprints.permisos.models import Permiso
+from citas_admin.blueprints.usuarios.decorators import permission_required
+from citas_admin.extensions import database
+
+MODULO = "CIT CITAS"
+TABLERO_DIAS = 30  # Días que se muestran por defecto en el tablero
+
+cit_citas_diarias = Blueprint("cit_citas_diarias", __name__, template_folder="templates")
+
+
+@cit_citas_diarias.before_request
+@login_required
+@permission_required(MODULO, Permiso.VER)
+def before_request():
+    """Permiso por defecto"""
+
+
+def _fecha_parametro(nombre: str, defecto: date) -> date:
+    """Tomar una fecha AAAA-MM-DD de los parámetros del URL, si no es válida entrega la fecha por defecto"""
+    try:
+        return date.fromisoformat(request.args.get(nombre, ""))
+    except ValueError:
+        return defecto
+
+
+@cit_citas_diarias.route("/cit_citas_diarias/tablero")
+def dashboard():
+    """Tablero de Cit Citas, sólo consulta cit_citas_diarias"""
+
+    # Tomar el rango de fechas y la oficina
+    hasta = _fecha_parametro("hasta", date.today())
+    desde = _fecha_parametro("desde", hasta - timedelta(days=TABLERO_DIAS - 1))
+    if desde > hasta:
+        desde, hasta = hasta, desde
+    oficina_id = request.args.get("oficina_id", type=int)
+    fechas = [desde + timedelta(days=dias) for dias in range((hasta - desde).days + 1)]
+
+    # Consultar las sumas por día y oficina para el mapa de calor
+    consulta = (
+        database.session.query(Oficina.clave, CitCitaDiaria.fecha, func.sum(CitCitaDiaria.cantidad))
+        .join(Oficina, CitCitaDiaria.oficina_id == Oficina.id)
+        .filter(CitCitaDiaria.fecha >= desde)
+        .filter(CitCitaDiaria.fecha <= hasta)
+    )
+    if oficina_id:
+        consulta = consulta.filter(CitCitaDiaria.oficina_id == oficina_id)
+    mapa = {}
+    for oficina_clave, fecha, cantidad in consulta.group_by(Oficina.clave, CitCitaDiaria.fecha).all():
+        mapa.setdefault(oficina_clave, {})[fecha] = int(cantidad)
+    maximo = max((cantidad for dias in mapa.values() for cantidad in dias.values()), default=0)
+    mapa_de_calor = [
+        {
+            "oficina_clave": oficina_clave,
+            "celdas": [(dias.get(fecha, 0), dias.get(fecha, 0) / maximo if maximo else 0) for fecha in fechas],
+            "total": sum(dias.values()),
+        }
+        for oficina_clave, dias in sorted(mapa.items())
+    ]
+
+    # Consultar las sumas por día y estado para la gráfica de tendencias
+    consulta = (
+        database.session.query(CitCitaDiaria.estado, CitCitaDiaria.fecha, func.sum(CitCitaDiaria.cantidad))
+        .filter(CitCitaDiaria.fecha >= desde)
+        .filter(CitCitaDiaria.fecha <= hasta)
+    )
+    if oficina_id:
+        consulta = consulta.filter(CitCitaDiaria.oficina_id == oficina_id)
+    tendencias = {}
+    for estado, fecha, cantidad in consulta.group_by(CitCitaDiaria.estado, CitCitaDiaria.fecha).all():
+        tendencias.setdefault(estado, [0] * len(fechas))[(fecha - desde).days] = int(cantidad)
+
+    # Entregar
+    return render_template(
+        "cit_citas_diarias/dashboard.jinja2",
+        desde=desde,
+        hasta=hasta,
+        oficina_id=oficina_id,
+        oficinas=Oficina.query.filter_by(puede_agendar_citas=True).filter_by(estatus="A").order_by(Oficina.clave).all(),
+        fechas=fechas,
+        mapa_de_calor=mapa_de_calor,
+        etiquetas=json.dumps([fecha.strftime("%d/%m") for fecha in fechas]),
+        tendencias=json.dumps(tendencias),
+    )
+
+
+@cit_citas_diarias.route("/cit_citas_diarias/actualizar")
+@permission_required(MODULO, Permiso.MODIFICAR)
+def update():
+    """Lanzar la tarea para actualizar cit_citas_diarias con los días que cambiaron"""
+    tarea = current_user.launch_task(
+        comando="cit_citas_diarias.tasks.lanzar_actualizar",
+        mensaje="Actualizando el tablero de Cit Citas",
+    )
+    flash("Se está actualizando el tablero de Cit Citas.", "info")
+    return redirect(url_for("tareas.detail", tarea_id=tarea.id))
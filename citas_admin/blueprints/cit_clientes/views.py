@@ -14,7 +14,8 @@ from citas_admin.blueprints.pag_pagos.models import PagPago
 from citas_admin.blueprints.pag_tramites_servicios.models import PagTramiteServicio
 from citas_admin.blueprints.permisos.models import Permiso
 from citas_admin.blueprints.usuarios.decorators import permission_required
-from lib.datatables import get_datatable_parameters, output_datatable_json
+from lib.datatables import get_datatable_parameters, output_datatable_json, paginate_datatable
+from lib.exports import FORMATOS
 from lib.safe_string import safe_email, safe_message, safe_string
 
 MODULO = "CIT CLIENTES"
@@ -29,32 +30,58 @@ def before_request():
     """Permiso por defecto"""
 
 
-@cit_clientes.route("/cit_clientes/datatable_json", methods=["GET", "POST"])
-def datatable_json():
-    """DataTable JSON para listado de CitCliente"""
-    # Tomar parámetros de Datatables
-    draw, start, rows_per_page = get_datatable_parameters()
+def filtrar_datatable(formulario):
+    """Consulta de CitCliente con los filtros del listado, se usa en datatable_json y al exportar"""
     # Consultar
     consulta = CitCliente.query
     # Primero filtrar por columnas propias
-    if "estatus" in request.form:
-        consulta = consulta.filter(CitCliente.estatus == request.form["estatus"])
+    if "estatus" in formulario:
+        consulta = consulta.filter(CitCliente.estatus == formulario["estatus"])
     else:
         consulta = consulta.filter(CitCliente.estatus == "A")
-    if "email" in request.form:
-        email = safe_email(request.form["email"], search_fragment=True)
+    if "email" in formulario:
+        email = safe_email(formulario["email"], search_fragment=True)
         if email != "":
             consulta = consulta.filter(CitCliente.email.contains(email))
-    if "nombres" in request.form:
-        nombres = safe_string(request.form["nombres"], save_enie=True)
+    if "nombres" in formulario:
+        nombres = safe_string(formulario["nombres"], save_enie=True)
         if nombres != "":
             consulta = consulta.filter(CitCliente.nombres.contains(nombres))
-    if "apellido_primero" in request.form:
-        apellido_primero = safe_string(request.form["apellido_primero"], save_enie=True)
+    if "apellido_primero" in formulario:
+        apellido_primero = safe_string(formulario["apellido_primero"], save_enie=True)
         if apellido_primero != "":
             consulta = consulta.filter(CitCliente.apellido_primero.contains(apellido_primero))
+    return consulta
+
+
+def exportar_datatable(formulario):
+    """Cabeceras y consulta con las columnas para exportar el listado con los mismos filtros"""
+    consulta = (
+        filtrar_datatable(formulario)
+        .with_entities(
+            CitCliente.id,
+            CitCliente.email,
+            CitCliente.nombres,
+            CitCliente.apellido_primero,
+            CitCliente.apellido_segundo,
+            CitCliente.curp,
+            CitCliente.telefono,
+            CitCliente.creado,
+        )
+        .order_by(CitCliente.id)
+    )
+    return ["ID", "EMAIL", "NOMBRES", "APELLIDO PRIMERO", "APELLIDO SEGUNDO", "CURP", "TELEFONO", "CREADO"], consulta
+
+
+@cit_clientes.route("/cit_clientes/datatable_json", methods=["GET", "POST"])
+def datatable_json():
+    """DataTable JSON para listado de CitCliente"""
+    # Tomar parámetros de Datatables
+    draw, start, rows_per_page = get_datatable_parameters()
+    # Consultar con los filtros
+    consulta = filtrar_datatable(request.form)
     # Ordenar y paginar
-    registros = consulta.order_by(CitCliente.email).offset(start).limit(rows_per_page).all()
+    registros, keyset = paginate_datatable(consulta, [CitCliente.email], start, rows_per_page, descendente=False)
     total = consulta.count()
     # Elaborar datos para DataTable
     data = []
@@ -70,7 +97,7 @@ def datatable_json():
             }
         )
     # Entregar JSON
-    return output_datatable_json(draw, total, data)
+    return output_datatable_json(draw, total, data, keyset)
 
 
 @cit_clientes.route("/cit_clientes")
@@ -96,6 +123,23 @@ def list_inactive():
     )
 
 
+@cit_clientes.route("/cit_clientes/exportar/<formato>")
+def export(formato):
+    """Lanzar la tarea para exportar el listado de CitCliente con los filtros dados"""
+    if formato not in FORMATOS:
+        flash("Formato de exportación no válido.", "warning")
+        return redirect(url_for("cit_clientes.list_active"))
+    tarea = current_user.launch_task(
+        comando="tareas.tasks.lanzar_exportar_listado",
+        mensaje=f"Exportando Clientes a {formato.upper()}",
+        listado="cit_clientes",
+        formato=formato,
+        filtros=request.args.to_dict(),
+    )
+    flash(f"Se está exportando el listado de Clientes a {formato.upper()}.", "info")
+    return redirect(url_for("tareas.detail", tarea_id=tarea.id))
+
+
 @cit_clientes.route("/cit_clientes/<int:cit_cliente_id>")
 def detail(cit_cliente_id):
     """Detalle de un CitCliente"""
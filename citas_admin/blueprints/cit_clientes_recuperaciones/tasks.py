@@ -6,19 +6,23 @@ import logging
 import os
 from datetime import datetime
 
-import sendgrid
 from dotenv import load_dotenv
-from jinja2 import Environment, FileSystemLoader
-from sendgrid.helpers.mail import Content, Email, Mail, To
+from sqlalchemy import update
+from sqlalchemy.orm import contains_eager
 
 from citas_admin.app import create_app
+from citas_admin.blueprints.cit_clientes.models import CitCliente
 from citas_admin.blueprints.cit_clientes_recuperaciones.models import CitClienteRecuperacion
 from citas_admin.extensions import database
 from lib.exceptions import MyAnyError, MyIsDeletedError, MyNotExistsError, MyNotValidParamError
+from lib.mailer import get_template, is_configured, send_each, send_email
 from lib.tasks import set_task_error, set_task_progress
 
 # Constantes
 JINJA2_TEMPLATES_DIR = "citas_admin/blueprints/cit_clientes_recuperaciones/templates/cit_clientes_recuperaciones"
+REENVIAR_HILOS = 8  # Hilos que envían mensajes a la vez
+REENVIAR_LOTE = 500  # Recuperaciones por lote, al consultar y al actualizar mensajes_cantidad
+REENVIAR_POR_SEGUNDO = 20  # Límite de mensajes por segundo
 TIMEZONE = "America/Mexico_City"
 
 # Bitácora logs/cit_clientes_recuperaciones.log
@@ -32,8 +36,6 @@ bitacora.addHandler(empunadura)
 # Cargar variables de entorno
 load_dotenv()
 HOST = os.getenv("HOST", "http://localhost:5000")
-SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY", "")
-SENDGRID_FROM_EMAIL = os.getenv("SENDGRID_FROM_EMAIL", "citas@pjecz.gob.mx")
 
 # Cargar la aplicación para tener acceso a la base de datos
 app = create_app()
@@ -48,9 +50,9 @@ def enviar(cit_cliente_recuperacion_id: int, to_email: str = None) -> str:
     mensaje = f"Inicia el envío de mensaje con un URL para cambiar la contraseña para {to_email}"
     bitacora.info(mensaje)
 
-    # Validar que esté configurado el API Key de SendGrid
-    if SENDGRID_API_KEY == "":
-        mensaje = "No está configurado el API Key de SendGrid"
+    # Validar que esté configurado el envío de mensajes
+    if not is_configured():
+        mensaje = "No está configurado el envío de mensajes"
         bitacora.error(mensaje)
         raise MyNotExistsError(mensaje)
 
@@ -83,31 +85,20 @@ def enviar(cit_cliente_recuperacion_id: int, to_email: str = None) -> str:
         raise MyIsDeletedError(mensaje)
 
     # Cargar la plantilla
-    entorno = Environment(loader=FileSystemLoader(JINJA2_TEMPLATES_DIR), trim_blocks=True, lstrip_blocks=True)
-    plantilla = entorno.get_template("email_password.jinja2")
+    plantilla = get_template(JINJA2_TEMPLATES_DIR, "email_recover.jinja2")
 
     # Elaborar el asunto del mensaje
     asunto_str = f"PJECZ Sistema de Citas: Cambiar contraseña"
 
     # Elaborar el contenido del mensaje
-    contenidos = plantilla.render(
-        cit_cliente_recuperacion=cit_cliente_recuperacion,
-        fecha_elaboracion=datetime.now().strftime("%d/%b/%Y %I:%M %p"),
-        expiracion_horas=24,
-        recuperacion_url=f"{HOST}/cit_clientes_recuperaciones/recuperar/{cit_cliente_recuperacion.encode_id()}",
-    )
+    contenidos = _elaborar_contenidos(plantilla, cit_cliente_recuperacion, datetime.now().strftime("%d/%b/%Y %I:%M %p"))
 
     # Si to_email es None, se usará el email del cliente
     if to_email is None:
         to_email = cit_cliente_recuperacion.cit_cliente.email
 
     # Enviar el mensaje
-    send_grid = sendgrid.SendGridAPIClient(api_key=SENDGRID_API_KEY)
-    remitente_email = Email(SENDGRID_FROM_EMAIL)
-    destinatario_email = To(to_email)
-    contenido = Content("text/html", contenidos)
-    mail = Mail(remitente_email, destinatario_email, asunto_str, contenido)
-    send_grid.client.mail.send.post(request_body=mail.get())
+    send_email(to_email, asunto_str, contenidos)
 
     # Entregar mensaje de término
     mensaje = f"Se envió el mensaje con un URL para cambiar su contraseña a {to_email}"
@@ -119,26 +110,76 @@ def reenviar() -> str:
     """Reenviar mensajes via email a quienes no han terminado su recuperación"""
 
     # Agregar mensaje de inicio
-    mensaje = f"Inicia el reenvío de mensajes de recuperación de contraseña"
+    mensaje = "Inicia el reenvío de mensajes de recuperación de contraseña"
     bitacora.info(mensaje)
 
-    # Consultar las recuperaciones pendientes
-    cit_clientes_recuperaciones = CitClienteRecuperacion.query.filter_by(ya_recuperado=False).filter_by(estatus="A").all()
+    # Validar que esté configurado el envío de mensajes
+    if not is_configured():
+        mensaje = "No está configurado el envío de mensajes"
+        bitacora.error(mensaje)
+        raise MyNotExistsError(mensaje)
 
-    # Si la consulta no arrojo resultados, terminar
-    if cit_clientes_recuperaciones is None:
-        mensaje = "No hay recuperaciones pendientes"
-        bitacora.info(mensaje)
-        return mensaje
+    # Eliminar en una sola sentencia las recuperaciones pendientes que ya expiraron
+    ahora = datetime.now()
+    with database.engine.begin() as conexion:
+        expiradas = conexion.execute(
+            update(CitClienteRecuperacion)
+            .where(CitClienteRecuperacion.ya_recuperado.is_(False))
+            .where(CitClienteRecuperacion.estatus == "A")
+            .where(CitClienteRecuperacion.expiracion <= ahora)
+            .values(estatus="B")
+        ).rowcount
+    if expiradas > 0:
+        bitacora.info(f"Se eliminaron {expiradas} recuperaciones que expiraron")
+
+    # Cargar la plantilla una sola vez
+    plantilla = get_template(JINJA2_TEMPLATES_DIR, "email_recover.jinja2")
+    asunto_str = "PJECZ Sistema de Citas: Cambiar contraseña"
+    fecha_elaboracion = ahora.strftime("%d/%b/%Y %I:%M %p")
+
+    # Consultar las recuperaciones pendientes con sus clientes por lotes, sin cargarlas todas en memoria
+    cit_clientes_recuperaciones = (
+        CitClienteRecuperacion.query.join(CitClienteRecuperacion.cit_cliente)
+        .options(contains_eager(CitClienteRecuperacion.cit_cliente))
+        .filter(CitClienteRecuperacion.ya_recuperado.is_(False))
+        .filter(CitClienteRecuperacion.estatus == "A")
+        .filter(CitClienteRecuperacion.expiracion > ahora)
+        .filter(CitCliente.estatus == "A")
+        .order_by(CitClienteRecuperacion.id)
+        .yield_per(REENVIAR_LOTE)
+    )
+
+    # Elaborar los mensajes conforme se consultan, el envío se hace en varios hilos
+    mensajes = (
+        (
+            cit_cliente_recuperacion.id,
+            cit_cliente_recuperacion.cit_cliente.email,
+            asunto_str,
+            _elaborar_contenidos(plantilla, cit_cliente_recuperacion, fecha_elaboracion),
+        )
+        for cit_cliente_recuperacion in cit_clientes_recuperaciones
+    )
 
-    # Bucle entre las recuperaciones pendientes
+    # Bucle entre los envíos terminados, incrementando mensajes_cantidad por lotes
     contador = 0
-    for cit_cliente_recuperacion in cit_clientes_recuperaciones:
-        try:
-            enviar(cit_cliente_recuperacion.id)
-            contador += 1
-        except MyAnyError as error:
-            bitacora.warning(str(error))
+    enviados_ids = []
+    for cit_cliente_recuperacion_id, error in send_each(mensajes, hilos=REENVIAR_HILOS, por_segundo=REENVIAR_POR_SEGUNDO):
+        if error is not None:
+            bitacora.warning(error)
+            continue
+        enviados_ids.append(cit_cliente_recuperacion_id)
+        contador += 1
+        if len(enviados_ids) >= REENVIAR_LOTE:
+            _incrementar_mensajes_cantidad(enviados_ids)
+            enviados_ids = []
+    if len(enviados_ids) > 0:
+        _incrementar_mensajes_cantidad(enviados_ids)
+
+    # Si no hubo recuperaciones pendientes, terminar
+    if contador == 0:
+        mensaje = "No hay recuperaciones pendientes o no se pudo enviar ningún mensaje"
+        bitacora.info(mensaje)
+        return mensaje
 
     # Entregar mensaje de término
     mensaje = f"Se enviaron {contador} mensajes de recuperación de contraseña"
@@ -146,6 +187,26 @@ def reenviar() -> str:
     return mensaje
 
 
+def _elaborar_contenidos(plantilla, cit_cliente_recuperacion: CitClienteRecuperacion, fecha_elaboracion: str) -> str:
+    """Elaborar el contenido del mensaje con el URL para cambiar la contraseña"""
+    return plantilla.render(
+        cit_cliente_recuperacion=cit_cliente_recuperacion,
+        fecha_elaboracion=fecha_elaboracion,
+        expiracion_horas=24,
+        recuperacion_url=f"{HOST}/cit_clientes_recuperaciones/recuperar/{cit_cliente_recuperacion.encode_id()}",
+    )
+
+
+def _incrementar_mensajes_cantidad(cit_clientes_recuperaciones_ids: list) -> None:
+    """Incrementar mensajes_cantidad de las recuperaciones en una sola sentencia, en su propia transacción"""
+    with database.engine.begin() as conexion:
+        conexion.execute(
+            update(CitClienteRecuperacion)
+            .where(CitClienteRecuperacion.id.in_(cit_clientes_recuperaciones_ids))
+            .values(mensajes_cantidad=CitClienteRecuperacion.mensajes_cantidad + 1)
+        )
+
+
 def lanzar_enviar(cit_cliente_recuperacion_id: int, to_email: str = None):
     """Lanzar tarea para enviar mensaje con un URL para cambiar su contraseña"""
 
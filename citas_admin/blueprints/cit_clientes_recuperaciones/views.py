@@ -6,6 +6,7 @@ import json
 
 from flask import Blueprint, flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
+from sqlalchemy.orm import joinedload
 
 from citas_admin.blueprints.bitacoras.models import Bitacora
 from citas_admin.blueprints.cit_clientes.models import CitCliente
@@ -59,7 +60,13 @@ def datatable_json():
         if cit_cliente_primer_apellido != "":
             consulta = consulta.filter(CitCliente.primer_apellido.contains(cit_cliente_primer_apellido))
     # Ordenar y paginar
-    registros = consulta.order_by(CitClienteRecuperacion.id.desc()).offset(start).limit(rows_per_page).all()
+    registros = (
+        consulta.options(joinedload(CitClienteRecuperacion.cit_cliente))
+        .order_by(CitClienteRecuperacion.id.desc())
+        .offset(start)
+        .limit(rows_per_page)
+        .all()
+    )
     total = consulta.count()
     # Elaborar datos para DataTable
     data = []
@@ -6,19 +6,21 @@ import logging
 import os
 from datetime import datetime
 
-import sendgrid
 from dotenv import load_dotenv
-from jinja2 import Environment, FileSystemLoader
-from sendgrid.helpers.mail import Content, Email, Mail, To
+from sqlalchemy import update
 
 from citas_admin.app import create_app
 from citas_admin.blueprints.cit_clientes_registros.models import CitClienteRegistro
 from citas_admin.extensions import database
-from lib.exceptions import MyAnyError, MyIsDeletedError, MyNotExistsError, MyNotValidParamError
+from lib.exceptions import MyAnyError, MyNotExistsError, MyNotValidParamError
+from lib.mailer import get_template, is_configured, send_each, send_email
 from lib.tasks import set_task_error, set_task_progress
 
 # Constantes
 JINJA2_TEMPLATES_DIR = "citas_admin/blueprints/cit_clientes_registros/templates/cit_clientes_registros"
+REENVIAR_HILOS = 8  # Hilos que envían mensajes a la vez
+REENVIAR_LOTE = 500  # Registros por lote, al consultar y al actualizar mensajes_cantidad
+REENVIAR_POR_SEGUNDO = 20  # Límite de mensajes por segundo
 TIMEZONE = "America/Mexico_City"
 
 # Bitácora logs/cit_clientes_registros.log
@@ -32,8 +34,6 @@ bitacora.addHandler(empunadura)
 # Cargar variables de entorno
 load_dotenv()
 HOST = os.getenv("HOST", "http://localhost:5000")
-SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY", "")
-SENDGRID_FROM_EMAIL = os.getenv("SENDGRID_FROM_EMAIL", "citas@pjecz.gob.mx")
 
 # Cargar la aplicación para tener acceso a la base de datos
 app = create_app()
@@ -41,16 +41,16 @@ app.app_context().push()
 database.app = app
 
 
-def enviar(cit_cliente_registro_id: int, to_email: str) -> str:
+def enviar(cit_cliente_registro_id: int, to_email: str = None) -> str:
     """Enviar mensaje via email con un URL para confirmar su registro"""
 
     # Agregar mensaje de inicio
     mensaje = f"Inicia el envío de mensaje con un URL para confirmar su registro para {to_email}"
     bitacora.info(mensaje)
 
-    # Validar que esté configurado el API Key de SendGrid
-    if SENDGRID_API_KEY == "":
-        mensaje = "No está configurado el API Key de SendGrid"
+    # Validar que esté configurado el envío de mensajes
+    if not is_configured():
+        mensaje = "No está configurado el envío de mensajes"
         bitacora.error(mensaje)
         raise MyNotExistsError(mensaje)
 
@@ -69,38 +69,21 @@ def enviar(cit_cliente_registro_id: int, to_email: str) -> str:
         bitacora.error(mensaje)
         raise MyNotValidParamError(mensaje)
 
-    # Validar el cliente
-    if cit_cliente_registro.cit_cliente.estatus != "A":
-        mensaje = f"El cliente {cit_cliente_registro.cit_cliente_id} está eliminado"
-        bitacora.error(mensaje)
-        raise MyIsDeletedError(mensaje)
-
     # Cargar la plantilla
-    entorno = Environment(loader=FileSystemLoader(JINJA2_TEMPLATES_DIR), trim_blocks=True, lstrip_blocks=True)
-    plantilla = entorno.get_template("email_verification.jinja2")
+    plantilla = get_template(JINJA2_TEMPLATES_DIR, "email_verification.jinja2")
 
     # Elaborar el asunto del mensaje
-    asunto_str = f"PJECZ Sistema de Citas: Cambiar contraseña"
+    asunto_str = "PJECZ Sistema de Citas: Confirmar su registro"
 
     # Elaborar el contenido del mensaje
-    contenidos = plantilla.render(
-        cit_cliente_registro=cit_cliente_registro,
-        fecha_elaboracion=datetime.now().strftime("%d/%b/%Y %I:%M %p"),
-        expiracion_horas=24,
-        url=f"{HOST}/cit_cliente_registro/validar/{cit_cliente_registro.encode_id()}",
-    )
+    contenidos = _elaborar_contenidos(plantilla, cit_cliente_registro, datetime.now().strftime("%d/%b/%Y %I:%M %p"))
 
-    # Si to_email es None, se usará el email del cliente
+    # Si to_email es None, se usará el email del registro
     if to_email is None:
-        to_email = cit_cliente_registro.cit_cliente.email
+        to_email = cit_cliente_registro.email
 
     # Enviar el mensaje
-    send_grid = sendgrid.SendGridAPIClient(api_key=SENDGRID_API_KEY)
-    remitente_email = Email(SENDGRID_FROM_EMAIL)
-    destinatario_email = To(to_email)
-    contenido = Content("text/html", contenidos)
-    mail = Mail(remitente_email, destinatario_email, asunto_str, contenido)
-    send_grid.client.mail.send.post(request_body=mail.get())
+    send_email(to_email, asunto_str, contenidos)
 
     # Entregar mensaje de término
     mensaje = f"Se envió el mensaje con un URL para confirmar su registro a {to_email}"
@@ -112,26 +95,59 @@ def reenviar() -> str:
     """Reenviar mensajes via email con un URL a quienes deben confirmar su registro"""
 
     # Agregar mensaje de inicio
-    mensaje = f"Inicia el reenvío de mensajes con un URL a quienes deben confirmar su registro"
+    mensaje = "Inicia el reenvío de mensajes con un URL a quienes deben confirmar su registro"
     bitacora.info(mensaje)
 
-    # Consultar los registros pendientes
-    cit_clientes_recuperaciones = CitClienteRegistro.query.filter_by(ya_registrado=False).filter_by(estatus="A").all()
+    # Validar que esté configurado el envío de mensajes
+    if not is_configured():
+        mensaje = "No está configurado el envío de mensajes"
+        bitacora.error(mensaje)
+        raise MyNotExistsError(mensaje)
 
-    # Si la consulta no arrojo resultados, terminar
-    if cit_clientes_recuperaciones is None:
-        mensaje = "No hay registros pendientes"
-        bitacora.info(mensaje)
-        return mensaje
+    # Cargar la plantilla una sola vez
+    plantilla = get_template(JINJA2_TEMPLATES_DIR, "email_verification.jinja2")
+    asunto_str = "PJECZ Sistema de Citas: Confirmar su registro"
+    fecha_elaboracion = datetime.now().strftime("%d/%b/%Y %I:%M %p")
+
+    # Consultar los registros pendientes por lotes, sin cargarlos todos en memoria
+    cit_clientes_registros = (
+        CitClienteRegistro.query.filter_by(ya_registrado=False)
+        .filter_by(estatus="A")
+        .order_by(CitClienteRegistro.id)
+        .yield_per(REENVIAR_LOTE)
+    )
 
-    # Bucle entre los registros pendientes
+    # Elaborar los mensajes conforme se consultan, el envío se hace en varios hilos
+    mensajes = (
+        (
+            cit_cliente_registro.id,
+            cit_cliente_registro.email,
+            asunto_str,
+            _elaborar_contenidos(plantilla, cit_cliente_registro, fecha_elaboracion),
+        )
+        for cit_cliente_registro in cit_clientes_registros
+    )
+
+    # Bucle entre los envíos terminados, incrementando mensajes_cantidad por lotes
     contador = 0
-    for cit_cliente_recuperacion in cit_clientes_recuperaciones:
-        try:
-            enviar(cit_cliente_recuperacion.id)
-            contador += 1
-        except MyAnyError as error:
-            bitacora.warning(str(error))
+    enviados_ids = []
+    for cit_cliente_registro_id, error in send_each(mensajes, hilos=REENVIAR_HILOS, por_segundo=REENVIAR_POR_SEGUNDO):
+        if error is not None:
+            bitacora.warning(error)
+            continue
+        enviados_ids.append(cit_cliente_registro_id)
+        contador += 1
+        if len(enviados_ids) >= REENVIAR_LOTE:
+            _incrementar_mensajes_cantidad(enviados_ids)
+            enviados_ids = []
+    if len(enviados_ids) > 0:
+        _incrementar_mensajes_cantidad(enviados_ids)
+
+    # Si no hubo registros pendientes, terminar
+    if contador == 0:
+        mensaje = "No hay registros pendientes o no se pudo enviar ningún mensaje"
+        bitacora.info(mensaje)
+        return mensaje
 
     # Entregar mensaje de término
     mensaje = f"Se enviaron {contador} mensajes con un URL a quienes deben confirmar su registro"
@@ -139,7 +155,27 @@ def reenviar() -> str:
     return mensaje
 
 
-def lanzar_enviar(cit_cliente_registro_id: int, to_email: str):
+def _elaborar_contenidos(plantilla, cit_cliente_registro: CitClienteRegistro, fecha_elaboracion: str) -> str:
+    """Elaborar el contenido del mensaje con el URL para confirmar el registro"""
+    return plantilla.render(
+        cit_cliente_registro=cit_cliente_registro,
+        fecha_elaboracion=fecha_elaboracion,
+        expiracion_horas=24,
+        url=f"{HOST}/cit_cliente_registro/validar/{cit_cliente_registro.encode_id()}",
+    )
+
+
+def _incrementar_mensajes_cantidad(cit_clientes_registros_ids: list) -> None:
+    """Incrementar mensajes_cantidad de los registros en una sola sentencia, en su propia transacción"""
+    with database.engine.begin() as conexion:
+        conexion.execute(
+            update(CitClienteRegistro)
+            .where(CitClienteRegistro.id.in_(cit_clientes_registros_ids))
+            .values(mensajes_cantidad=CitClienteRegistro.mensajes_cantidad + 1)
+        )
+
+
+def lanzar_enviar(cit_cliente_registro_id: int, to_email: str = None):
     """Lanzar tarea para enviar mensaje via email con un URL para confirmar su registro"""
 
     # Iniciar la tarea en el fondo
@@ -3,8 +3,10 @@ Cit Dias Inhábiles, formularios
 """
 
 from flask_wtf import FlaskForm
-from wtforms import DateField, StringField, SubmitField
-from wtforms.validators import DataRequired, Length
+from wtforms import DateField, SelectField, StringField, SubmitField
+from wtforms.validators import DataRequired, Length, Optional
+
+from lib.citas_afectadas import AFECTADAS_ACCIONES
 
 
 class CitDiaInhabilForm(FlaskForm):
@@ -12,4 +14,6 @@ class CitDiaInhabilForm(FlaskForm):
 
     fecha = DateField("Fecha", validators=[DataRequired()])
     descripcion = StringField("Descripción", validators=[DataRequired(), Length(max=256)])
+    afectadas = SelectField("Citas pendientes afectadas", choices=AFECTADAS_ACCIONES, validate_choice=False)
+    reagendar_fecha = DateField("Reagendar al día", validators=[Optional()])
     guardar = SubmitField("Guardar")
@@ -13,7 +13,16 @@ from citas_admin.blueprints.cit_dias_inhabiles.models import CitDiaInhabil
 from citas_admin.blueprints.modulos.models import Modulo
 from citas_admin.blueprints.permisos.models import Permiso
 from citas_admin.blueprints.usuarios.decorators import permission_required
+from lib.citas_afectadas import (
+    cancelar_afectadas,
+    condiciones_afectadas,
+    consultar_afectadas,
+    notificar_afectadas,
+    reagendar_afectadas,
+    revisar_reagendar,
+)
 from lib.datatables import get_datatable_parameters, output_datatable_json
+from lib.exceptions import MyNotValidParamError
 from lib.safe_string import safe_message, safe_string
 
 MODULO = "CIT DIAS INHABILES"
@@ -98,28 +107,53 @@ def detail(cit_dia_inhabil_id):
 def new():
     """Nuevo Dia Inhábil"""
     form = CitDiaInhabilForm()
+    afectadas = []
     if form.validate_on_submit():
         # Validar que la fecha no exista
         fecha = form.fecha.data
         if CitDiaInhabil.query.filter_by(fecha=fecha).first():
             flash(f"Ya se tiene {fecha} como un Día Inhábil", "warning")
-            return render_template("cit_dias_inhabiles/new.jinja2", form=form)
-        # Guardar
+            return render_template("cit_dias_inhabiles/new.jinja2", form=form, afectadas=afectadas)
+        # Revisar las citas pendientes de todas las oficinas en ese día, si las hay se muestran para elegir qué hacer
+        condiciones = condiciones_afectadas(fecha)
+        afectadas = consultar_afectadas(condiciones)
+        accion = form.afectadas.data
+        if afectadas and accion not in ("cancelar", "reagendar"):
+            flash(f"Hay {len(afectadas)} citas pendientes en este día, elija si se cancelan o se reagendan", "warning")
+            return render_template("cit_dias_inhabiles/new.jinja2", form=form, afectadas=afectadas)
+        if afectadas and accion == "reagendar":
+            try:
+                revisar_reagendar(condiciones, fecha, form.reagendar_fecha.data)
+            except MyNotValidParamError as error:
+                flash(str(error), "warning")
+                return render_template("cit_dias_inhabiles/new.jinja2", form=form, afectadas=afectadas)
+        # Cancelar o reagendar las citas y guardar en la misma transacción
+        cambios = []
+        fechas = [fecha]
+        if afectadas and accion == "cancelar":
+            cambios = cancelar_afectadas(condiciones)
+        elif afectadas and accion == "reagendar":
+            cambios = reagendar_afectadas(condiciones, fecha, form.reagendar_fecha.data)
+            fechas.append(form.reagendar_fecha.data)
         cit_dia_inhabil = CitDiaInhabil(
             fecha=fecha,
             descripcion=safe_string(form.descripcion.data, save_enie=True),
         )
         cit_dia_inhabil.save()
+        notificar_afectadas(cambios, accion, fechas)
+        descripcion = f"Nuevo Dia Inhábil {cit_dia_inhabil.fecha}"
+        if cambios:
+            descripcion += f" ({len(cambios)} citas {'canceladas' if accion == 'cancelar' else 'reagendadas'})"
         bitacora = Bitacora(
             modulo=Modulo.query.filter_by(nombre=MODULO).first(),
             usuario=current_user,
-            descripcion=safe_message(f"Nuevo Dia Inhábil {cit_dia_inhabil.fecha}"),
+            descripcion=safe_message(descripcion),
             url=url_for("cit_dias_inhabiles.detail", cit_dia_inhabil_id=cit_dia_inhabil.id),
         )
         bitacora.save()
         flash(bitacora.descripcion, "success")
         return redirect(bitacora.url)
-    return render_template("cit_dias_inhabiles/new.jinja2", form=form)
+    return render_template("cit_dias_inhabiles/new.jinja2", form=form, afectadas=afectadas)
 
 
 @cit_dias_inhabiles.route("/cit_dias_inhabiles/edicion/<int:cit_dia_inhabil_id>", methods=["GET", "POST"])
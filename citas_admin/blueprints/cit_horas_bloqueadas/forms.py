@@ -4,7 +4,9 @@ Cit Horas Bloqueadas, formularios
 
 from flask_wtf import FlaskForm
 from wtforms import DateField, SelectField, StringField, SubmitField, TimeField
-from wtforms.validators import DataRequired, Length
+from wtforms.validators import DataRequired, Length, Optional
+
+from lib.citas_afectadas import AFECTADAS_ACCIONES
 
 
 class CitHoraBloqueadaForm(FlaskForm):
@@ -15,6 +17,8 @@ class CitHoraBloqueadaForm(FlaskForm):
     inicio_tiempo = TimeField("Inicio", validators=[DataRequired()])
     termino_tiempo = TimeField("Término", validators=[DataRequired()])
     descripcion = StringField("Descripción", validators=[DataRequired(), Length(max=256)])
+    afectadas = SelectField("Citas pendientes afectadas", choices=AFECTADAS_ACCIONES, validate_choice=False)
+    reagendar_fecha = DateField("Reagendar al día", validators=[Optional()])
     guardar = SubmitField("Guardar")
 
 
@@ -26,4 +30,6 @@ class CitHoraBloqueadaAdminForm(FlaskForm):
     inicio_tiempo = TimeField("Inicio", validators=[DataRequired()])
     termino_tiempo = TimeField("Término", validators=[DataRequired()])
     descripcion = StringField("Descripción", validators=[DataRequired(), Length(max=256)])
+    afectadas = SelectField("Citas pendientes afectadas", choices=AFECTADAS_ACCIONES, validate_choice=False)
+    reagendar_fecha = DateField("Reagendar al día", validators=[Optional()])
     guardar = SubmitField("Guardar")
@@ -6,6 +6,7 @@ import json
 
 from flask import Blueprint, abort, flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
+from sqlalchemy.orm import joinedload
 
 from citas_admin.blueprints.bitacoras.models import Bitacora
 from citas_admin.blueprints.cit_horas_bloqueadas.forms import CitHoraBloqueadaAdminForm, CitHoraBloqueadaForm
@@ -14,7 +15,16 @@ from citas_admin.blueprints.modulos.models import Modulo
 from citas_admin.blueprints.oficinas.models import Oficina
 from citas_admin.blueprints.permisos.models import Permiso
 from citas_admin.blueprints.usuarios.decorators import permission_required
-from lib.datatables import get_datatable_parameters, output_datatable_json
+from lib.citas_afectadas import (
+    cancelar_afectadas,
+    condiciones_afectadas,
+    consultar_afectadas,
+    notificar_afectadas,
+    reagendar_afectadas,
+    revisar_reagendar,
+)
+from lib.datatables import get_datatable_parameters, output_datatable_json, paginate_datatable
+from lib.exceptions import MyNotValidParamError
 from lib.safe_string import safe_clave, safe_message, safe_string
 
 MODULO = "CIT HORAS BLOQUEADAS"
@@ -56,7 +66,7 @@ def datatable_json():
         if descripcion != "":
             consulta = consulta.filter(CitHoraBloqueada.descripcion.contains(descripcion))
     # Ordenar y paginar
-    registros = consulta.order_by(CitHoraBloqueada.id.desc()).offset(start).limit(rows_per_page).all()
+    registros, keyset = paginate_datatable(consulta, [CitHoraBloqueada.id], start, rows_per_page)
     total = consulta.count()
     # Elaborar datos para DataTable
     data = []
@@ -73,7 +83,7 @@ def datatable_json():
             }
         )
     # Entregar JSON
-    return output_datatable_json(draw, total, data)
+    return output_datatable_json(draw, total, data, keyset)
 
 
 @cit_horas_bloqueadas.route("/cit_horas_bloqueadas/admin_datatable_json", methods=["GET", "POST"])
@@ -103,7 +113,9 @@ def admin_datatable_json():
         if descripcion != "":
             consulta = consulta.filter(CitHoraBloqueada.descripcion.contains(descripcion))
     # Ordenar y paginar
-    registros = consulta.order_by(CitHoraBloqueada.id.desc()).offset(start).limit(rows_per_page).all()
+    registros, keyset = paginate_datatable(
+        consulta.options(joinedload(CitHoraBloqueada.oficina)), [CitHoraBloqueada.id], start, rows_per_page
+    )
     total = consulta.count()
     # Elaborar datos para DataTable
     data = []
@@ -126,7 +138,7 @@ def admin_datatable_json():
             }
         )
     # Entregar JSON
-    return output_datatable_json(draw, total, data)
+    return output_datatable_json(draw, total, data, keyset)
 
 
 @cit_horas_bloqueadas.route("/cit_horas_bloqueadas")
@@ -184,6 +196,7 @@ def new():
     else:
         form = CitHoraBloqueadaForm()
         oficina_id = current_user.oficina_id
+    afectadas = []
     # Si se recibe el formulario
     if form.validate_on_submit():
         es_valido = True
@@ -202,22 +215,46 @@ def new():
         # Si el tiempo de inicio es mayor que el tiempo de termino, vamos a intercambiarlos
         if inicio > termino:
             inicio, termino = termino, inicio
-        # Si es valido, insertar
+        # Revisar las citas pendientes que caen en el horario, si las hay se muestran para elegir qué hacer con ellas
+        fecha = form.fecha.data
+        condiciones = condiciones_afectadas(fecha, oficina_id, inicio, termino)
+        afectadas = consultar_afectadas(condiciones)
+        accion = form.afectadas.data
+        if es_valido and afectadas and accion not in ("cancelar", "reagendar"):
+            flash(f"Hay {len(afectadas)} citas pendientes en este horario, elija si se cancelan o se reagendan", "warning")
+            es_valido = False
+        if es_valido and afectadas and accion == "reagendar":
+            try:
+                revisar_reagendar(condiciones, fecha, form.reagendar_fecha.data)
+            except MyNotValidParamError as error:
+                flash(str(error), "warning")
+                es_valido = False
+        # Si es valido, cancelar o reagendar las citas e insertar en la misma transacción
         if es_valido:
+            cambios = []
+            fechas = [fecha]
+            if afectadas and accion == "cancelar":
+                cambios = cancelar_afectadas(condiciones)
+            elif afectadas and accion == "reagendar":
+                cambios = reagendar_afectadas(condiciones, fecha, form.reagendar_fecha.data)
+                fechas.append(form.reagendar_fecha.data)
             cit_hora_bloqueada = CitHoraBloqueada(
                 oficina_id=oficina_id,
-                fecha=form.fecha.data,
+                fecha=fecha,
                 inicio=inicio,
                 termino=termino,
                 descripcion=safe_string(form.descripcion.data, save_enie=True),
             )
             cit_hora_bloqueada.save()
+            notificar_afectadas(cambios, accion, fechas)
+            descripcion = f"Nueva Hora Bloqueada {cit_hora_bloqueada.fecha}"
+            descripcion += f" de {cit_hora_bloqueada.inicio} a {cit_hora_bloqueada.termino}"
+            if cambios:
+                descripcion += f" ({len(cambios)} citas {'canceladas' if accion == 'cancelar' else 'reagendadas'})"
             bitacora = Bitacora(
                 modulo=Modulo.query.filter_by(nombre=MODULO).first(),
                 usuario=current_user,
-                descripcion=safe_message(
-                    f"Nueva Hora Bloqueada {cit_hora_bloqueada.fecha} de {cit_hora_bloqueada.inicio} a {cit_hora_bloqueada.termino}"
-                ),
+                descripcion=safe_message(descripcion),
                 url=url_for("cit_horas_bloqueadas.detail", cit_hora_bloqueada_id=cit_hora_bloqueada.id),
             )
             bitacora.save()
@@ -232,12 +269,14 @@ def new():
                 oficina = Oficina.query.get(int(request.args.get("oficina_id")))
             except ValueError:
                 pass
+        elif oficina_id:
+            oficina = Oficina.query.get(oficina_id)  # Al mostrar las citas afectadas se conserva la oficina elegida
         else:
             oficina = Oficina.query.filter_by(clave="ND").first()  # De lo contrario, se va a tomar la oficina 'ND'
-        return render_template("cit_horas_bloqueadas/new_admin.jinja2", form=form, oficina=oficina)
+        return render_template("cit_horas_bloqueadas/new_admin.jinja2", form=form, oficina=oficina, afectadas=afectadas)
     # No es administrador
     form.oficina.data = current_user.oficina.clave + ": " + current_user.oficina.descripcion
-    return render_template("cit_horas_bloqueadas/new.jinja2", form=form)
+    return render_template("cit_horas_bloqueadas/new.jinja2", form=form, afectadas=afectadas)
 
 
 @cit_horas_bloqueadas.route("/cit_horas_bloqueadas/edicion/<int:cit_hora_bloqueada_id>", methods=["GET", "POST"])
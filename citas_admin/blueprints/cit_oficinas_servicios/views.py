@@ -6,6 +6,7 @@ import json
 
 from flask import Blueprint, flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
+from sqlalchemy.orm import joinedload
 
 from citas_admin.blueprints.bitacoras.models import Bitacora
 from citas_admin.blueprints.cit_oficinas_servicios.forms import (
@@ -77,7 +78,13 @@ def datatable_json():
         if cit_servicio_descripcion != "":
             consulta = consulta.filter(CitServicio.descripcion.contains(cit_servicio_descripcion))
     # Ordenar y paginar
-    registros = consulta.order_by(CitOficinaServicio.id).offset(start).limit(rows_per_page).all()
+    registros = (
+        consulta.options(joinedload(CitOficinaServicio.cit_servicio), joinedload(CitOficinaServicio.oficina))
+        .order_by(CitOficinaServicio.id)
+        .offset(start)
+        .limit(rows_per_page)
+        .all()
+    )
     total = consulta.count()
     # Elaborar datos para DataTable
     data = []
@@ -36,6 +36,7 @@ class CitServicio(database.Model, UniversalMixin):
 
     # Hijos
     cit_citas: Mapped[List["CitCita"]] = relationship(back_populates="cit_servicio")
+    cit_citas_diarias: Mapped[List["CitCitaDiaria"]] = relationship(back_populates="cit_servicio")
     cit_oficinas_servicios: Mapped[List["CitOficinaServicio"]] = relationship(back_populates="cit_servicio")
 
     def __repr__(self):
@@ -6,6 +6,7 @@ import json
 
 from flask import Blueprint, flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
+from sqlalchemy.orm import joinedload
 
 from citas_admin.blueprints.bitacoras.models import Bitacora
 from citas_admin.blueprints.cit_servicios.forms import CitServicioForm
@@ -64,7 +65,13 @@ def datatable_json():
         if descripcion != "":
             consulta = consulta.filter(CitServicio.descripcion.contains(descripcion))
     # Ordenar y paginar
-    registros = consulta.order_by(CitServicio.clave).offset(start).limit(rows_per_page).all()
+    registros = (
+        consulta.options(joinedload(CitServicio.cit_categoria))
+        .order_by(CitServicio.clave)
+        .offset(start)
+        .limit(rows_per_page)
+        .all()
+    )
     total = consulta.count()
     # Elaborar datos para DataTable
     data = []
@@ -6,12 +6,13 @@ import json
 
 from flask import Blueprint, render_template, request, url_for
 from flask_login import login_required
+from sqlalchemy.orm import joinedload
 
 from citas_admin.blueprints.entradas_salidas.models import EntradaSalida
 from citas_admin.blueprints.permisos.models import Permiso
 from citas_admin.blueprints.usuarios.decorators import permission_required
 from citas_admin.blueprints.usuarios.models import Usuario
-from lib.datatables import get_datatable_parameters, output_datatable_json
+from lib.datatables import count_datatable, get_datatable_parameters, output_datatable_json, paginate_datatable
 from lib.safe_string import safe_email
 
 MODULO = "ENTRADAS SALIDAS"
@@ -45,8 +46,10 @@ def datatable_json():
         except ValueError:
             pass
     # Ordenar y paginar
-    registros = consulta.order_by(EntradaSalida.id.desc()).offset(start).limit(rows_per_page).all()
-    total = consulta.count()
+    registros, keyset = paginate_datatable(
+        consulta.options(joinedload(EntradaSalida.usuario)), [EntradaSalida.id], start, rows_per_page
+    )
+    total, estimado = count_datatable(consulta)
     # Elaborar datos para DataTable
     data = []
     for resultado in registros:
@@ -61,7 +64,7 @@ def datatable_json():
             }
         )
     # Entregar JSON
-    return output_datatable_json(draw, total, data)
+    return output_datatable_json(draw, total, data, keyset, estimado)
 
 
 @entradas_salidas.route("/entradas_salidas")
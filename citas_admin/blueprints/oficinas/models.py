@@ -40,6 +40,7 @@ class Oficina(database.Model, UniversalMixin):
 
     # Hijos
     cit_citas: Mapped[List["CitCita"]] = relationship("CitCita", back_populates="oficina")
+    cit_citas_diarias: Mapped[List["CitCitaDiaria"]] = relationship("CitCitaDiaria", back_populates="oficina")
     cit_horas_bloqueadas: Mapped[List["CitHoraBloqueada"]] = relationship("CitHoraBloqueada", back_populates="oficina")
     cit_oficinas_servicios: Mapped[List["CitOficinaServicio"]] = relationship("CitOficinaServicio", back_populates="oficina")
     usuarios: Mapped[List["Usuario"]] = relationship("Usuario", back_populates="oficina")
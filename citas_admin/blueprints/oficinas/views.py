@@ -3,10 +3,12 @@ Oficinas, vistas
 """
 
 import json
+from datetime import date
 
 from flask import Blueprint, flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
 from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
 
 from citas_admin.blueprints.bitacoras.models import Bitacora
 from citas_admin.blueprints.modulos.models import Modulo
@@ -15,6 +17,7 @@ from citas_admin.blueprints.oficinas.models import Oficina
 from citas_admin.blueprints.permisos.models import Permiso
 from citas_admin.blueprints.usuarios.decorators import permission_required
 from lib.datatables import get_datatable_parameters, output_datatable_json
+from lib.disponibilidad import horarios_disponibles
 from lib.safe_string import safe_clave, safe_message, safe_string
 
 MODULO = "OFICINAS"
@@ -57,7 +60,13 @@ def datatable_json():
         if descripcion_corta != "":
             consulta = consulta.filter(Oficina.descripcion_corta.contains(descripcion_corta))
     # Ordenar y paginar
-    registros = consulta.order_by(Oficina.clave).offset(start).limit(rows_per_page).all()
+    registros = (
+        consulta.options(joinedload(Oficina.distrito), joinedload(Oficina.domicilio))
+        .order_by(Oficina.clave)
+        .offset(start)
+        .limit(rows_per_page)
+        .all()
+    )
     total = consulta.count()
     # Elaborar datos para DataTable
     data = []
@@ -257,3 +266,20 @@ def query_oficinas_json():
     for oficina in consulta.order_by(Oficina.clave).limit(20).all():
         resultados.append({"id": oficina.id, "text": f"{oficina.clave} - {oficina.descripcion_corta}"})
     return {"results": resultados, "pagination": {"more": False}}
+
+
+@oficinas.route("/oficinas/disponibilidad_json", methods=["POST"])
+def query_disponibilidad_json():
+    """Proporcionar el JSON de los horarios disponibles de un servicio en una oficina en una fecha"""
+    try:
+        oficina_id = int(request.form["oficina_id"])
+        cit_servicio_id = int(request.form["cit_servicio_id"])
+        fecha = date.fromisoformat(request.form["fecha"])
+    except (KeyError, ValueError):
+        return {"success": False, "message": "Parámetros inválidos", "horarios": []}
+    horarios = horarios_disponibles(oficina_id, cit_servicio_id, fecha)
+    return {
+        "success": True,
+        "message": f"{len(horarios)} horarios disponibles",
+        "horarios": [horario.strftime("%H:%M") for horario in horarios],
+    }
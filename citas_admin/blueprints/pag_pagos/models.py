@@ -5,7 +5,7 @@ Pag Pagos, modelos
 from datetime import date, datetime
 from typing import Optional
 
-from sqlalchemy import Date, Enum, ForeignKey, Numeric, String, Text
+from sqlalchemy import Date, Enum, ForeignKey, Index, Numeric, String, Text, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from citas_admin.extensions import database
@@ -26,6 +26,16 @@ class PagPago(database.Model, UniversalMixin):
     # Nombre de la tabla
     __tablename__ = "pag_pagos"
 
+    # Índice parcial para cancelar los SOLICITADOS con caducidad vencida, sólo contiene los pagos en espera
+    __table_args__ = (
+        Index(
+            "pag_pagos_solicitados_caducidad",
+            "estado",
+            "caducidad",
+            postgresql_where=text("estado = 'SOLICITADO'"),
+        ),
+    )
+
     # Clave primaria
     id: Mapped[int] = mapped_column(primary_key=True)
 
@@ -1,37 +1,77 @@
 """
 Pag Pagos, tareas en el fondo
+
+- exportar_xlsx: Exportar Pagos PAGADOS y ENTREGADOS a un archivo XLSX
+- cancelar_solicitados_expirados: Cancelar con un solo UPDATE los pagos SOLICITADOS con la caducidad vencida
+- enviar_comprobantes: Enviar los comprobantes de los pagos PAGADOS que no se han enviado, por lotes
+- conciliar: Comparar resultado_xml con el estado, el folio y el total de los pagos, las diferencias van a un reporte
+
+Para conciliar se traen los pagos por lotes con un cursor del lado del servidor, cada lote se descifra y analiza en otro
+proceso y a lo más CONCILIAR_EN_VUELO lotes por proceso esperan a la vez, así la memoria no crece con el rango de fechas.
+
+Para enviar los comprobantes cada lote de COMPROBANTES_LOTE pagos se toma con SELECT ... FOR UPDATE SKIP LOCKED, se
+envía y se marca ya_se_envio_comprobante con un solo UPDATE antes de confirmar. Así varias tareas pueden enviar a la vez
+sin repetir pagos. Los que fallan se quedan sin marcar para la siguiente vez.
 """
 
 import logging
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import date, datetime, timedelta
-from pathlib import Path
+from itertools import islice
 
 import pytz
-from openpyxl import Workbook
-from sqlalchemy import or_
+from sqlalchemy import String, insert, or_, update
+from sqlalchemy.orm import joinedload
 
 from citas_admin.app import create_app
 from citas_admin.blueprints.autoridades.models import Autoridad
+from citas_admin.blueprints.bitacoras.models import Bitacora
 from citas_admin.blueprints.cit_clientes.models import CitCliente
 from citas_admin.blueprints.distritos.models import Distrito
+from citas_admin.blueprints.modulos.models import Modulo
 from citas_admin.blueprints.pag_pagos.models import PagPago
+from citas_admin.blueprints.usuarios.models import Usuario
 from citas_admin.extensions import database
-from config.settings import get_settings
+from lib.conciliar_pagos import CONCILIAR_CABECERAS, comparar_lote
 from lib.exceptions import (
     MyAnyError,
     MyBucketNotFoundError,
     MyEmptyError,
     MyFileNotAllowedError,
     MyFileNotFoundError,
+    MyNotExistsError,
+    MyNotValidParamError,
     MyUploadError,
 )
-from lib.google_cloud_storage import upload_file_to_gcs
-from lib.tasks import set_task_error, set_task_progress
+from lib.exports import (
+    FORMATOS,
+    XLSX_CONTENT_TYPE,
+    column_types,
+    export_paths,
+    stream_rows,
+    upload_export,
+    write_export,
+    write_xlsx,
+)
+from lib.mailer import get_template, is_configured, send_each
+from lib.tasks import TaskProgress, set_task_error, set_task_progress
 
 # Constantes
 GCS_BASE_DIRECTORY = "pag_pagos"
+MODULO = "PAG PAGOS"
 LOCAL_BASE_DIRECTORY = "exports/pag_pagos"
 TIMEZONE = "America/Mexico_City"
+CONCILIAR_DIAS = 365  # Días hacia atrás que se concilian por defecto
+CONCILIAR_EN_VUELO = 2  # Lotes por proceso que pueden esperar a la vez
+CONCILIAR_LOTE = 1000  # Pagos por lote
+CONCILIAR_PROCESOS = max(1, min(4, os.cpu_count() or 1))
+COMPROBANTES_HILOS = 8  # Hilos que envían mensajes a la vez
+COMPROBANTES_LOTE = 100  # Pagos que se toman y se marcan por transacción
+COMPROBANTES_POR_SEGUNDO = 20  # Límite de mensajes por segundo
+JINJA2_TEMPLATES_DIR = "citas_admin/blueprints/pag_pagos/templates/pag_pagos"
 
 # Bitácora logs/pag_pagos.log
 bitacora = logging.getLogger(__name__)
@@ -78,9 +118,23 @@ def exportar_xlsx(desde: date = None, hasta: date = None) -> tuple[str, str, str
     bitacora.info(mensaje)
     mensajes.append(mensaje)
 
-    # Consultar los pagos
+    # Consultar sólo las columnas que se exportan, con sus relaciones en la misma consulta
     pag_pagos = (
-        PagPago.query.join(Autoridad, Autoridad.id == PagPago.autoridad_id)
+        PagPago.query.with_entities(
+            PagPago.creado,
+            Distrito.nombre_corto,
+            Autoridad.descripcion_corta,
+            CitCliente.nombres,
+            CitCliente.apellido_primero,
+            CitCliente.apellido_segundo,
+            CitCliente.curp,
+            CitCliente.email,
+            CitCliente.telefono,
+            PagPago.estado,
+            PagPago.folio,
+            PagPago.total,
+        )
+        .join(Autoridad, Autoridad.id == PagPago.autoridad_id)
         .join(Distrito, Distrito.id == Autoridad.distrito_id)
         .join(CitCliente, CitCliente.id == PagPago.cit_cliente_id)
         .filter(PagPago.estatus == "A")
@@ -90,95 +144,51 @@ def exportar_xlsx(desde: date = None, hasta: date = None) -> tuple[str, str, str
         .order_by(PagPago.creado)
     )
 
-    # Iniciar el archivo XLSX
-    libro = Workbook()
-
-    # Tomar la hoja del libro XLSX
-    hoja = libro.active
-
-    # Agregar la fila con las cabeceras de las columnas
-    hoja.append(
-        [
-            "CREADO",
-            "DISTRITO",
-            "AUTORIDAD",
-            "NOMBRES",
-            "APELLIDO PRIMERO",
-            "APELLIDO SEGUNDO",
-            "CURP",
-            "EMAIL",
-            "TELEFONO",
-            "ESTADO",
-            "FOLIO",
-            "TOTAL",
-        ]
-    )
+    # Determinar el nombre del archivo XLSX y las rutas con directorios con el año y el número de mes en dos digitos
+    desde_str = desde.strftime("%Y-%m-%d")
+    hasta_str = hasta.strftime("%Y-%m-%d")
+    momento_str = hoy.strftime("%Y-%m-%d_%H%M%S")
+    nombre_archivo_xlsx = f"pagos_{desde_str}_{hasta_str}_{momento_str}.xlsx"
+    ruta_local_archivo_xlsx, ruta_gcs_archivo_xlsx = export_paths(LOCAL_BASE_DIRECTORY, GCS_BASE_DIRECTORY, nombre_archivo_xlsx)
 
-    # Bucle por los pagos para agregar las filas
-    contador = 0
-    for pago in pag_pagos:
-        hoja.append(
+    # Escribir el archivo XLSX conforme se traen los pagos por lotes
+    with TaskProgress(0, "Exportando Pagos PAGADOS y ENTREGADOS") as progreso:
+        contador = write_xlsx(
+            ruta_local_archivo_xlsx,
             [
-                pago.creado,
-                pago.autoridad.distrito.nombre_corto,
-                pago.autoridad.descripcion_corta,
-                pago.cit_cliente.nombres,
-                pago.cit_cliente.apellido_primero,
-                pago.cit_cliente.apellido_segundo,
-                pago.cit_cliente.curp,
-                pago.cit_cliente.email,
-                pago.cit_cliente.telefono,
-                pago.estado,
-                pago.folio,
-                pago.total,
-            ]
+                "CREADO",
+                "DISTRITO",
+                "AUTORIDAD",
+                "NOMBRES",
+                "APELLIDO PRIMERO",
+                "APELLIDO SEGUNDO",
+                "CURP",
+                "EMAIL",
+                "TELEFONO",
+                "ESTADO",
+                "FOLIO",
+                "TOTAL",
+            ],
+            progreso.iterate(stream_rows(pag_pagos)),
         )
-        contador += 1
 
     # Agregar a mensajes la cantidad de pagos exportados
     mensaje = f"Se exportaron {contador} Pagos PAGADOS y ENTREGADOS"
     bitacora.info(mensaje)
     mensajes.append(mensaje)
 
-    # Determinar el nombre del archivo XLSX
-    desde_str = desde.strftime("%Y-%m-%d")
-    hasta_str = hasta.strftime("%Y-%m-%d")
-    momento_str = hoy.strftime("%Y-%m-%d_%H%M%S")
-    ahora = datetime.now(tz=pytz.timezone(TIMEZONE))
-    nombre_archivo_xlsx = f"pagos_{desde_str}_{hasta_str}_{momento_str}.xlsx"
-
-    # Determinar las rutas con directorios con el año y el número de mes en dos digitos
-    ruta_local = Path(LOCAL_BASE_DIRECTORY, ahora.strftime("%Y"), ahora.strftime("%m"))
-    ruta_gcs = Path(GCS_BASE_DIRECTORY, ahora.strftime("%Y"), ahora.strftime("%m"))
-
-    # Si no existe el directorio local, crearlo
-    Path(ruta_local).mkdir(parents=True, exist_ok=True)
-
-    # Guardar el archivo XLSX
-    ruta_local_archivo_xlsx = str(Path(ruta_local, nombre_archivo_xlsx))
-    libro.save(ruta_local_archivo_xlsx)
-
-    # Si esta configurado Google Cloud Storage
+    # Si esta configurado Google Cloud Storage, subir el archivo XLSX por partes
     public_url = ""
-    settings = get_settings()
-    if settings.CLOUD_STORAGE_DEPOSITO != "":
-        # Leer el contenido del archivo XLSX
-        with open(ruta_local_archivo_xlsx, "rb") as archivo:
-            # Subir el archivo XLSX a Google Cloud Storage
-            try:
-                public_url = upload_file_to_gcs(
-                    bucket_name=settings.CLOUD_STORAGE_DEPOSITO,
-                    blob_name=f"{ruta_gcs}/{nombre_archivo_xlsx}",
-                    content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    data=archivo.read(),
-                )
-                mensaje = f"Se subió el archivo {nombre_archivo_xlsx} a GCS"
-                bitacora.info(mensaje)
-                mensajes.append(mensaje)
-            except (MyEmptyError, MyBucketNotFoundError, MyFileNotAllowedError, MyFileNotFoundError, MyUploadError) as error:
-                mensaje = f"Falló el subir el archivo XLSX a GCS: {str(error)}"
-                bitacora.warning(mensaje)
-                mensajes.append(mensaje)
+    try:
+        public_url = upload_export(ruta_local_archivo_xlsx, ruta_gcs_archivo_xlsx, XLSX_CONTENT_TYPE)
+        if public_url != "":
+            mensaje = f"Se subió el archivo {nombre_archivo_xlsx} a GCS"
+            bitacora.info(mensaje)
+            mensajes.append(mensaje)
+    except (MyEmptyError, MyBucketNotFoundError, MyFileNotAllowedError, MyFileNotFoundError, MyUploadError) as error:
+        mensaje = f"Falló el subir el archivo XLSX a GCS: {str(error)}"
+        bitacora.warning(mensaje)
+        mensajes.append(mensaje)
 
     # Entregar mensaje de termino, el nombre del archivo XLSX y la URL publica
     mensaje_termino = "\n".join(mensajes)
@@ -202,3 +212,270 @@ def lanzar_exportar_xlsx():
     # Terminar la tarea en el fondo y entregar el mensaje de termino
     set_task_progress(100, mensaje_termino, nombre_archivo_xlsx, public_url)
     return mensaje_termino
+
+
+def cancelar_solicitados_expirados(usuario_id: int) -> str:
+    """Cancelar los pagos SOLICITADOS cuya caducidad ya pasó, con un solo UPDATE que usa el índice parcial"""
+
+    # Agregar mensaje de inicio
+    bitacora.info("Inicia cancelar los pagos SOLICITADOS con la caducidad vencida")
+
+    # Validar el usuario y el módulo para la bitácora
+    usuario = Usuario.query.get(usuario_id)
+    if usuario is None:
+        mensaje = f"El usuario con ID {usuario_id} no existe"
+        bitacora.error(mensaje)
+        raise MyNotExistsError(mensaje)
+    modulo = Modulo.query.filter_by(nombre=MODULO).first()
+    if modulo is None:
+        mensaje = f"No existe el módulo {MODULO}"
+        bitacora.error(mensaje)
+        raise MyNotExistsError(mensaje)
+
+    # Los pagos que caducaron antes de hoy, con la fecha local
+    hoy = datetime.now(tz=pytz.timezone(TIMEZONE)).date()
+
+    # Cambiar el estado y escribir el resumen en la bitácora en la misma transacción
+    with database.engine.begin() as conexion:
+        cancelados = (
+            conexion.execute(
+                update(PagPago)
+                .where(PagPago.estado == "SOLICITADO")
+                .where(PagPago.caducidad < hoy)
+                .where(PagPago.estatus == "A")
+                .values(estado="CANCELADO")
+                .returning(PagPago.id)
+            )
+            .scalars()
+            .all()
+        )
+        if len(cancelados) > 0:
+            conexion.execute(
+                insert(Bitacora).values(
+                    modulo_id=modulo.id,
+                    usuario_id=usuario.id,
+                    descripcion=f"Se cancelaron {len(cancelados)} pagos SOLICITADOS con caducidad antes del {hoy}",
+                    url="/pag_pagos",
+                )
+            )
+
+    # Entregar mensaje de término
+    if len(cancelados) == 0:
+        mensaje = f"No hay pagos SOLICITADOS con caducidad antes del {hoy}"
+    else:
+        mensaje = f"Se cancelaron {len(cancelados)} pagos SOLICITADOS con caducidad antes del {hoy}"
+    bitacora.info(mensaje)
+    return mensaje
+
+
+def enviar_comprobantes(lote: int = COMPROBANTES_LOTE) -> str:
+    """Enviar los comprobantes de los pagos PAGADOS que no se han enviado, por lotes que se bloquean con SKIP LOCKED"""
+
+    # Agregar mensaje de inicio
+    bitacora.info("Inicia enviar comprobantes de pagos")
+
+    # Validar que esté configurado el envío de mensajes
+    if not is_configured():
+        mensaje = "No está configurado el envío de mensajes"
+        bitacora.error(mensaje)
+        raise MyNotExistsError(mensaje)
+
+    # Cargar la plantilla una sola vez
+    plantilla = get_template(JINJA2_TEMPLATES_DIR, "email_paid.jinja2")
+    asunto_str = "PJECZ Sistema de Citas: Comprobante de pago"
+    fecha_elaboracion = datetime.now().strftime("%d/%b/%Y %I:%M %p")
+
+    # Consulta de los pagos por enviar con lo que necesita la plantilla, sólo se bloquean los renglones de pag_pagos
+    consulta = (
+        PagPago.query.options(
+            joinedload(PagPago.autoridad, innerjoin=True).joinedload(Autoridad.distrito, innerjoin=True),
+            joinedload(PagPago.cit_cliente, innerjoin=True),
+            joinedload(PagPago.pag_tramite_servicio, innerjoin=True),
+        )
+        .filter(PagPago.estado == "PAGADO")
+        .filter(PagPago.ya_se_envio_comprobante.is_(False))
+        .filter(PagPago.estatus == "A")
+    )
+
+    # Tomar, enviar y marcar lote por lote, con los mismos hilos para conservar sus conexiones
+    enviados = fallidos = 0
+    ultimo_id = 0
+    with TaskProgress(0, "Enviando comprobantes") as progreso, ThreadPoolExecutor(COMPROBANTES_HILOS) as ejecutor:
+        while True:
+            # Cada lote se elabora de nuevo, el filtro va antes del orden, el límite y el bloqueo
+            pag_pagos = (
+                consulta.filter(PagPago.id > ultimo_id)
+                .order_by(PagPago.id)
+                .limit(lote)
+                .with_for_update(skip_locked=True, of=PagPago)
+                .all()
+            )
+            if len(pag_pagos) == 0:
+                database.session.rollback()
+                break
+            ultimo_id = pag_pagos[-1].id
+            mensajes = (
+                (
+                    pag_pago.id,
+                    pag_pago.email or pag_pago.cit_cliente.email,
+                    asunto_str,
+                    plantilla.render(pag_pago=pag_pago, fecha_elaboracion=fecha_elaboracion),
+                )
+                for pag_pago in pag_pagos
+            )
+            marcar = []
+            for pag_pago_id, error in send_each(
+                mensajes, hilos=COMPROBANTES_HILOS, por_segundo=COMPROBANTES_POR_SEGUNDO, ejecutor=ejecutor
+            ):
+                if error is not None:
+                    bitacora.warning("Pago %d: %s", pag_pago_id, error)
+                    fallidos += 1
+                    continue
+                marcar.append(pag_pago_id)
+            if len(marcar) > 0:
+                database.session.execute(
+                    update(PagPago)
+                    .where(PagPago.id.in_(marcar))
+                    .values(ya_se_envio_comprobante=True)
+                    .execution_options(synchronize_session=False)
+                )
+            database.session.commit()  # Confirmar libera los renglones bloqueados del lote
+            enviados += len(marcar)
+            progreso.advance(len(pag_pagos))
+
+    # Entregar mensaje de término
+    mensaje = f"Se enviaron {enviados} comprobantes de pago"
+    if fallidos > 0:
+        mensaje += f", fallaron {fallidos} que se intentarán la siguiente vez"
+    bitacora.info(mensaje)
+    return mensaje
+
+
+def lanzar_enviar_comprobantes():
+    """Lanzar tarea para enviar los comprobantes de pago"""
+
+    # Iniciar la tarea en el fondo
+    set_task_progress(0, "Inicia enviar comprobantes de pago")
+
+    # Ejecutar
+    try:
+        mensaje_termino = enviar_comprobantes()
+    except MyAnyError as error:
+        mensaje_error = str(error)
+        set_task_error(mensaje_error)
+        return mensaje_error
+
+    # Terminar la tarea en el fondo y entregar el mensaje de termino
+    set_task_progress(100, mensaje_termino)
+    return mensaje_termino
+
+
+def conciliar(desde: date = None, hasta: date = None, formato: str = "xlsx", procesos: int = CONCILIAR_PROCESOS):
+    """Conciliar los pagos con resultado_xml contra el estado, el folio y el total, entrega un reporte de diferencias"""
+
+    # Iniciar listado con los mensajes
+    mensajes = []
+
+    # Validar el formato y el rango de fechas, por defecto el último año
+    if formato not in FORMATOS:
+        mensaje = f"El formato {formato} no es válido"
+        bitacora.error(mensaje)
+        raise MyNotValidParamError(mensaje)
+    content_type, _ = FORMATOS[formato]
+    hoy = datetime.now(pytz.timezone(TIMEZONE))
+    if hasta is None:
+        hasta = hoy.date()
+    if desde is None:
+        desde = hasta - timedelta(days=CONCILIAR_DIAS)
+    if desde > hasta:
+        raise MyNotValidParamError("La fecha desde debe ser anterior a la fecha hasta")
+    procesos = max(1, procesos)
+
+    # Consultar sólo las columnas que se comparan, ordenadas por id para que el reporte salga en orden
+    consulta = (
+        PagPago.query.with_entities(PagPago.id, PagPago.estado, PagPago.folio, PagPago.total, PagPago.resultado_xml)
+        .filter(PagPago.estatus == "A")
+        .filter(PagPago.resultado_xml.isnot(None))
+        .filter(PagPago.creado >= datetime.combine(desde, datetime.min.time()))
+        .filter(PagPago.creado < datetime.combine(hasta + timedelta(days=1), datetime.min.time()))
+    )
+    total = consulta.count()
+    mensaje = f"Inicia conciliar {total} Pagos desde {desde} hasta {hasta} con {procesos} procesos"
+    bitacora.info(mensaje)
+    mensajes.append(mensaje)
+
+    # Determinar el nombre del archivo y las rutas
+    momento_str = hoy.strftime("%Y-%m-%d_%H%M%S")
+    nombre_archivo = f"conciliacion_{desde}_{hasta}_{momento_str}.{formato}"
+    ruta_local_archivo, ruta_gcs_archivo = export_paths(LOCAL_BASE_DIRECTORY, GCS_BASE_DIRECTORY, nombre_archivo)
+
+    # Escribir las diferencias conforme terminan los lotes
+    with TaskProgress(total, "Conciliando Pagos") as progreso:
+        contador = write_export(
+            formato,
+            ruta_local_archivo,
+            CONCILIAR_CABECERAS,
+            _conciliar_lotes(consulta.order_by(PagPago.id), procesos, progreso),
+            column_types(consulta)[:4] + [String()] * 4,  # ID, ESTADO, FOLIO y TOTAL como en pag_pagos, lo demás es texto
+        )
+
+    # Agregar a mensajes la cantidad de pagos revisados y con diferencias
+    mensaje = f"Se revisaron {progreso.cantidad} Pagos, {contador} tienen diferencias"
+    bitacora.info(mensaje)
+    mensajes.append(mensaje)
+
+    # Si esta configurado Google Cloud Storage, subir el archivo por partes
+    public_url = ""
+    try:
+        public_url = upload_export(ruta_local_archivo, ruta_gcs_archivo, content_type)
+        if public_url != "":
+            mensaje = f"Se subió el archivo {nombre_archivo} a GCS"
+            bitacora.info(mensaje)
+            mensajes.append(mensaje)
+    except (MyEmptyError, MyBucketNotFoundError, MyFileNotAllowedError, MyFileNotFoundError, MyUploadError) as error:
+        mensaje = f"Falló el subir el archivo a GCS: {str(error)}"
+        bitacora.warning(mensaje)
+        mensajes.append(mensaje)
+
+    # Entregar mensaje de termino, el nombre del archivo y la URL publica
+    mensaje_termino = "\n".join(mensajes)
+    return mensaje_termino, nombre_archivo, public_url
+
+
+def _conciliar_lotes(consulta, procesos: int, progreso: TaskProgress):
+    """Comparar los lotes en otros procesos, entrega las diferencias en el orden de la consulta"""
+    renglones = (tuple(renglon) for renglon in stream_rows(consulta, CONCILIAR_LOTE))
+    lotes = iter(lambda: list(islice(renglones, CONCILIAR_LOTE)), [])
+    # Se usa spawn porque aquí ya están abiertas las conexiones de SQLAlchemy y Redis, al hacer fork los procesos las
+    # compartirían y no es seguro; con spawn empiezan sin ellas, sea desde la tarea o desde el CLI
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context("spawn")) as ejecutor:
+        pendientes = deque()
+        for lote in lotes:
+            pendientes.append(ejecutor.submit(comparar_lote, lote))
+            if len(pendientes) >= procesos * CONCILIAR_EN_VUELO:
+                revisados, diferencias = pendientes.popleft().result()
+                progreso.advance(revisados)
+                yield from diferencias
+        while pendientes:
+            revisados, diferencias = pendientes.popleft().result()
+            progreso.advance(revisados)
+            yield from diferencias
+
+
+def lanzar_conciliar(desde: date = None, hasta: date = None, formato: str = "xlsx"):
+    """Lanzar tarea para conciliar los Pagos con las respuestas del banco"""
+
+    # Iniciar la tarea en el fondo
+    set_task_progress(0, "Inicia conciliar Pagos")
+
+    # Ejecutar
+    try:
+        mensaje_termino, nombre_archivo, public_url = conciliar(desde, hasta, formato)
+    except MyAnyError as error:
+        mensaje_error = str(error)
+        set_task_error(mensaje_error)
+        return mensaje_error
+
+    # Terminar la tarea en el fondo y entregar el mensaje de termino
+    set_task_progress(100, mensaje_termino, nombre_archivo, public_url)
+    return mensaje_termino
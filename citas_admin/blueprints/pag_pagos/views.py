@@ -4,22 +4,57 @@ Pag Pagos, vistas
 
 import json
 import re
-from datetime import datetime
+from datetime import date, datetime
 
 from flask import Blueprint, flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
+from sqlalchemy.orm import aliased
 
+from citas_admin.blueprints.autoridades.models import Autoridad
 from citas_admin.blueprints.bitacoras.models import Bitacora
 from citas_admin.blueprints.cit_clientes.models import CitCliente
+from citas_admin.blueprints.distritos.models import Distrito
 from citas_admin.blueprints.modulos.models import Modulo
 from citas_admin.blueprints.pag_pagos.models import PagPago
 from citas_admin.blueprints.pag_tramites_servicios.models import PagTramiteServicio
 from citas_admin.blueprints.permisos.models import Permiso
 from citas_admin.blueprints.usuarios.decorators import permission_required
-from lib.datatables import get_datatable_parameters, output_datatable_json
+from lib.datatables import get_datatable_parameters, output_datatable_json, paginate_datatable, url_template
+from lib.exports import FORMATOS
 from lib.safe_string import safe_message, safe_string
 
 MODULO = "PAG PAGOS"
+# Columnas que entrega el listado, se consultan como tuplas en lugar de cargar las entidades completas
+DATATABLE_AUTORIDAD = aliased(Autoridad)
+DATATABLE_CIT_CLIENTE = aliased(CitCliente)
+DATATABLE_DISTRITO = aliased(Distrito)
+DATATABLE_PAG_TRAMITE_SERVICIO = aliased(PagTramiteServicio)
+DATATABLE_COLUMNS = [
+    PagPago.id,
+    PagPago.creado,
+    PagPago.cantidad,
+    PagPago.folio,
+    PagPago.total,
+    PagPago.estado,
+    PagPago.cit_cliente_id,
+    (
+        DATATABLE_CIT_CLIENTE.nombres
+        + " "
+        + DATATABLE_CIT_CLIENTE.apellido_primero
+        + " "
+        + DATATABLE_CIT_CLIENTE.apellido_segundo
+    ).label("cit_cliente_nombre"),
+    DATATABLE_CIT_CLIENTE.email.label("cit_cliente_email"),
+    PagPago.pag_tramite_servicio_id,
+    DATATABLE_PAG_TRAMITE_SERVICIO.clave.label("pag_tramite_servicio_clave"),
+    DATATABLE_PAG_TRAMITE_SERVICIO.descripcion.label("pag_tramite_servicio_descripcion"),
+    PagPago.distrito_id,
+    DATATABLE_DISTRITO.clave.label("distrito_clave"),
+    DATATABLE_DISTRITO.nombre_corto.label("distrito_nombre_corto"),
+    PagPago.autoridad_id,
+    DATATABLE_AUTORIDAD.clave.label("autoridad_clave"),
+    DATATABLE_AUTORIDAD.descripcion_corta.label("autoridad_descripcion_corta"),
+]
 
 pag_pagos = Blueprint("pag_pagos", __name__, template_folder="templates")
 
@@ -67,9 +102,26 @@ def datatable_json():
             consulta = consulta.filter(PagPago.fecha >= fecha_desde)
         if fecha_hasta:
             consulta = consulta.filter(PagPago.fecha <= fecha_hasta)
-    # Ordenar y paginar
-    registros = consulta.order_by(PagPago.id.desc()).offset(start).limit(rows_per_page).all()
+    # Ordenar y paginar, consultando sólo las columnas que se van a entregar
+    consulta_columnas = (
+        consulta.with_entities(*DATATABLE_COLUMNS)
+        .join(DATATABLE_CIT_CLIENTE, PagPago.cit_cliente)
+        .join(DATATABLE_PAG_TRAMITE_SERVICIO, PagPago.pag_tramite_servicio)
+        .join(DATATABLE_DISTRITO, PagPago.distrito)
+        .join(DATATABLE_AUTORIDAD, PagPago.autoridad)
+    )
+    registros, keyset = paginate_datatable(consulta_columnas, [PagPago.id], start, rows_per_page)
     total = consulta.count()
+    # Elaborar las plantillas de los URL una sola vez, en lugar de usar url_for en cada fila
+    detalle_url = url_template("pag_pagos.detail", "pag_pago_id")
+    cit_cliente_url = url_template("cit_clientes.detail", "cit_cliente_id") if current_user.can_view("CIT CLIENTES") else ""
+    pag_tramite_servicio_url = (
+        url_template("pag_tramites_servicios.detail", "pag_tramite_servicio_id")
+        if current_user.can_view("PAG TRAMITES SERVICIOS")
+        else ""
+    )
+    distrito_url = url_template("distritos.detail", "distrito_id") if current_user.can_view("DISTRITOS") else ""
+    autoridad_url = url_template("autoridades.detail", "autoridad_id") if current_user.can_view("AUTORIDADES") else ""
     # Elaborar datos para DataTable
     data = []
     for resultado in registros:
@@ -77,45 +129,29 @@ def datatable_json():
             {
                 "detalle": {
                     "id": resultado.id,
-                    "url": url_for("pag_pagos.detail", pag_pago_id=resultado.id),
+                    "url": detalle_url.format(resultado.id),
                 },
-                "creado": resultado.creado.strftime("%Y-%m-%dT%H:%M:%S"),
+                "creado": resultado.creado.isoformat(timespec="seconds"),
                 "cit_cliente": {
-                    "nombre": f"{resultado.cit_cliente.nombre}",
-                    "url": (
-                        url_for("cit_clientes.detail", cit_cliente_id=resultado.cit_cliente_id)
-                        if current_user.can_view("CIT CLIENTES")
-                        else ""
-                    ),
+                    "nombre": resultado.cit_cliente_nombre,
+                    "url": cit_cliente_url.format(resultado.cit_cliente_id),
                 },
-                "email": resultado.cit_cliente.email,
+                "email": resultado.cit_cliente_email,
                 "cantidad": resultado.cantidad,
                 "pag_tramite_servicio": {
-                    "clave": resultado.pag_tramite_servicio.clave,
-                    "descripcion": resultado.pag_tramite_servicio.descripcion,
-                    "url": (
-                        url_for("pag_tramites_servicios.detail", pag_tramite_servicio_id=resultado.pag_tramite_servicio_id)
-                        if current_user.can_view("PAG TRAMITES SERVICIOS")
-                        else ""
-                    ),
+                    "clave": resultado.pag_tramite_servicio_clave,
+                    "descripcion": resultado.pag_tramite_servicio_descripcion,
+                    "url": pag_tramite_servicio_url.format(resultado.pag_tramite_servicio_id),
                 },
                 "distrito": {
-                    "clave": resultado.distrito.clave,
-                    "nombre_corto": resultado.distrito.nombre_corto,
-                    "url": (
-                        url_for("distritos.detail", distrito_id=resultado.distrito_id)
-                        if current_user.can_view("DISTRITOS")
-                        else ""
-                    ),
+                    "clave": resultado.distrito_clave,
+                    "nombre_corto": resultado.distrito_nombre_corto,
+                    "url": distrito_url.format(resultado.distrito_id),
                 },
                 "autoridad": {
-                    "clave": resultado.autoridad.clave,
-                    "nombre_corto": resultado.autoridad.descripcion_corta,
-                    "url": (
-                        url_for("autoridades.detail", autoridad_id=resultado.autoridad_id)
-                        if current_user.can_view("AUTORIDADES")
-                        else ""
-                    ),
+                    "clave": resultado.autoridad_clave,
+                    "nombre_corto": resultado.autoridad_descripcion_corta,
+                    "url": autoridad_url.format(resultado.autoridad_id),
                 },
                 "folio": resultado.folio,
                 "total": resultado.total,
@@ -123,7 +159,7 @@ def datatable_json():
             }
         )
     # Entregar JSON
-    return output_datatable_json(draw, total, data)
+    return output_datatable_json(draw, total, data, keyset)
 
 
 @pag_pagos.route("/pag_pagos")
@@ -176,3 +212,27 @@ def detail(pag_pago_id):
 def dashboard():
     """Tablero de PagPago"""
     return render_template("pag_pagos/dashboard.jinja2")
+
+
+@pag_pagos.route("/pag_pagos/conciliar/<formato>")
+@permission_required(MODULO, Permiso.ADMINISTRAR)
+def reconcile(formato):
+    """Lanzar la tarea para conciliar los PagPago con las respuestas del banco, opcional con desde y hasta AAAA-MM-DD"""
+    if formato not in FORMATOS:
+        flash("Formato de exportación no válido.", "warning")
+        return redirect(url_for("pag_pagos.dashboard"))
+    try:
+        desde = date.fromisoformat(request.args["desde"]) if request.args.get("desde") else None
+        hasta = date.fromisoformat(request.args["hasta"]) if request.args.get("hasta") else None
+    except ValueError:
+        flash("Las fechas deben tener el formato AAAA-MM-DD.", "warning")
+        return redirect(url_for("pag_pagos.dashboard"))
+    tarea = current_user.launch_task(
+        comando="pag_pagos.tasks.lanzar_conciliar",
+        mensaje=f"Conciliando Pagos a {formato.upper()}",
+        desde=desde,
+        hasta=hasta,
+        formato=formato,
+    )
+    flash(f"Se están conciliando los Pagos, las diferencias irán a un archivo {formato.upper()}.", "info")
+    return redirect(url_for("tareas.detail", tarea_id=tarea.id))
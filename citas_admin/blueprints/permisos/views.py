@@ -6,6 +6,7 @@ import json
 
 from flask import Blueprint, flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
+from sqlalchemy.orm import joinedload
 
 from citas_admin.blueprints.bitacoras.models import Bitacora
 from citas_admin.blueprints.modulos.models import Modulo
@@ -61,7 +62,13 @@ def datatable_json():
         if nivel != "":
             consulta = consulta.filter(Permiso.nivel == nivel)
     # Ordenar y paginar
-    registros = consulta.order_by(Permiso.nombre).offset(start).limit(rows_per_page).all()
+    registros = (
+        consulta.options(joinedload(Permiso.modulo), joinedload(Permiso.rol))
+        .order_by(Permiso.nombre)
+        .offset(start)
+        .limit(rows_per_page)
+        .all()
+    )
     total = consulta.count()
     # Elaborar datos para DataTable
     data = []
@@ -46,6 +46,11 @@ class Tarea(database.Model, UniversalMixin):
         job = self.get_rq_job()
         return job.meta.get("progress", 0) if job is not None else 100
 
+    def get_message(self):
+        """Returns the latest message, from Redis while the task is running"""
+        job = self.get_rq_job()
+        return job.meta.get("message", self.mensaje) if job is not None else self.mensaje
+
     def __repr__(self):
         """Representación"""
         return f"<Tarea {self.id}>"
@@ -0,0 +1,124 @@
+"""
+Tareas, tareas en el fondo
+"""
+
+import importlib
+import logging
+from datetime import datetime
+
+import pytz
+
+from citas_admin.app import create_app
+from citas_admin.extensions import database
+from lib.exceptions import (
+    MyAnyError,
+    MyBucketNotFoundError,
+    MyEmptyError,
+    MyFileNotAllowedError,
+    MyFileNotFoundError,
+    MyNotValidParamError,
+    MyUploadError,
+)
+from lib.exports import FORMATOS, column_types, export_paths, stream_rows, upload_export, write_export
+from lib.tasks import TaskProgress, set_task_error, set_task_progress
+
+# Constantes
+GCS_BASE_DIRECTORY = "listados"
+LOCAL_BASE_DIRECTORY = "exports/listados"
+TIMEZONE = "America/Mexico_City"
+
+# Listados que se pueden exportar, cada módulo de vistas debe tener la función exportar_datatable
+LISTADOS = {
+    "bitacoras": "citas_admin.blueprints.bitacoras.views",
+    "cit_citas": "citas_admin.blueprints.cit_citas.views",
+    "cit_clientes": "citas_admin.blueprints.cit_clientes.views",
+}
+
+# Bitácora logs/tareas.log
+bitacora = logging.getLogger(__name__)
+bitacora.setLevel(logging.INFO)
+formato = logging.Formatter("%(asctime)s:%(levelname)s:%(message)s")
+empunadura = logging.FileHandler("logs/tareas.log")
+empunadura.setFormatter(formato)
+bitacora.addHandler(empunadura)
+
+# Cargar la aplicación para tener acceso a la base de datos
+app = create_app()
+app.app_context().push()
+database.app = app
+
+
+def exportar_listado(listado: str, formato: str, filtros: dict) -> tuple[str, str, str]:
+    """Exportar un listado con los mismos filtros del DataTable a un archivo CSV, XLSX o Parquet"""
+
+    # Iniciar listado con los mensajes
+    mensajes = []
+
+    # Validar el listado y el formato
+    if listado not in LISTADOS:
+        mensaje = f"El listado {listado} no se puede exportar"
+        bitacora.error(mensaje)
+        raise MyNotValidParamError(mensaje)
+    if formato not in FORMATOS:
+        mensaje = f"El formato {formato} no es válido"
+        bitacora.error(mensaje)
+        raise MyNotValidParamError(mensaje)
+    content_type, _ = FORMATOS[formato]
+
+    # Elaborar la consulta con los filtros del listado
+    cabeceras, consulta = importlib.import_module(LISTADOS[listado]).exportar_datatable(filtros)
+    mensaje = f"Inicia exportar {listado} a {formato.upper()} con los filtros {filtros}"
+    bitacora.info(mensaje)
+    mensajes.append(mensaje)
+
+    # Determinar el nombre del archivo y las rutas
+    momento_str = datetime.now(pytz.timezone(TIMEZONE)).strftime("%Y-%m-%d_%H%M%S")
+    nombre_archivo = f"{listado}_{momento_str}.{formato}"
+    ruta_local_archivo, ruta_gcs_archivo = export_paths(LOCAL_BASE_DIRECTORY, GCS_BASE_DIRECTORY, nombre_archivo)
+
+    # Escribir el archivo conforme se traen las filas por lotes
+    with TaskProgress(0, f"Exportando {listado}") as progreso:
+        contador = write_export(
+            formato, ruta_local_archivo, cabeceras, progreso.iterate(stream_rows(consulta)), column_types(consulta)
+        )
+
+    # Agregar a mensajes la cantidad de filas exportadas
+    mensaje = f"Se exportaron {contador} filas de {listado}"
+    bitacora.info(mensaje)
+    mensajes.append(mensaje)
+
+    # Si esta configurado Google Cloud Storage, subir el archivo por partes
+    public_url = ""
+    try:
+        public_url = upload_export(ruta_local_archivo, ruta_gcs_archivo, content_type)
+        if public_url != "":
+            mensaje = f"Se subió el archivo {nombre_archivo} a GCS"
+            bitacora.info(mensaje)
+            mensajes.append(mensaje)
+    except (MyEmptyError, MyBucketNotFoundError, MyFileNotAllowedError, MyFileNotFoundError, MyUploadError) as error:
+        mensaje = f"Falló el subir el archivo a GCS: {str(error)}"
+        bitacora.warning(mensaje)
+        mensajes.append(mensaje)
+
+    # Entregar mensaje de termino, el nombre del archivo y la URL publica
+    mensaje_termino = "\n".join(mensajes)
+    return mensaje_termino, nombre_archivo, public_url
+
+
+def lanzar_exportar_listado(listado: str, formato: str, filtros: dict):
+    """Lanzar tarea para exportar un listado a un archivo CSV, XLSX o Parquet"""
+
+    # Iniciar la tarea en el fondo
+    set_task_progress(0, f"Inicia exportar {listado} a {formato.upper()}")
+
+    # Ejecutar
+    try:
+        mensaje_termino, nombre_archivo, public_url = exportar_listado(listado, formato, filtros)
+    except MyAnyError as error:
+        mensaje_error = str(error)
+        set_task_error(mensaje_error)
+        return mensaje_error
+
+    # Terminar la tarea en el fondo y entregar el mensaje de termino
+    set_task_progress(100, mensaje_termino, nombre_archivo, public_url)
+    return mensaje_termino
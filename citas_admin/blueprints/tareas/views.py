@@ -6,12 +6,14 @@ import json
 
 from flask import Blueprint, current_app, flash, make_response, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
+from sqlalchemy.orm import joinedload
 
 from citas_admin.blueprints.permisos.models import Permiso
 from citas_admin.blueprints.tareas.models import Tarea
 from citas_admin.blueprints.usuarios.decorators import permission_required
 from lib.datatables import get_datatable_parameters, output_datatable_json
 from lib.exceptions import MyAnyError
+from lib.exports import FORMATOS
 from lib.google_cloud_storage import get_blob_name_from_url, get_file_from_gcs
 
 MODULO = "TAREAS"
@@ -45,7 +47,9 @@ def datatable_json():
     if "usuario_id" in request.form:
         consulta = consulta.filter_by(usuario_id=request.form["usuario_id"])
     # Ordenar y paginar
-    registros = consulta.order_by(Tarea.creado.desc()).offset(start).limit(rows_per_page).all()
+    registros = (
+        consulta.options(joinedload(Tarea.usuario)).order_by(Tarea.creado.desc()).offset(start).limit(rows_per_page).all()
+    )
     total = consulta.count()
     # Elaborar datos para DataTable
     data = []
@@ -106,9 +110,10 @@ def detail(tarea_id):
 
 
 @tareas.route("/tareas/<tarea_id>/xlsx")
+@tareas.route("/tareas/<tarea_id>/descargar")
 @login_required
 def download_xlsx(tarea_id):
-    """Descargar archivo XLSX de una Tarea"""
+    """Descargar archivo XLSX, CSV o Parquet de una Tarea"""
 
     # Consultar la Tarea
     tarea = Tarea.query.get_or_404(tarea_id)
@@ -124,10 +129,12 @@ def download_xlsx(tarea_id):
         flash("Esta tarea no tiene un archivo para descargar", "warning")
         return redirect(url_for("tareas.detail", tarea_id=tarea.id))
 
-    # Validar que descarga_nombre termine en .xlsx
-    if not descarga_nombre.endswith(".xlsx"):
-        flash("Esta tarea no tiene un archivo XLSX para descargar", "warning")
+    # Validar que descarga_nombre termine en una extensión de los formatos de exportación
+    extension = descarga_nombre.rsplit(".", 1)[-1].lower()
+    if extension not in FORMATOS:
+        flash("Esta tarea no tiene un archivo XLSX, CSV o Parquet para descargar", "warning")
         return redirect(url_for("tareas.detail", tarea_id=tarea.id))
+    content_type, _ = FORMATOS[extension]
 
     # Obtener el contenido del archivo desde Google Storage
     try:
@@ -139,8 +146,8 @@ def download_xlsx(tarea_id):
         flash(str(error), "danger")
         return redirect(url_for("tareas.detail", tarea_id=tarea.id))
 
-    # Descargar un archivo XLSX
+    # Descargar el archivo
     response = make_response(descarga_contenido)
-    response.headers["Content-Type"] = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    response.headers["Content-Type"] = content_type
     response.headers["Content-Disposition"] = f"attachment; filename={descarga_nombre}"
     return response
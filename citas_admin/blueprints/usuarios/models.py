@@ -2,20 +2,39 @@
 Usuarios, modelos
 """
 
+import json
 from datetime import datetime
+from itertools import chain
 from typing import List, Optional
 
-from flask import current_app
+from flask import current_app, has_app_context
 from flask_login import UserMixin
-from sqlalchemy import ForeignKey, String
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from redis.exceptions import RedisError
+from sqlalchemy import ForeignKey, String, event, func, select
+from sqlalchemy.orm import Mapped, Session, make_transient_to_detached, mapped_column, relationship
 
+from citas_admin.blueprints.modulos.models import Modulo
 from citas_admin.blueprints.permisos.models import Permiso
+from citas_admin.blueprints.roles.models import Rol
 from citas_admin.blueprints.tareas.models import Tarea
 from citas_admin.blueprints.usuarios_roles.models import UsuarioRol
 from citas_admin.extensions import database, pwd_context
 from lib.universal_mixin import UniversalMixin
 
+PERMISOS_CACHE_TTL = 3600  # Segundos que se conserva en Redis la matriz de permisos de un usuario
+PERMISOS_VERSION_KEY = "usuarios:permisos:version"  # Contador que se incrementa cuando cambian los permisos
+USUARIO_CACHE_TTL = 300  # Segundos que se conserva en Redis la copia del usuario que usa Flask-Login
+USUARIO_CACHE_COLUMNAS = [
+    "id",
+    "autoridad_id",
+    "oficina_id",
+    "email",
+    "nombres",
+    "apellido_paterno",
+    "apellido_materno",
+    "estatus",
+]
+
 
 class Usuario(database.Model, UserMixin, UniversalMixin):
     """Usuario"""
@@ -51,9 +70,8 @@ class Usuario(database.Model, UserMixin, UniversalMixin):
     usuarios_roles: Mapped[List["UsuarioRol"]] = relationship("UsuarioRol", back_populates="usuario")
     usuarios_oficinas: Mapped[List["UsuarioOficina"]] = relationship("UsuarioOficina", back_populates="usuario")
 
-    # Propiedades
-    modulos_menu_principal_consultados = []
-    permisos_consultados = {}
+    # Matriz de permisos consultada, vive lo mismo que la instancia, es decir, una petición
+    _matriz_permisos = None
 
     @property
     def nombre(self):
@@ -63,39 +81,97 @@ class Usuario(database.Model, UserMixin, UniversalMixin):
     @property
     def modulos_menu_principal(self):
         """Elaborar listado con los modulos ordenados para el menu principal"""
-        if len(self.modulos_menu_principal_consultados) > 0:
-            return self.modulos_menu_principal_consultados
-        modulos = []
-        modulos_nombres = []
-        for usuario_rol in self.usuarios_roles:
-            if usuario_rol.estatus == "A":
-                for permiso in usuario_rol.rol.permisos:
-                    if (
-                        permiso.modulo.nombre not in modulos_nombres
-                        and permiso.estatus == "A"
-                        and permiso.modulo.estatus == "A"
-                        and permiso.nivel > 0
-                        and permiso.modulo.en_navegacion
-                    ):
-                        modulos.append(permiso.modulo)
-                        modulos_nombres.append(permiso.modulo.nombre)
-        self.modulos_menu_principal_consultados = sorted(modulos, key=lambda x: x.nombre_corto)
-        return self.modulos_menu_principal_consultados
+        return self.matriz_permisos["modulos_menu_principal"]
 
     @property
     def permisos(self):
         """Entrega un diccionario con todos los permisos"""
-        if len(self.permisos_consultados) > 0:
-            return self.permisos_consultados
-        self.permisos_consultados = {}
-        for usuario_rol in self.usuarios_roles:
-            if usuario_rol.estatus == "A":
-                for permiso in usuario_rol.rol.permisos:
-                    if permiso.estatus == "A":
-                        etiqueta = permiso.modulo.nombre
-                        if etiqueta not in self.permisos_consultados or permiso.nivel > self.permisos_consultados[etiqueta]:
-                            self.permisos_consultados[etiqueta] = permiso.nivel
-        return self.permisos_consultados
+        return self.matriz_permisos["permisos"]
+
+    @property
+    def matriz_permisos(self):
+        """Entrega los permisos y los modulos del menu principal, de Redis si están ahí o consultando una sola vez"""
+        if self._matriz_permisos is not None:
+            return self._matriz_permisos
+        # Si está en Redis para la versión vigente de los permisos, tomarla
+        llave = None
+        try:
+            llave = f"usuarios:permisos:{self.id}:{get_permisos_version()}"
+            guardado = current_app.redis.get(llave)
+        except (RedisError, RuntimeError):
+            guardado = None
+        if guardado is not None:
+            self._matriz_permisos = json.loads(guardado)
+            return self._matriz_permisos
+        # Consultar el nivel más alto de cada modulo en los roles activos del usuario
+        consulta = (
+            select(
+                Modulo.nombre,
+                Modulo.nombre_corto,
+                Modulo.ruta,
+                Modulo.icono,
+                Modulo.en_navegacion,
+                Modulo.estatus,
+                func.max(Permiso.nivel),
+            )
+            .select_from(UsuarioRol)
+            .join(Permiso, Permiso.rol_id == UsuarioRol.rol_id)
+            .join(Modulo, Modulo.id == Permiso.modulo_id)
+            .where(UsuarioRol.usuario_id == self.id)
+            .where(UsuarioRol.estatus == "A")
+            .where(Permiso.estatus == "A")
+            .group_by(Modulo.id)
+        )
+        permisos = {}
+        modulos = []
+        for nombre, nombre_corto, ruta, icono, en_navegacion, estatus, nivel in database.session.execute(consulta):
+            permisos[nombre] = nivel
+            if estatus == "A" and nivel > 0 and en_navegacion:
+                modulos.append({"nombre": nombre, "nombre_corto": nombre_corto, "ruta": ruta, "icono": icono})
+        self._matriz_permisos = {
+            "permisos": permisos,
+            "modulos_menu_principal": sorted(modulos, key=lambda x: x["nombre_corto"]),
+        }
+        # Guardar en Redis
+        if llave is not None:
+            try:
+                current_app.redis.setex(llave, PERMISOS_CACHE_TTL, json.dumps(self._matriz_permisos))
+            except RedisError:
+                pass
+        return self._matriz_permisos
+
+    @classmethod
+    def get_cached(cls, usuario_id):
+        """Cargar al usuario de su copia en Redis, si no está o cambió la versión de los permisos, consultarlo"""
+        llave = f"usuarios:usuario:{usuario_id}"
+        try:
+            guardado, version = current_app.redis.mget(llave, PERMISOS_VERSION_KEY)
+        except RedisError:
+            return cls.query.get(usuario_id)
+        version = 0 if version is None else int(version)
+        # Si la copia es de la versión vigente, reconstruir al usuario sin consultar la base de datos
+        if guardado is not None:
+            copia = json.loads(guardado)
+            if copia["permisos_version"] == version:
+                usuario = cls(**copia["columnas"])
+                make_transient_to_detached(usuario)
+                usuario = database.session.merge(usuario, load=False)
+                usuario._matriz_permisos = copia["matriz_permisos"]
+                return usuario
+        # Consultar y guardar la copia en Redis
+        usuario = cls.query.get(usuario_id)
+        if usuario is None:
+            return None
+        copia = {
+            "columnas": {columna: getattr(usuario, columna) for columna in USUARIO_CACHE_COLUMNAS},
+            "matriz_permisos": usuario.matriz_permisos,
+            "permisos_version": version,
+        }
+        try:
+            current_app.redis.setex(llave, USUARIO_CACHE_TTL, json.dumps(copia))
+        except RedisError:
+            pass
+        return usuario
 
     @classmethod
     def find_by_identity(cls, identity):
@@ -135,6 +211,15 @@ class Usuario(database.Model, UserMixin, UniversalMixin):
         """¿Tiene permiso para administrar?"""
         return self.can(modulo_nombre, Permiso.ADMINISTRAR)
 
+    def save(self):
+        """Guardar registro y descartar su copia en Redis"""
+        super().save()
+        try:
+            current_app.redis.delete(f"usuarios:usuario:{self.id}")
+        except RedisError:
+            pass
+        return self
+
     def get_roles(self):
         """Obtener roles"""
         usuarios_roles = UsuarioRol.query.filter_by(usuario_id=self.id).filter_by(estatus="A").all()
@@ -158,3 +243,36 @@ class Usuario(database.Model, UserMixin, UniversalMixin):
     def __repr__(self):
         """Representación"""
         return f"<Usuario {self.email}>"
+
+
+def get_permisos_version() -> int:
+    """Entrega la versión vigente de los permisos, forma parte de la llave de la matriz en Redis"""
+    version = current_app.redis.get(PERMISOS_VERSION_KEY)
+    if version is None:
+        return 0
+    return int(version)
+
+
+@event.listens_for(Session, "after_flush")
+def _marcar_cambio_permisos(session, flush_context):
+    """Si se guardan permisos, roles, usuarios-roles o modulos, marcar la sesión para cambiar la versión al confirmar"""
+    for registro in chain(session.new, session.dirty, session.deleted):
+        if isinstance(registro, (Permiso, Rol, UsuarioRol, Modulo)):
+            session.info["permisos_cambiaron"] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _incrementar_permisos_version(session):
+    """Al confirmar cambios en los permisos, incrementar la versión para que las matrices en Redis ya no se usen"""
+    if session.info.pop("permisos_cambiaron", False) and has_app_context():
+        try:
+            current_app.redis.incr(PERMISOS_VERSION_KEY)
+        except RedisError:
+            pass
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_cambio_permisos(session):
+    """Al revertir, descartar la marca de cambios en los permisos"""
+    session.info.pop("permisos_cambiaron", None)
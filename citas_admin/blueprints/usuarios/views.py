@@ -11,6 +11,7 @@ import google.oauth2.id_token
 from flask import Blueprint, flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required, login_user, logout_user
 from pytz import timezone
+from sqlalchemy.orm import joinedload
 
 from citas_admin.blueprints.bitacoras.models import Bitacora
 from citas_admin.blueprints.distritos.models import Distrito
@@ -181,7 +182,7 @@ def datatable_json():
     if "email" in request.form:
         consulta = consulta.filter(Usuario.email.contains(safe_email(request.form["email"], search_fragment=True)))
     # Ordenar y paginar
-    registros = consulta.order_by(Usuario.email).offset(start).limit(rows_per_page).all()
+    registros = consulta.options(joinedload(Usuario.autoridad)).order_by(Usuario.email).offset(start).limit(rows_per_page).all()
     total = consulta.count()
     # Elaborar datos para DataTable
     data = []
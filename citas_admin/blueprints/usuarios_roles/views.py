@@ -6,6 +6,7 @@ import json
 
 from flask import Blueprint, flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
+from sqlalchemy.orm import joinedload
 
 from citas_admin.blueprints.bitacoras.models import Bitacora
 from citas_admin.blueprints.modulos.models import Modulo
@@ -69,7 +70,9 @@ def datatable_json():
     # Filtrar por los usuarios activos y por los roles activos
     consulta = consulta.filter(Usuario.estatus == "A").filter(Rol.estatus == "A")
     # Paginar
-    registros = consulta.offset(start).limit(rows_per_page).all()
+    registros = (
+        consulta.options(joinedload(UsuarioRol.rol), joinedload(UsuarioRol.usuario)).offset(start).limit(rows_per_page).all()
+    )
     total = consulta.count()
     # Elaborar datos para DataTable
     data = []
@@ -0,0 +1,66 @@
+"""
+Modelos
+
+Cargar todos los modelos para que SQLAlchemy encuentre por su nombre las clases de las relaciones.
+
+Se importa en citas_admin/app.py antes que las vistas, porque algunas elaboran aliased() al cargarse y eso configura
+los mappers; si en ese momento falta un modelo, create_app falla con "failed to locate a name".
+"""
+
+from citas_admin.blueprints.autoridades.models import Autoridad
+from citas_admin.blueprints.bitacoras.models import Bitacora
+from citas_admin.blueprints.cit_categorias.models import CitCategoria
+from citas_admin.blueprints.cit_citas.models import CitCita
+from citas_admin.blueprints.cit_citas_diarias.models import CitCitaDiaria
+from citas_admin.blueprints.cit_clientes.models import CitCliente
+from citas_admin.blueprints.cit_clientes_recuperaciones.models import CitClienteRecuperacion
+from citas_admin.blueprints.cit_clientes_registros.models import CitClienteRegistro
+from citas_admin.blueprints.cit_dias_inhabiles.models import CitDiaInhabil
+from citas_admin.blueprints.cit_horas_bloqueadas.models import CitHoraBloqueada
+from citas_admin.blueprints.cit_oficinas_servicios.models import CitOficinaServicio
+from citas_admin.blueprints.cit_servicios.models import CitServicio
+from citas_admin.blueprints.distritos.models import Distrito
+from citas_admin.blueprints.domicilios.models import Domicilio
+from citas_admin.blueprints.entradas_salidas.models import EntradaSalida
+from citas_admin.blueprints.materias.models import Materia
+from citas_admin.blueprints.modulos.models import Modulo
+from citas_admin.blueprints.municipios.models import Municipio
+from citas_admin.blueprints.oficinas.models import Oficina
+from citas_admin.blueprints.pag_pagos.models import PagPago
+from citas_admin.blueprints.pag_tramites_servicios.models import PagTramiteServicio
+from citas_admin.blueprints.permisos.models import Permiso
+from citas_admin.blueprints.roles.models import Rol
+from citas_admin.blueprints.tareas.models import Tarea
+from citas_admin.blueprints.usuarios.models import Usuario
+from citas_admin.blueprints.usuarios_oficinas.models import UsuarioOficina
+from citas_admin.blueprints.usuarios_roles.models import UsuarioRol
+
+__all__ = [
+    "Autoridad",
+    "Bitacora",
+    "CitCategoria",
+    "CitCita",
+    "CitCitaDiaria",
+    "CitCliente",
+    "CitClienteRecuperacion",
+    "CitClienteRegistro",
+    "CitDiaInhabil",
+    "CitHoraBloqueada",
+    "CitOficinaServicio",
+    "CitServicio",
+    "Distrito",
+    "Domicilio",
+    "EntradaSalida",
+    "Materia",
+    "Modulo",
+    "Municipio",
+    "Oficina",
+    "PagPago",
+    "PagTramiteServicio",
+    "Permiso",
+    "Rol",
+    "Tarea",
+    "Usuario",
+    "UsuarioOficina",
+    "UsuarioRol",
+]
@@ -40,4 +40,19 @@ class ConfigDataTable {
       },
     };
   }
+
+  // Paginar por llave (keyset): al avanzar a la página siguiente se envía la llave de la última fila
+  keyset(config) {
+    let keyset = null;
+    config["ajax"]["dataSrc"] = function (json) {
+      keyset = json.keyset || null;
+      return json.aaData || json.data;
+    };
+    config["ajax"]["beforeSend"] = function (xhr, settings) {
+      if (keyset !== null) {
+        settings.data += "&" + $.param({ keyset_start: keyset.start, keyset_valores: JSON.stringify(keyset.valores) });
+      }
+    };
+    return config;
+  }
 }
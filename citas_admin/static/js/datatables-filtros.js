@@ -98,6 +98,13 @@ class FiltrosDataTable {
     $(this.dataTable).DataTable(this.configDataTable);
   }
 
+  // Exportar, abre el URL con los mismos filtros del DataTable en la consulta
+  exportar(url) {
+    this.leerValoresInputs();
+    const parametros = new URLSearchParams(this.configDataTable["ajax"]["data"]);
+    window.location.href = url + "?" + parametros.toString();
+  }
+
   // Precargar
   precargar() {
     $(this.dataTable).DataTable(this.configDataTable);
@@ -11,6 +11,7 @@ import click
 from citas_admin.blueprints.autoridades.models import Autoridad
 from citas_admin.blueprints.distritos.models import Distrito
 from citas_admin.blueprints.materias.models import Materia
+from cli.commands.cargar import cargar_filas, consultar_ids
 from lib.safe_string import safe_clave, safe_string
 
 AUTORIDADES_CSV = "seed/autoridades.csv"
@@ -25,8 +26,10 @@ def alimentar_autoridades():
     if not ruta.is_file():
         click.echo(f"AVISO: {ruta.name} no es un archivo.")
         sys.exit(1)
+    distritos_ids = consultar_ids(Distrito)
+    materias_ids = consultar_ids(Materia)
     click.echo("Alimentando autoridades: ", nl=False)
-    contador = 0
+    filas = []
     with open(ruta, encoding="utf8") as puntero:
         rows = csv.DictReader(puntero)
         for row in rows:
@@ -40,29 +43,29 @@ def alimentar_autoridades():
             es_notaria = row["es_notaria"] == "1"
             organo_jurisdiccional = safe_string(row["organo_jurisdiccional"], save_enie=True)
             estatus = row["estatus"]
-            if autoridad_id != contador + 1:
+            if autoridad_id != len(filas) + 1:
                 click.echo(click.style(f"  AVISO: autoridad_id {autoridad_id} no es consecutivo", fg="red"))
                 sys.exit(1)
-            distrito = Distrito.query.get(distrito_id)
-            if distrito is None:
+            if distrito_id not in distritos_ids:
                 click.echo(click.style(f"  AVISO: distrito_id {distrito_id} no existe", fg="red"))
                 sys.exit(1)
-            materia = Materia.query.get(materia_id)
-            if materia is None:
+            if materia_id not in materias_ids:
                 click.echo(click.style(f"  AVISO: materia_id {materia_id} no existe", fg="red"))
                 sys.exit(1)
-            Autoridad(
-                distrito=distrito,
-                materia=materia,
-                clave=clave,
-                descripcion=descripcion,
-                descripcion_corta=descripcion_corta,
-                es_jurisdiccional=es_jurisdiccional,
-                es_notaria=es_notaria,
-                organo_jurisdiccional=organo_jurisdiccional,
-                estatus=estatus,
-            ).save()
-            contador += 1
-            click.echo(click.style(".", fg="green"), nl=False)
+            filas.append(
+                {
+                    "id": autoridad_id,
+                    "distrito_id": distrito_id,
+                    "materia_id": materia_id,
+                    "clave": clave,
+                    "descripcion": descripcion,
+                    "descripcion_corta": descripcion_corta,
+                    "es_jurisdiccional": es_jurisdiccional,
+                    "es_notaria": es_notaria,
+                    "organo_jurisdiccional": organo_jurisdiccional,
+                    "estatus": estatus,
+                }
+            )
+    contador = cargar_filas(Autoridad, filas)
     click.echo()
     click.echo(click.style(f"  {contador} autoridades alimentadas.", fg="green"))
@@ -2,14 +2,18 @@
 Alimentar Distritos
 """
 
-from pathlib import Path
 import csv
 import sys
+from pathlib import Path
 
 import click
+from sqlalchemy import exists, update
 
-from lib.safe_string import safe_clave, safe_string
+from citas_admin.blueprints.autoridades.models import Autoridad
 from citas_admin.blueprints.distritos.models import Distrito
+from citas_admin.extensions import database
+from cli.commands.cargar import cargar_filas
+from lib.safe_string import safe_clave, safe_string
 
 DISTRITOS_CSV = "seed/distritos.csv"
 
@@ -24,7 +28,7 @@ def alimentar_distritos():
         click.echo(f"AVISO: {ruta.name} no es un archivo.")
         sys.exit(1)
     click.echo("Alimentando distritos: ", nl=False)
-    contador = 0
+    filas = []
     with open(ruta, encoding="utf8") as puntero:
         rows = csv.DictReader(puntero)
         for row in rows:
@@ -34,18 +38,20 @@ def alimentar_distritos():
             nombre_corto = safe_string(row["nombre_corto"], save_enie=True)
             es_distrito_judicial = row["es_distrito_judicial"] == "1"
             estatus = row["estatus"]
-            if distrito_id != contador + 1:
+            if distrito_id != len(filas) + 1:
                 click.echo(click.style(f"  AVISO: distrito_id {distrito_id} no es consecutivo", fg="red"))
                 sys.exit(1)
-            Distrito(
-                clave=clave,
-                nombre=nombre,
-                nombre_corto=nombre_corto,
-                es_distrito_judicial=es_distrito_judicial,
-                estatus=estatus,
-            ).save()
-            contador += 1
-            click.echo(click.style(".", fg="green"), nl=False)
+            filas.append(
+                {
+                    "id": distrito_id,
+                    "clave": clave,
+                    "nombre": nombre,
+                    "nombre_corto": nombre_corto,
+                    "es_distrito_judicial": es_distrito_judicial,
+                    "estatus": estatus,
+                }
+            )
+    contador = cargar_filas(Distrito, filas)
     click.echo()
     click.echo(click.style(f"  {contador} distritos alimentados.", fg="green"))
 
@@ -53,16 +59,10 @@ def alimentar_distritos():
 def eliminar_distritos_sin_autoridades():
     """Eliminar Distritos sin Autoridades"""
     click.echo("Eliminando distritos sin autoridades: ", nl=False)
-    contador = 0
-    for distrito in Distrito.query.filter_by(estatus="A").all():
-        autoridades_activas_contador = 0
-        for autoridad in distrito.autoridades:
-            if autoridad.estatus == "A":
-                autoridades_activas_contador += 1
-        if autoridades_activas_contador == 0:
-            distrito.estatus = "B"
-            distrito.save()
-            contador += 1
-            click.echo(click.style(".", fg="green"), nl=False)
+    autoridades_activas = exists().where(Autoridad.distrito_id == Distrito.id).where(Autoridad.estatus == "A")
+    resultado = database.session.execute(
+        update(Distrito).where(Distrito.estatus == "A").where(~autoridades_activas).values(estatus="B")
+    )
+    database.session.commit()
     click.echo()
-    click.echo(click.style(f"  {contador} distritos eliminados.", fg="green"))
+    click.echo(click.style(f"  {resultado.rowcount} distritos eliminados.", fg="green"))
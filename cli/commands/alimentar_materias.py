@@ -9,6 +9,7 @@ from pathlib import Path
 import click
 
 from citas_admin.blueprints.materias.models import Materia
+from cli.commands.cargar import cargar_filas
 from lib.safe_string import safe_string
 
 MATERIAS_CSV = "seed/materias.csv"
@@ -24,21 +25,23 @@ def alimentar_materias():
         click.echo(f"AVISO: {ruta.name} no es un archivo.")
         sys.exit(1)
     click.echo("Alimentando materias: ", nl=False)
-    contador = 0
+    filas = []
     with open(ruta, encoding="utf8") as puntero:
         rows = csv.DictReader(puntero)
         for row in rows:
             materia_id = int(row["materia_id"])
             nombre = safe_string(row["nombre"], save_enie=True)
             estatus = row["estatus"]
-            if materia_id != contador + 1:
+            if materia_id != len(filas) + 1:
                 click.echo(click.style(f"  AVISO: materia_id {materia_id} no es consecutivo", fg="red"))
                 sys.exit(1)
-            Materia(
-                nombre=nombre,
-                estatus=estatus,
-            ).save()
-            contador += 1
-            click.echo(click.style(".", fg="green"), nl=False)
+            filas.append(
+                {
+                    "id": materia_id,
+                    "nombre": nombre,
+                    "estatus": estatus,
+                }
+            )
+    contador = cargar_filas(Materia, filas)
     click.echo()
     click.echo(click.style(f"  {contador} materias alimentadas.", fg="green"))
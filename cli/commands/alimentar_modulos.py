@@ -9,6 +9,7 @@ from pathlib import Path
 import click
 
 from citas_admin.blueprints.modulos.models import Modulo
+from cli.commands.cargar import cargar_filas, incrementar_permisos_version
 from lib.safe_string import safe_string
 
 MODULOS_CSV = "seed/modulos.csv"
@@ -24,7 +25,7 @@ def alimentar_modulos():
         click.echo(f"AVISO: {ruta_csv.name} no es un archivo.")
         sys.exit(1)
     click.echo("Alimentando modulos: ", nl=False)
-    contador = 0
+    filas = []
     with open(ruta_csv, encoding="utf8") as puntero:
         rows = csv.DictReader(puntero)
         for row in rows:
@@ -35,18 +36,21 @@ def alimentar_modulos():
             ruta = row["ruta"]
             en_navegacion = row["en_navegacion"] == "1"
             estatus = row["estatus"]
-            if modulo_id != contador + 1:
+            if modulo_id != len(filas) + 1:
                 click.echo(click.style(f"  AVISO: modulo_id {modulo_id} no es consecutivo", fg="red"))
                 sys.exit(1)
-            Modulo(
-                nombre=nombre,
-                nombre_corto=nombre_corto,
-                icono=icono,
-                ruta=ruta,
-                en_navegacion=en_navegacion,
-                estatus=estatus,
-            ).save()
-            contador += 1
-            click.echo(click.style(".", fg="green"), nl=False)
+            filas.append(
+                {
+                    "id": modulo_id,
+                    "nombre": nombre,
+                    "nombre_corto": nombre_corto,
+                    "icono": icono,
+                    "ruta": ruta,
+                    "en_navegacion": en_navegacion,
+                    "estatus": estatus,
+                }
+            )
+    contador = cargar_filas(Modulo, filas)
+    incrementar_permisos_version()
     click.echo()
     click.echo(click.style(f"  {contador} modulos alimentados.", fg="green"))
@@ -2,17 +2,18 @@
 Alimentar Oficinas
 """
 
-from datetime import datetime
-from pathlib import Path
 import csv
 import sys
+from datetime import datetime
+from pathlib import Path
 
 import click
 
-from lib.safe_string import safe_clave, safe_string
 from citas_admin.blueprints.distritos.models import Distrito
 from citas_admin.blueprints.domicilios.models import Domicilio
 from citas_admin.blueprints.oficinas.models import Oficina
+from cli.commands.cargar import cargar_filas, consultar_ids
+from lib.safe_string import safe_clave, safe_string
 
 OFICINAS_CSV = "seed/oficinas.csv"
 
@@ -26,8 +27,10 @@ def alimentar_oficinas():
     if not ruta.is_file():
         click.echo(f"AVISO: {ruta.name} no es un archivo.")
         sys.exit(1)
+    distritos_ids = consultar_ids(Distrito)
+    domicilios_ids = consultar_ids(Domicilio)
     click.echo("Alimentando oficinas: ", nl=False)
-    contador = 0
+    filas = []
     with open(ruta, encoding="utf8") as puntero:
         rows = csv.DictReader(puntero)
         for row in rows:
@@ -39,35 +42,35 @@ def alimentar_oficinas():
             descripcion_corta = safe_string(row["descripcion_corta"], save_enie=True)
             es_jurisdiccional = row["es_jurisdiccional"] == "1"
             puede_agendar_citas = row["puede_agendar_citas"] == "1"
-            apertura = datetime.strptime(row["apertura"], "%H:%M:%S")
-            cierre = datetime.strptime(row["cierre"], "%H:%M:%S")
+            apertura = datetime.strptime(row["apertura"], "%H:%M:%S").time()
+            cierre = datetime.strptime(row["cierre"], "%H:%M:%S").time()
             limite_personas = int(row["limite_personas"])
             estatus = row["estatus"]
-            if oficina_id != contador + 1:
+            if oficina_id != len(filas) + 1:
                 click.echo(click.style(f"  AVISO: oficina_id {oficina_id} no es consecutivo", fg="red"))
                 sys.exit(1)
-            distrito = Distrito.query.get(distrito_id)
-            if distrito is None:
+            if distrito_id not in distritos_ids:
                 click.echo(click.style(f"  AVISO: distrito_id {distrito_id} no existe", fg="red"))
                 sys.exit(1)
-            domicilio = Domicilio.query.get(domicilio_id)
-            if domicilio is None:
+            if domicilio_id not in domicilios_ids:
                 click.echo(click.style(f"  AVISO: domicilio_id {domicilio_id} no existe", fg="red"))
                 sys.exit(1)
-            Oficina(
-                domicilio=domicilio,
-                distrito=distrito,
-                clave=clave,
-                descripcion=descripcion,
-                descripcion_corta=descripcion_corta,
-                es_jurisdiccional=es_jurisdiccional,
-                puede_agendar_citas=puede_agendar_citas,
-                apertura=apertura,
-                cierre=cierre,
-                limite_personas=limite_personas,
-                estatus=estatus,
-            ).save()
-            contador += 1
-            click.echo(click.style(".", fg="green"), nl=False)
+            filas.append(
+                {
+                    "id": oficina_id,
+                    "domicilio_id": domicilio_id,
+                    "distrito_id": distrito_id,
+                    "clave": clave,
+                    "descripcion": descripcion,
+                    "descripcion_corta": descripcion_corta,
+                    "es_jurisdiccional": es_jurisdiccional,
+                    "puede_agendar_citas": puede_agendar_citas,
+                    "apertura": apertura,
+                    "cierre": cierre,
+                    "limite_personas": limite_personas,
+                    "estatus": estatus,
+                }
+            )
+    contador = cargar_filas(Oficina, filas)
     click.echo()
     click.echo(click.style(f"  {contador} oficinas alimentadas.", fg="green"))
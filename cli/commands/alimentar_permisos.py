@@ -2,15 +2,16 @@
 Alimentar Permisos
 """
 
-from pathlib import Path
 import csv
 import sys
+from pathlib import Path
 
 import click
 
-from citas_admin.blueprints.roles.models import Rol
 from citas_admin.blueprints.modulos.models import Modulo
 from citas_admin.blueprints.permisos.models import Permiso
+from citas_admin.blueprints.roles.models import Rol
+from cli.commands.cargar import cargar_filas, consultar_claves, incrementar_permisos_version
 
 PERMISOS_CSV = "seed/roles_permisos.csv"
 
@@ -24,23 +25,23 @@ def alimentar_permisos():
     if not ruta.is_file():
         click.echo(f"AVISO: {ruta.name} no es un archivo.")
         sys.exit(1)
-    modulos = Modulo.query.all()
+    modulos = consultar_claves(Modulo.nombre, Modulo.id)
     if len(modulos) == 0:
         click.echo(click.style("  AVISO: No hay modulos alimentados.", fg="red"))
         sys.exit(1)
+    roles = consultar_claves(Rol.id, Rol.nombre)
     click.echo("Alimentando permisos: ", nl=False)
-    contador = 0
+    filas = []
     with open(ruta, encoding="utf8") as puntero:
         rows = csv.DictReader(puntero)
         for row in rows:
             rol_id = int(row["rol_id"])
             estatus = row["estatus"]
-            rol = Rol.query.get(rol_id)
-            if rol is None:
+            if rol_id not in roles:
                 click.echo(click.style(f"  AVISO: rol_id {rol_id} no existe", fg="red"))
                 sys.exit(1)
-            for modulo in modulos:
-                columna = modulo.nombre.lower()
+            for modulo_nombre, modulo_id in modulos.items():
+                columna = modulo_nombre.lower()
                 if columna not in row:
                     continue
                 if row[columna] == "":
@@ -53,14 +54,16 @@ def alimentar_permisos():
                     nivel = 0
                 if nivel > 4:
                     nivel = 4
-                Permiso(
-                    rol=rol,
-                    modulo=modulo,
-                    nivel=nivel,
-                    nombre=f"{rol.nombre} puede {Permiso.NIVELES[nivel]} en {modulo.nombre}",
-                    estatus=estatus,
-                ).save()
-            contador += 1
-            click.echo(click.style(".", fg="green"), nl=False)
+                filas.append(
+                    {
+                        "rol_id": rol_id,
+                        "modulo_id": modulo_id,
+                        "nivel": nivel,
+                        "nombre": f"{roles[rol_id]} puede {Permiso.NIVELES[nivel]} en {modulo_nombre}",
+                        "estatus": estatus,
+                    }
+                )
+    contador = cargar_filas(Permiso, filas)
+    incrementar_permisos_version()
     click.echo()
     click.echo(click.style(f"  {contador} permisos alimentados.", fg="green"))
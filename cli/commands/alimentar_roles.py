@@ -2,14 +2,15 @@
 Alimentar Roles
 """
 
-from pathlib import Path
 import csv
 import sys
+from pathlib import Path
 
 import click
 
-from lib.safe_string import safe_string
 from citas_admin.blueprints.roles.models import Rol
+from cli.commands.cargar import cargar_filas, incrementar_permisos_version
+from lib.safe_string import safe_string
 
 ROLES_CSV = "seed/roles_permisos.csv"
 
@@ -24,21 +25,24 @@ def alimentar_roles():
         click.echo(f"AVISO: {ruta.name} no es un archivo.")
         sys.exit(1)
     click.echo("Alimentando roles: ", nl=False)
-    contador = 0
+    filas = []
     with open(ruta, encoding="utf8") as puntero:
         rows = csv.DictReader(puntero)
         for row in rows:
             rol_id = int(row["rol_id"])
             nombre = safe_string(row["nombre"], save_enie=True)
             estatus = row["estatus"]
-            if rol_id != contador + 1:
+            if rol_id != len(filas) + 1:
                 click.echo(click.style(f"  AVISO: rol_id {rol_id} no es consecutivo", fg="red"))
                 sys.exit(1)
-            Rol(
-                nombre=nombre,
-                estatus=estatus,
-            ).save()
-            contador += 1
-            click.echo(click.style(".", fg="green"), nl=False)
+            filas.append(
+                {
+                    "id": rol_id,
+                    "nombre": nombre,
+                    "estatus": estatus,
+                }
+            )
+    contador = cargar_filas(Rol, filas)
+    incrementar_permisos_version()
     click.echo()
     click.echo(click.style(f"  {contador} roles alimentados.", fg="green"))
@@ -13,6 +13,7 @@ from citas_admin.blueprints.autoridades.models import Autoridad
 from citas_admin.blueprints.oficinas.models import Oficina
 from citas_admin.blueprints.usuarios.models import Usuario
 from citas_admin.extensions import pwd_context
+from cli.commands.cargar import cargar_filas, consultar_claves, consultar_ids
 from lib.pwgen import generar_contrasena
 from lib.safe_string import safe_clave, safe_email, safe_string
 
@@ -28,8 +29,10 @@ def alimentar_usuarios():
     if not ruta.is_file():
         click.echo(f"AVISO: {ruta.name} no es un archivo.")
         sys.exit(1)
+    autoridades = consultar_claves(Autoridad.clave, Autoridad.id)
+    oficinas_ids = consultar_ids(Oficina)
     click.echo("Alimentando usuarios: ", nl=False)
-    contador = 0
+    filas = []
     with open(ruta, encoding="utf8") as puntero:
         rows = csv.DictReader(puntero)
         for row in rows:
@@ -41,30 +44,30 @@ def alimentar_usuarios():
             apellido_paterno = safe_string(row["apellido_paterno"], save_enie=True)
             apellido_materno = safe_string(row["apellido_materno"], save_enie=True)
             estatus = row["estatus"]
-            if usuario_id != contador + 1:
+            if usuario_id != len(filas) + 1:
                 click.echo(click.style(f"  AVISO: usuario_id {usuario_id} no es consecutivo", fg="red"))
                 sys.exit(1)
-            autoridad = Autoridad.query.filter_by(clave=autoridad_clave).first()
-            if autoridad is None:
+            if autoridad_clave not in autoridades:
                 click.echo(click.style(f"  AVISO: autoridad_clave {autoridad_clave} no existe", fg="red"))
                 sys.exit(1)
-            oficina = Oficina.query.get(oficina_id)
-            if oficina is None:
+            if oficina_id not in oficinas_ids:
                 click.echo(click.style(f"  AVISO: oficina_id {oficina_id} no existe", fg="red"))
                 sys.exit(1)
-            Usuario(
-                autoridad=autoridad,
-                oficina=oficina,
-                email=email,
-                nombres=nombres,
-                apellido_paterno=apellido_paterno,
-                apellido_materno=apellido_materno,
-                estatus=estatus,
-                contrasena=pwd_context.hash(generar_contrasena()),
-                api_key="",
-                api_key_expiracion=datetime(year=2000, month=1, day=1),
-            ).save()
-            contador += 1
-            click.echo(click.style(".", fg="green"), nl=False)
+            filas.append(
+                {
+                    "id": usuario_id,
+                    "autoridad_id": autoridades[autoridad_clave],
+                    "oficina_id": oficina_id,
+                    "email": email,
+                    "nombres": nombres,
+                    "apellido_paterno": apellido_paterno,
+                    "apellido_materno": apellido_materno,
+                    "estatus": estatus,
+                    "contrasena": pwd_context.hash(generar_contrasena()),
+                    "api_key": "",
+                    "api_key_expiracion": datetime(year=2000, month=1, day=1),
+                }
+            )
+    contador = cargar_filas(Usuario, filas)
     click.echo()
     click.echo(click.style(f"  {contador} usuarios alimentados.", fg="green"))
@@ -2,15 +2,16 @@
 Alimentar Usuarios-Roles
 """
 
-from pathlib import Path
 import csv
 import sys
+from pathlib import Path
 
 import click
 
 from citas_admin.blueprints.roles.models import Rol
 from citas_admin.blueprints.usuarios.models import Usuario
 from citas_admin.blueprints.usuarios_roles.models import UsuarioRol
+from cli.commands.cargar import cargar_filas, consultar_claves, incrementar_permisos_version
 
 USUARIOS_ROLES_CSV = "seed/usuarios_roles.csv"
 
@@ -24,27 +25,29 @@ def alimentar_usuarios_roles():
     if not ruta.is_file():
         click.echo(f"AVISO: {ruta.name} no es un archivo.")
         sys.exit(1)
+    usuarios = consultar_claves(Usuario.id, Usuario.email)
+    roles = consultar_claves(Rol.nombre, Rol.id)
     click.echo("Alimentando usuarios-roles: ", nl=False)
-    contador = 0
+    filas = []
     with open(ruta, encoding="utf8") as puntero:
         rows = csv.DictReader(puntero)
         for row in rows:
             usuario_id = int(row["usuario_id"])
-            usuario = Usuario.query.get(usuario_id)
-            if usuario is None:
+            if usuario_id not in usuarios:
                 click.echo(click.style(f"  AVISO: usuario_id {usuario_id} no existe", fg="red"))
                 sys.exit(1)
             for rol_nombre in row["roles"].split(","):
                 rol_nombre = rol_nombre.strip().upper()
-                rol = Rol.query.filter_by(nombre=rol_nombre).first()
-                if rol is None:
+                if rol_nombre not in roles:
                     continue
-                UsuarioRol(
-                    usuario=usuario,
-                    rol=rol,
-                    descripcion=f"{usuario.email} en {rol.nombre}",
-                ).save()
-                contador += 1
-                click.echo(click.style(".", fg="green"), nl=False)
+                filas.append(
+                    {
+                        "usuario_id": usuario_id,
+                        "rol_id": roles[rol_nombre],
+                        "descripcion": f"{usuarios[usuario_id]} en {rol_nombre}",
+                    }
+                )
+    contador = cargar_filas(UsuarioRol, filas)
+    incrementar_permisos_version()
     click.echo()
     click.echo(click.style(f"  {contador} usuarios-roles alimentados.", fg="green"))
@@ -0,0 +1,107 @@
+"""
+Cargar
+
+Carga masiva para alimentar las tablas desde los CSV de seed/ en una transacción por tabla.
+
+- Las llaves foráneas se validan contra conjuntos o diccionarios en memoria, tomados con consultar_ids o consultar_claves
+- En PostgreSQL las filas entran por lotes con COPY FROM STDIN, en otras bases de datos con INSERT de varias filas
+- Al terminar se reinicia la secuencia de la columna id al valor más alto
+
+Ejemplo
+
+    distritos_ids = consultar_ids(Distrito)
+    filas = []
+    for row in rows:
+        if int(row["distrito_id"]) not in distritos_ids:
+            ...
+        filas.append({"id": int(row["oficina_id"]), "distrito_id": int(row["distrito_id"]), ...})
+    contador = cargar_filas(Oficina, filas)
+"""
+
+import csv
+import io
+
+import click
+from flask import current_app
+from redis.exceptions import RedisError
+from sqlalchemy import func, insert, select, text
+
+from citas_admin.extensions import database
+
+CARGAR_LOTE = 5000  # Filas por lote que se envían a la base de datos
+COPY_NULL = r"\N"  # Texto que representa NULL en el CSV de COPY, así las cadenas vacías se conservan
+
+
+def consultar_ids(modelo) -> set:
+    """Consultar los id de una tabla en un conjunto, para validar llaves foráneas sin consultar por cada fila"""
+    return set(database.session.execute(select(modelo.id)).scalars())
+
+
+def consultar_claves(columna_clave, columna_valor) -> dict:
+    """Consultar un diccionario clave: valor, por ejemplo Distrito.clave: Distrito.id"""
+    return dict(database.session.execute(select(columna_clave, columna_valor)).all())
+
+
+def cargar_filas(modelo, filas: list, lote: int = CARGAR_LOTE) -> int:
+    """Cargar las filas (diccionarios con los nombres de las columnas) en una sola transacción, entrega la cantidad"""
+    tabla = modelo.__table__
+    if len(filas) == 0:
+        return 0
+    filas = [_completar_defaults(tabla, fila) for fila in filas]
+    columnas = list(filas[0].keys())
+    contador = 0
+    with database.engine.begin() as conexion:
+        es_postgresql = conexion.dialect.name == "postgresql" and conexion.dialect.driver == "psycopg2"
+        for inicio in range(0, len(filas), lote):
+            filas_lote = filas[inicio : inicio + lote]
+            if es_postgresql:
+                _copiar_lote(conexion, tabla.name, columnas, filas_lote)
+            else:
+                conexion.execute(insert(tabla), filas_lote)
+            contador += len(filas_lote)
+            click.echo(click.style(".", fg="green"), nl=False)
+        if es_postgresql and "id" in tabla.c:
+            _reiniciar_secuencia(conexion, tabla)
+    return contador
+
+
+def incrementar_permisos_version() -> None:
+    """La carga masiva no pasa por la sesión, incrementar la versión de los permisos para que no se usen los de Redis"""
+    # Importar aquí para no cargar los modelos de usuarios desde los comandos que no los usan
+    from citas_admin.blueprints.usuarios.models import PERMISOS_VERSION_KEY
+
+    try:
+        current_app.redis.incr(PERMISOS_VERSION_KEY)
+    except RedisError:
+        pass
+
+
+def _completar_defaults(tabla, fila: dict) -> dict:
+    """Agregar los valores por defecto de Python que COPY no aplica, los de la base de datos se dejan al servidor"""
+    for columna in tabla.columns:
+        if columna.name not in fila and columna.default is not None and columna.default.is_scalar:
+            fila[columna.name] = columna.default.arg
+    return fila
+
+
+def _copiar_lote(conexion, tabla_nombre: str, columnas: list, filas: list) -> None:
+    """Enviar un lote con COPY FROM STDIN en formato CSV"""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    for fila in filas:
+        escritor.writerow([COPY_NULL if fila[columna] is None else fila[columna] for columna in columnas])
+    buffer.seek(0)
+    sentencia = f"COPY {tabla_nombre} ({', '.join(columnas)}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')"
+    with conexion.connection.cursor() as cursor:
+        cursor.copy_expert(sentencia, buffer)
+
+
+def _reiniciar_secuencia(conexion, tabla) -> None:
+    """Reiniciar la secuencia de la columna id al valor más alto, para que los siguientes registros no choquen"""
+    maximo = conexion.execute(select(func.max(tabla.c.id))).scalar()
+    if maximo is None:
+        return
+    conexion.execute(
+        text("SELECT setval(pg_get_serial_sequence(:tabla, 'id'), :maximo)"),
+        {"tabla": tabla.name, "maximo": maximo},
+    )
@@ -5,6 +5,9 @@ CLI Cit Citas
 - enviar_cancelado: Enviar mensaje vía email de una cita cancelada
 - enviar_asistio: Enviar mensaje vía email de su cita a la que asistió
 - enviar_inasistencia: Enviar un mensaje vía email de una cita por Inasistencia
+- actualizar_diarias: Actualizar la tabla cit_citas_diarias para el tablero
+- enviar_recordatorios: Enviar recordatorios de las citas del día siguiente, para ejecutar cada día
+- marcar_inasistencias: Marcar como INASISTENCIA las citas pendientes de los días anteriores, para ejecutar cada noche
 """
 
 import sys
@@ -13,6 +16,7 @@ import click
 
 from citas_admin.app import create_app
 from citas_admin.blueprints.cit_citas.models import CitCita
+from citas_admin.blueprints.usuarios.models import Usuario
 from citas_admin.extensions import database
 
 app = create_app()
@@ -185,7 +189,74 @@ def enviar_inasistencia(cit_cita_id: int, to_email: str):
     click.echo(f"Se lanzado una tarea en el fondo para enviar un mensaje a {to_email}")
 
 
+@click.command()
+@click.option("--desde-cero", is_flag=True, help="Reconstruir toda la tabla")
+def actualizar_diarias(desde_cero: bool):
+    """Actualizar la tabla cit_citas_diarias para el tablero"""
+    click.echo("Actualizar cit_citas_diarias")
+
+    # Agregar tarea en el fondo para actualizar
+    app.task_queue.enqueue(
+        "citas_admin.blueprints.cit_citas_diarias.tasks.lanzar_actualizar",
+        desde_cero=desde_cero,
+    )
+
+    # Mostrar mensaje de termino
+    click.echo("Se lanzado una tarea en el fondo para actualizar cit_citas_diarias")
+
+
+@click.command()
+@click.option("--usuario-email", envvar="CIT_CITAS_USUARIO_EMAIL", required=True, help="Usuario de la tarea", type=str)
+@click.option("--fecha", default=None, help="Fecha AAAA-MM-DD de las citas, por defecto mañana", type=str)
+def enviar_recordatorios(usuario_email: str, fecha: str):
+    """Enviar recordatorios de las citas del día siguiente"""
+    click.echo("Enviar recordatorios de las citas del día siguiente")
+
+    # Consultar el usuario que lanza la tarea
+    usuario = Usuario.query.filter_by(email=usuario_email).first()
+    if usuario is None:
+        click.echo(f"ERROR: No se encontró el usuario con el e-mail {usuario_email}")
+        sys.exit(1)
+
+    # Lanzar una sola tarea en el fondo, su avance se consulta en Tareas
+    tarea = usuario.launch_task(
+        comando="cit_citas.tasks.lanzar_enviar_recordatorios",
+        mensaje="Enviando recordatorios de las citas del día siguiente",
+        fecha=fecha,
+    )
+
+    # Mostrar mensaje de termino
+    click.echo(f"Se lanzado la tarea {tarea.id} en el fondo para enviar los recordatorios")
+
+
+@click.command()
+@click.option("--usuario-email", envvar="CIT_CITAS_USUARIO_EMAIL", required=True, help="Usuario para la bitácora", type=str)
+@click.option("--sin-mensajes", is_flag=True, help="No enviar los mensajes de inasistencia")
+def marcar_inasistencias(usuario_email: str, sin_mensajes: bool):
+    """Marcar como INASISTENCIA las citas pendientes de los días anteriores"""
+    click.echo("Marcar como INASISTENCIA las citas pendientes de los días anteriores")
+
+    # Consultar el usuario para la bitácora
+    usuario = Usuario.query.filter_by(email=usuario_email).first()
+    if usuario is None:
+        click.echo(f"ERROR: No se encontró el usuario con el e-mail {usuario_email}")
+        sys.exit(1)
+
+    # Agregar tarea en el fondo para marcar las citas, la misma tarea encola los mensajes por lotes
+    app.task_queue.enqueue(
+        "citas_admin.blueprints.cit_citas.tasks.marcar_inasistencias",
+        usuario_id=usuario.id,
+        notificar=not sin_mensajes,
+    )
+
+    # Mostrar mensaje de termino
+    click.echo("Se lanzado una tarea en el fondo para marcar las citas como INASISTENCIA")
+
+
 cli.add_command(enviar_pendiente)
 cli.add_command(enviar_cancelado)
 cli.add_command(enviar_asistio)
 cli.add_command(enviar_inasistencia)
+cli.add_command(actualizar_diarias)
+cli.add_command(enviar_recordatorios)
+cli.add_command(marcar_inasistencias)
@@ -22,7 +22,15 @@ from cli.commands.alimentar_permisos import alimentar_permisos
 from cli.commands.alimentar_roles import alimentar_roles
 from cli.commands.alimentar_usuarios import alimentar_usuarios
 from cli.commands.alimentar_usuarios_roles import alimentar_usuarios_roles
-from cli.commands.copiar import copiar_tabla
+from cli.commands.copiar import COPIAR_HILOS, COPIAR_LOTE, copiar_tablas, sincronizar_tablas
+from cli.commands.respaldar import (
+    COMPRESIONES,
+    HILOS,
+    RESPALDOS_DIR,
+    TABLAS_TRANSACCIONALES,
+    respaldar_en_paralelo,
+    respaldar_tabla,
+)
 from cli.commands.respaldar_autoridades import respaldar_autoridades
 from cli.commands.respaldar_distritos import respaldar_distritos
 from cli.commands.respaldar_domicilios import respaldar_domicilios
@@ -43,6 +51,21 @@ load_dotenv()  # Take environment variables from .env
 entorno_implementacion = os.environ.get("DEPLOYMENT_ENVIRONMENT", "develop").upper()
 RESPALDOS_BASE_DIR = os.getenv("RESPALDOS_BASE_DIR", "")
 
+# Tablas que se copian o sincronizan desde la BD de origen
+TABLAS_COPIAR = [
+    "cit_categorias",
+    "cit_servicios",
+    "cit_oficinas_servicios",
+    "cit_clientes",
+    "cit_clientes_recuperaciones",
+    "cit_clientes_registros",
+    "cit_dias_inhabiles",
+    "cit_horas_bloqueadas",
+    "cit_citas",
+    "pag_tramites_servicios",
+    "pag_pagos",
+]
+
 
 @click.group()
 def cli():
@@ -89,36 +112,50 @@ def reiniciar(ctx):
 
 
 @click.command()
-def respaldar():
-    """Respaldar"""
-    respaldar_autoridades()
-    respaldar_distritos()
-    respaldar_domicilios()
-    respaldar_materias()
-    respaldar_modulos()
-    respaldar_oficinas()
-    respaldar_roles_permisos()
-    respaldar_usuarios_roles()
+@click.option("--compresion", type=click.Choice(list(COMPRESIONES)), default="ninguna", help="Comprimir al escribir")
+@click.option("--directorio", default=RESPALDOS_DIR, type=str, help="Directorio para las tablas transaccionales")
+@click.option("--hilos", default=HILOS, type=int, help="Conexiones en paralelo")
+@click.option("--sin-transaccionales", is_flag=True, help="Sólo respaldar los catálogos de seed")
+def respaldar(compresion, directorio, hilos, sin_transaccionales):
+    """Respaldar los catálogos en seed y las tablas transaccionales en el directorio"""
+    respaldos = [
+        respaldar_autoridades(),
+        respaldar_distritos(),
+        respaldar_domicilios(),
+        respaldar_materias(),
+        respaldar_modulos(),
+        respaldar_oficinas(),
+        respaldar_roles_permisos(),
+        respaldar_usuarios_roles(),
+    ]
+    if not sin_transaccionales:
+        # Las tablas grandes van primero para que empiecen antes en el paralelo
+        respaldos = [respaldar_tabla(tabla, directorio) for tabla in TABLAS_TRANSACCIONALES] + respaldos
+    click.echo("Respaldando: ")
+    respaldar_en_paralelo(respaldos, compresion, hilos)
     click.echo("Termina respaldar.")
 
 
 @click.command()
-def copiar():
-    """Copiar los registros de varias tablas desde la BD de origen a la BD de destino"""
-    copiar_tabla("cit_categorias")
-    copiar_tabla("cit_servicios")
-    copiar_tabla("cit_oficinas_servicios")
-    copiar_tabla("cit_clientes")
-    copiar_tabla("cit_clientes_recuperaciones")
-    copiar_tabla("cit_clientes_registros")
-    copiar_tabla("cit_dias_inhabiles")
-    copiar_tabla("cit_horas_bloqueadas")
-    copiar_tabla("cit_citas")
-    copiar_tabla("pag_tramites_servicios")
-    copiar_tabla("pag_pagos")
+@click.option("--hilos", default=COPIAR_HILOS, type=int, help="Tablas que se copian a la vez")
+@click.option("--lote", default=COPIAR_LOTE, type=int, help="Registros por lote")
+def copiar(hilos, lote):
+    """Copiar los registros de varias tablas desde la BD de origen a la BD de destino, continúa si se interrumpió"""
+    click.echo("Copiando tablas: ")
+    copiar_tablas(TABLAS_COPIAR, hilos, lote)
     click.echo("Termina copiar.")
 
 
+@click.command()
+@click.option("--hilos", default=COPIAR_HILOS, type=int, help="Tablas que se sincronizan a la vez")
+@click.option("--lote", default=COPIAR_LOTE, type=int, help="Registros por lote")
+def sincronizar(hilos, lote):
+    """Sincronizar en la BD de destino los registros modificados en la BD de origen desde la última vez"""
+    click.echo("Sincronizando tablas: ")
+    sincronizar_tablas(TABLAS_COPIAR, hilos, lote)
+    click.echo("Termina sincronizar.")
+
+
 @click.command()
 @click.argument("anio_mes", type=str)
 def generar_sicgd_csv(anio_mes):
@@ -204,4 +241,5 @@ cli.add_command(alimentar)
 cli.add_command(reiniciar)
 cli.add_command(respaldar)
 cli.add_command(copiar)
+cli.add_command(sincronizar)
 cli.add_command(generar_sicgd_csv)
@@ -1,15 +1,23 @@
 """
 CLI Pag Pagos
 
+- cancelar_solicitados_expirados: Cancelar Pagos SOLICITADOS con la caducidad vencida, para ejecutar cada día
+- enviar_mensajes_comprobantes: Enviar los comprobantes de los Pagos PAGADOS que no se han enviado
 - exportar_xlsx: Exportar Pagos PAGADOS y ENTREGADOS a un archivo XLSX
+- conciliar: Comparar resultado_xml con el estado, el folio y el total de los Pagos
 """
 
 import sys
 from datetime import datetime
 
 import click
+from flask import current_app
+from rq import Queue
 
+from citas_admin.blueprints.pag_pagos.tasks import CONCILIAR_PROCESOS
+from citas_admin.blueprints.pag_pagos.tasks import conciliar as conciliar_task
 from citas_admin.blueprints.pag_pagos.tasks import exportar_xlsx as exportar_xlsx_task
+from citas_admin.blueprints.usuarios.models import Usuario
 from lib.exceptions import MyAnyError
 
 
@@ -19,13 +27,40 @@ def cli():
 
 
 @click.command()
-def cancelar_solicitados_expirados():
-    """Cancelar Pagos en estado SOLICIADO que hayan sido creados hace más de 2 horas"""
+@click.option("--usuario-email", envvar="PAG_PAGOS_USUARIO_EMAIL", required=True, help="Usuario para la bitácora", type=str)
+def cancelar_solicitados_expirados(usuario_email: str):
+    """Cancelar Pagos en estado SOLICITADO cuya caducidad ya pasó"""
+    click.echo("Cancelar Pagos en estado SOLICITADO cuya caducidad ya pasó")
+
+    # Consultar el usuario para la bitácora
+    usuario = Usuario.query.filter_by(email=usuario_email).first()
+    if usuario is None:
+        click.echo(f"ERROR: No se encontró el usuario con el e-mail {usuario_email}")
+        sys.exit(1)
+
+    # Agregar tarea en el fondo, un solo UPDATE cancela todos los pagos
+    current_app.task_queue.enqueue(
+        "citas_admin.blueprints.pag_pagos.tasks.cancelar_solicitados_expirados",
+        usuario_id=usuario.id,
+    )
+
+    # Mostrar mensaje de termino
+    click.echo("Se lanzado una tarea en el fondo para cancelar los Pagos SOLICITADOS con la caducidad vencida")
 
 
 @click.command()
-def enviar_mensajes_comprobantes():
-    """Enviar mensajes de comprobantes de pago (cuyo estado es PAGADO) que hayan sido creados hace más de 1 horas"""
+@click.option("--tareas", default=1, help="Tareas que envían a la vez, cada una toma sus propios lotes", type=int)
+def enviar_mensajes_comprobantes(tareas: int):
+    """Enviar mensajes de comprobantes de pago (cuyo estado es PAGADO) que no se han enviado"""
+    click.echo("Enviar mensajes de comprobantes de pago")
+
+    # Agregar las tareas en el fondo de una vez, los lotes se bloquean con SKIP LOCKED para no repetir pagos
+    current_app.task_queue.enqueue_many(
+        [Queue.prepare_data("citas_admin.blueprints.pag_pagos.tasks.enviar_comprobantes") for _ in range(max(1, tareas))]
+    )
+
+    # Mostrar mensaje de termino
+    click.echo(f"Se lanzaron {max(1, tareas)} tareas en el fondo para enviar los comprobantes de pago")
 
 
 @click.command()
@@ -53,4 +88,35 @@ def exportar_xlsx(desde: str = None, hasta: str = None):
     click.echo(click.style(mensaje_termino, fg="green"))
 
 
+@click.command()
+@click.option("--desde", help="Fecha de inicio (YYYY-MM-DD), por defecto hace un año")
+@click.option("--hasta", help="Fecha de termino (YYYY-MM-DD), por defecto hoy")
+@click.option("--formato", default="xlsx", type=click.Choice(["csv", "parquet", "xlsx"]), help="Formato del reporte")
+@click.option("--procesos", default=CONCILIAR_PROCESOS, help="Procesos que analizan las respuestas", type=int)
+def conciliar(desde: str, hasta: str, formato: str, procesos: int):
+    """Comparar resultado_xml con el estado, el folio y el total de los Pagos"""
+
+    # Convertir las fechas desde y hasta a dates
+    try:
+        desde = datetime.strptime(desde, "%Y-%m-%d").date() if desde else None
+        hasta = datetime.strptime(hasta, "%Y-%m-%d").date() if hasta else None
+    except ValueError:
+        click.echo(click.style("Las fechas deben tener el formato YYYY-MM-DD", fg="red"))
+        sys.exit(1)
+
+    # Ejecutar la tarea
+    try:
+        mensaje_termino, nombre_archivo, _ = conciliar_task(desde, hasta, formato, procesos)
+    except MyAnyError as error:
+        click.echo(click.style(str(error), fg="red"))
+        sys.exit(1)
+
+    # Mensaje de termino
+    click.echo(click.style(mensaje_termino, fg="green"))
+    click.echo(f"Reporte en {nombre_archivo}")
+
+
+cli.add_command(cancelar_solicitados_expirados)
+cli.add_command(enviar_mensajes_comprobantes)
 cli.add_command(exportar_xlsx)
+cli.add_command(conciliar)
@@ -0,0 +1,203 @@
+"""
+CLI Web Pay Plus
+
+- simular: Servidor local que responde como WPP, para medir sin conectarse al banco
+- medir: Crear muchos links de pago y mostrar cuántos por segundo
+- medir_codec: Comparar el cifrado y el análisis de respuestas de WPPCodec con la forma anterior
+
+Todos usan WPP_KEY para cifrar y descifrar, el servidor simulado no valida WPP_COMMERCE_ID.
+"""
+
+import asyncio
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from uuid import uuid4
+
+import click
+
+from lib.exceptions import MyAnyError
+from lib.v_AESEncryption import AES128Encryption
+from lib.wpp import (
+    close_async_client,
+    create_pay_link,
+    create_pay_link_async,
+    decrypt_chain,
+    encrypt_chain,
+    get_codec,
+    get_response,
+    get_responses,
+)
+
+
+@click.group()
+def cli():
+    """Web Pay Plus"""
+
+
+class ManejadorWPP(BaseHTTPRequestHandler):
+    """Responder como WPP: descifrar la cadena y entregar cifrado un nb_url con la referencia"""
+
+    protocol_version = "HTTP/1.1"  # Conservar las conexiones abiertas, como el servidor real
+    latencia = 0.0  # Segundos que tarda en responder
+
+    def do_POST(self):
+        """Crear un link de pago"""
+        cuerpo = self.rfile.read(int(self.headers.get("Content-Length", "0"))).decode()
+        try:
+            pgs = ET.fromstring(cuerpo.removeprefix("xml="))
+            cadena = ET.fromstring(decrypt_chain(pgs.find("data").text))
+            referencia = cadena.find("url/reference").text
+        except (AttributeError, ET.ParseError, ValueError):
+            self._responder(400, "Cadena no válida")
+            return
+        if self.latencia > 0:
+            time.sleep(self.latencia)
+        respuesta = ET.Element("P_RESPONSE")
+        ET.SubElement(respuesta, "cd_response").text = "success"
+        ET.SubElement(respuesta, "nb_url").text = f"http://{self.headers.get('Host')}/pago/{referencia}/{uuid4().hex}"
+        self._responder(200, encrypt_chain(ET.tostring(respuesta, encoding="unicode")).decode())
+
+    def _responder(self, estado: int, texto: str):
+        """Enviar la respuesta con su longitud, para que el cliente pueda reutilizar la conexión"""
+        contenido = texto.encode()
+        self.send_response(estado)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(contenido)))
+        self.end_headers()
+        self.wfile.write(contenido)
+
+    def log_message(self, format, *args):
+        """No escribir una línea por petición"""
+
+
+@click.command()
+@click.option("--puerto", default=8081, help="Puerto", type=int)
+@click.option("--latencia", default=0.05, help="Segundos que tarda en responder", type=float)
+def simular(puerto: int, latencia: float):
+    """Servidor local que responde como WPP"""
+    if os.getenv("WPP_KEY") is None:
+        click.echo("ERROR: Falta definir WPP_KEY")
+        sys.exit(1)
+    ManejadorWPP.latencia = latencia
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), ManejadorWPP)
+    click.echo(f"Servidor WPP simulado en http://127.0.0.1:{puerto} con {latencia} segundos de latencia")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+@click.command()
+@click.option("--cantidad", default=200, help="Links de pago a crear", type=int)
+@click.option("--concurrencia", default=20, help="Links que se crean a la vez", type=int)
+@click.option("--modo", default="sync", type=click.Choice(["sync", "async"]), help="Cliente síncrono o asyncio")
+@click.option("--url", default=None, help="URL de WPP, por defecto WPP_URL", type=str)
+def medir(cantidad: int, concurrencia: int, modo: str, url: str):
+    """Crear muchos links de pago y mostrar cuántos por segundo"""
+    if url is not None:
+        os.environ["WPP_URL"] = url
+    if os.getenv("WPP_COMMERCE_ID") is None:
+        os.environ["WPP_COMMERCE_ID"] = "SIMULADO"
+    argumentos = [(f"cliente{numero}@correo.com", "Prueba", numero, 100.0) for numero in range(cantidad)]
+
+    # Crear los links
+    inicio = time.perf_counter()
+    if modo == "async":
+        errores = asyncio.run(_medir_async(argumentos, concurrencia))
+    else:
+        errores = _medir_sync(argumentos, concurrencia)
+    segundos = time.perf_counter() - inicio
+
+    # Mostrar resultados
+    for error in errores[:5]:
+        click.echo(click.style(f"  {error}", fg="red"))
+    creados = cantidad - len(errores)
+    click.echo(f"Se crearon {creados} links en {segundos:.2f} segundos, {creados / segundos:.1f} por segundo ({modo})")
+
+
+def _medir_sync(argumentos: list, concurrencia: int) -> list:
+    """Crear los links en varios hilos, entrega los errores"""
+    errores = []
+    with ThreadPoolExecutor(max_workers=concurrencia) as ejecutor:
+        for futuro in as_completed([ejecutor.submit(create_pay_link, *argumento) for argumento in argumentos]):
+            try:
+                futuro.result()
+            except MyAnyError as error:
+                errores.append(str(error))
+    return errores
+
+
+async def _medir_async(argumentos: list, concurrencia: int) -> list:
+    """Crear los links con asyncio, a lo más concurrencia a la vez, entrega los errores"""
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async def crear(argumento):
+        async with semaforo:
+            return await create_pay_link_async(*argumento)
+
+    try:
+        resultados = await asyncio.gather(*(crear(argumento) for argumento in argumentos), return_exceptions=True)
+    finally:
+        await close_async_client()
+    errores = []
+    for resultado in resultados:
+        if isinstance(resultado, MyAnyError):
+            errores.append(str(resultado))
+        elif isinstance(resultado, BaseException):
+            raise resultado
+    return errores
+
+
+@click.command()
+@click.option("--cantidad", default=5000, help="Repeticiones de cada prueba", type=int)
+def medir_codec(cantidad: int):
+    """Comparar el cifrado y el análisis de respuestas de WPPCodec con la forma anterior"""
+    if os.getenv("WPP_KEY") is None:
+        os.environ["WPP_KEY"] = os.urandom(16).hex()
+    llave = os.environ["WPP_KEY"]
+
+    # Una respuesta como las que guarda pag_pagos.resultado_xml, con la declaración en su propio renglón
+    respuesta = ET.Element("CENTEROFPAYMENTS")
+    for nodo, texto in [("reference", "123"), ("response", "approved"), ("foliocpagos", "987654"), ("auth", "A1B2C3")]:
+        ET.SubElement(respuesta, nodo).text = texto
+    ET.SubElement(respuesta, "email").text = "cliente@correo.com"
+    texto_xml = '<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(respuesta, encoding="unicode")
+    cifrados = [get_codec(llave).encrypt(texto_xml) for _ in range(cantidad)]
+
+    # Pruebas
+    pruebas = [
+        ("Cifrar, AES128Encryption en cada llamada", lambda: [AES128Encryption().encrypt(texto_xml, llave) for _ in cifrados]),
+        ("Cifrar, WPPCodec", lambda: [encrypt_chain(texto_xml) for _ in cifrados]),
+        ("Descifrar, AES128Encryption en cada llamada", lambda: [AES128Encryption().decrypt(llave, c) for c in cifrados]),
+        ("Descifrar, WPPCodec", lambda: [decrypt_chain(cifrado) for cifrado in cifrados]),
+        ("Respuesta, renglón por renglón", lambda: [_get_response_anterior(llave, cifrado) for cifrado in cifrados]),
+        ("Respuesta, get_response", lambda: [get_response(cifrado) for cifrado in cifrados]),
+        ("Respuestas, get_responses en lote", lambda: list(get_responses(cifrados))),
+    ]
+    for nombre, prueba in pruebas:
+        inicio = time.perf_counter()
+        prueba()
+        microsegundos = (time.perf_counter() - inicio) * 1_000_000 / cantidad
+        click.echo(f"  {nombre:<48} {microsegundos:8.1f} µs")
+
+
+def _get_response_anterior(llave: str, cifrado: bytes) -> dict:
+    """La forma anterior de get_response, para comparar"""
+    xml = AES128Encryption().decrypt(llave, cifrado)
+    xml_limpio = ""
+    for line in xml.split("\n"):
+        if "<?" not in line:
+            xml_limpio += line
+    root = ET.fromstring(xml_limpio)
+    return {nodo: root.find(nodo).text for nodo in ("reference", "response", "foliocpagos", "auth", "email")}
+
+
+cli.add_command(simular)
+cli.add_command(medir)
+cli.add_command(medir_codec)
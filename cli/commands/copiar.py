@@ -1,19 +1,190 @@
 """
 Copiar
+
+Copiar tablas de la BD de origen a la BD de destino por lotes.
+
+- La tabla de origen se recorre con un cursor con nombre (del lado del servidor) en orden de id, por lotes de COPIAR_LOTE
+- Cada lote se inserta y se confirma, así el id más alto en el destino es el punto de control: si la copia se
+  interrumpe, al volver a ejecutarla continúa desde ese id en lugar de empezar de nuevo
+- Las tablas que no dependen entre sí se copian en paralelo, una tabla espera a que terminen las tablas a las que
+  hace referencia con sus llaves foráneas
+- Cada hilo conserva sus conexiones para las tablas que le toquen
+
+Sincronizar
+
+Para mantener al día una réplica, sincronizar_tablas copia sólo los registros cuyo modificado es posterior a la marca
+de la última sincronización y los inserta o actualiza con ON CONFLICT (id) DO UPDATE.
+
+- Las marcas se guardan por tabla en la tabla SINCRONIZAR_MARCAS del destino, en la misma transacción de cada lote
+- Se vuelve a leer SINCRONIZAR_TRASLAPE antes de la marca, por los registros de transacciones que confirmaron después
+- Los borrados son lógicos (estatus B) y cambian modificado, así que también se sincronizan
 """
 
 import os
 import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
 
 import click
 import psycopg2
+import psycopg2.extras
 from dotenv import load_dotenv
 
+from citas_admin.extensions import database
+
 load_dotenv()  # Take environment variables from .env
 
+COPIAR_HILOS = 4  # Tablas que se copian a la vez
+COPIAR_LOTE = 10000  # Registros por lote
+SINCRONIZAR_MARCAS = "sincronizar_marcas"  # Tabla en el destino con el último modificado sincronizado por tabla
+SINCRONIZAR_TRASLAPE = timedelta(minutes=5)  # Margen que se vuelve a leer antes de la marca
+
+# Conexiones por hilo
+_conexiones = threading.local()
+_conexiones_abiertas = []
+_conexiones_candado = threading.Lock()
+
+
+def copiar_tablas(tablas: list, hilos: int = COPIAR_HILOS, lote: int = COPIAR_LOTE):
+    """Copiar varias tablas en paralelo respetando el orden de sus llaves foráneas"""
+    _en_paralelo(copiar_tabla, "se copiaron", tablas, hilos, lote)
+
+
+def sincronizar_tablas(tablas: list, hilos: int = COPIAR_HILOS, lote: int = COPIAR_LOTE):
+    """Sincronizar varias tablas en paralelo respetando el orden de sus llaves foráneas"""
+    _en_paralelo(sincronizar_tabla, "se sincronizaron", tablas, hilos, lote)
+
+
+def _en_paralelo(funcion, accion: str, tablas: list, hilos: int, lote: int):
+    """Ejecutar la función con cada tabla en paralelo, una tabla espera a que terminen las tablas de las que depende"""
+
+    # Para cada tabla, las tablas de la lista de las que depende
+    dependencias = {}
+    for tabla in tablas:
+        referidas = {llave.column.table.name for llave in database.metadata.tables[tabla].foreign_keys}
+        dependencias[tabla] = (referidas & set(tablas)) - {tabla}
+
+    # Lanzar cada tabla cuando ya se copiaron sus dependencias
+    pendientes = list(tablas)
+    terminadas = set()
+    try:
+        with ThreadPoolExecutor(max_workers=hilos) as ejecutor:
+            en_curso = {}
+            while pendientes or en_curso:
+                for tabla in [tabla for tabla in pendientes if dependencias[tabla] <= terminadas]:
+                    pendientes.remove(tabla)
+                    en_curso[ejecutor.submit(funcion, tabla, lote)] = tabla
+                if not en_curso:
+                    click.echo(click.style(f"  AVISO: Dependencias circulares entre {', '.join(pendientes)}", fg="red"))
+                    sys.exit(1)
+                listos, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+                for futuro in listos:
+                    tabla = en_curso.pop(futuro)
+                    contador = futuro.result()
+                    terminadas.add(tabla)
+                    click.echo(click.style(f"  {tabla}: {accion} {contador} registros.", fg="green"))
+    finally:
+        _cerrar_conexiones()
+
+
+def copiar_tabla(tabla: str, lote: int = COPIAR_LOTE) -> int:
+    """Copiar tabla de una base de datos a la que usamos, continúa desde el id más alto en el destino"""
+    source_conn, destination_conn = _conectar()
+    contador = 0
+    with destination_conn.cursor() as destination_cursor:
+        # Punto de control: el id más alto que ya está en el destino
+        destination_cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {tabla}")
+        ultimo_id = destination_cursor.fetchone()[0]
+        destination_conn.commit()
+        if ultimo_id > 0:
+            click.echo(f"  {tabla}: continúa después del id {ultimo_id}")
+
+        # Recorrer el origen con un cursor del lado del servidor
+        with source_conn.cursor(name=f"copiar_{tabla}") as source_cursor:
+            source_cursor.itersize = lote
+            source_cursor.execute(f"SELECT * FROM {tabla} WHERE id > %s ORDER BY id", (ultimo_id,))
+            insert_query = None
+            while True:
+                rows = source_cursor.fetchmany(lote)
+                if len(rows) == 0:
+                    break
+                if insert_query is None:
+                    colnames = [desc[0] for desc in source_cursor.description]
+                    insert_query = f"INSERT INTO {tabla} ({', '.join(colnames)}) VALUES %s"
+                psycopg2.extras.execute_values(destination_cursor, insert_query, rows, page_size=lote)
+                destination_conn.commit()
+                contador += len(rows)
+        source_conn.commit()
+
+        # Actualizar la secuencia al valor mas alto de la columna id
+        _reiniciar_secuencia(destination_cursor, tabla)
+        destination_conn.commit()
+
+    return contador
 
-def copiar_tabla(tabla: str):
-    """Copiar tabla de una base de datos a la que usamos"""
+
+def sincronizar_tabla(tabla: str, lote: int = COPIAR_LOTE) -> int:
+    """Insertar o actualizar en el destino los registros modificados desde la última sincronización"""
+    source_conn, destination_conn = _conectar()
+    contador = 0
+    with destination_conn.cursor() as destination_cursor:
+        # Leer la marca de la tabla
+        destination_cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {SINCRONIZAR_MARCAS} (tabla VARCHAR(64) PRIMARY KEY, modificado TIMESTAMP NOT NULL)"
+        )
+        destination_cursor.execute(f"SELECT modificado FROM {SINCRONIZAR_MARCAS} WHERE tabla = %s", (tabla,))
+        renglon = destination_cursor.fetchone()
+        destination_conn.commit()
+        desde = renglon[0] - SINCRONIZAR_TRASLAPE if renglon is not None else datetime(year=2000, month=1, day=1)
+
+        # Recorrer el origen en orden de modificado con un cursor del lado del servidor
+        with source_conn.cursor(name=f"sincronizar_{tabla}") as source_cursor:
+            source_cursor.itersize = lote
+            source_cursor.execute(f"SELECT * FROM {tabla} WHERE modificado > %s ORDER BY modificado, id", (desde,))
+            upsert_query = None
+            while True:
+                rows = source_cursor.fetchmany(lote)
+                if len(rows) == 0:
+                    break
+                if upsert_query is None:
+                    colnames = [desc[0] for desc in source_cursor.description]
+                    modificado_posicion = colnames.index("modificado")
+                    actualizar = ", ".join(f"{colname} = EXCLUDED.{colname}" for colname in colnames if colname != "id")
+                    upsert_query = (
+                        f"INSERT INTO {tabla} ({', '.join(colnames)}) VALUES %s ON CONFLICT (id) DO UPDATE SET {actualizar}"
+                    )
+                psycopg2.extras.execute_values(destination_cursor, upsert_query, rows, page_size=lote)
+                # Guardar la marca en la misma transacción que el lote, el más reciente va al final
+                destination_cursor.execute(
+                    f"INSERT INTO {SINCRONIZAR_MARCAS} (tabla, modificado) VALUES (%s, %s) "
+                    "ON CONFLICT (tabla) DO UPDATE SET modificado = GREATEST(EXCLUDED.modificado, "
+                    f"{SINCRONIZAR_MARCAS}.modificado)",
+                    (tabla, rows[-1][modificado_posicion]),
+                )
+                destination_conn.commit()
+                contador += len(rows)
+        source_conn.commit()
+
+        # Actualizar la secuencia si llegaron registros nuevos
+        if contador > 0:
+            _reiniciar_secuencia(destination_cursor, tabla)
+            destination_conn.commit()
+
+    return contador
+
+
+def _reiniciar_secuencia(cursor, tabla: str):
+    """Reiniciar la secuencia de la columna id al valor más alto de la tabla"""
+    cursor.execute(
+        f"SELECT setval(pg_get_serial_sequence('{tabla}', 'id'), COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {tabla}"
+    )
+
+
+def _conectar():
+    """Entregar las conexiones de origen y destino del hilo, las abre la primera vez"""
+    if getattr(_conexiones, "source_conn", None) is not None:
+        return _conexiones.source_conn, _conexiones.destination_conn
 
     # Definir los parametros de conexion a la base de datos de origen
     source_conn_params = {
@@ -35,65 +206,21 @@ def copiar_tabla(tabla: str):
 
     # Conectar a las bases de datos
     try:
-        click.echo("Conectando a la BD de origen... ", nl=False)
         source_conn = psycopg2.connect(**source_conn_params)
-        click.echo(click.style("Conectado.", fg="green"))
-        click.echo("Conectando a la BD de destino... ", nl=False)
         destination_conn = psycopg2.connect(**destination_conn_params)
-        click.echo(click.style("Conectado.", fg="green"))
     except psycopg2.OperationalError as error:
         click.echo(f"Error al conectar a la base de datos: {error}")
         sys.exit(1)
-
-    # Inicializar contador
-    contador = 0
-
-    # Copiar tabla
-    click.echo(f"Copiando tabla {tabla}... ", nl=False)
-    try:
-        source_cursor = source_conn.cursor()
-        destination_cursor = destination_conn.cursor()
-
-        # Obtener los registros
-        source_cursor.execute(f"SELECT * FROM {tabla}")
-        rows = source_cursor.fetchall()
-
-        # Definir los nombres de las columnas
-        colnames = [desc[0] for desc in source_cursor.description]
-
-        # Elaborar comandos SQL para insertar
-        insert_query = f"INSERT INTO {tabla} ({', '.join(colnames)}) VALUES %s"
-
-        # Insertar registros
-        psycopg2.extras.execute_values(destination_cursor, insert_query, rows)
-
-        # Ejecutar las operaciones
-        destination_conn.commit()
-
-        # Incrementar contador
-        contador += len(rows)
-
-        # Actualizar la secuencia al valor mas alto de la columna id
-        destination_cursor.execute(
-            f"""
-            do $$
-            declare nextid int;
-            begin
-                select max(id) + 1 from {tabla} into nextid;
-                execute 'alter SEQUENCE {tabla}_id_seq RESTART with '|| nextid;
-            end;
-            $$ language plpgsql
-        """
-        )
-
-        # Ejecutar la operacion
-        destination_conn.commit()
-
-    finally:
-        source_cursor.close()
-        destination_cursor.close()
-        source_conn.close()
-        destination_conn.close()
-
-    # Mostrar el contador
-    click.echo(f"Se copiaron {contador} registros.")
+    with _conexiones_candado:
+        _conexiones_abiertas.extend([source_conn, destination_conn])
+    _conexiones.source_conn = source_conn
+    _conexiones.destination_conn = destination_conn
+    return source_conn, destination_conn
+
+
+def _cerrar_conexiones():
+    """Cerrar las conexiones que abrieron los hilos"""
+    with _conexiones_candado:
+        for conexion in _conexiones_abiertas:
+            conexion.close()
+        _conexiones_abiertas.clear()
@@ -0,0 +1,111 @@
+"""
+Respaldar
+
+Respaldar tablas a archivos CSV con COPY (SELECT ...) TO STDOUT, sin cargar los registros en memoria.
+
+- Cada respaldo es un Respaldo(nombre, ruta, consulta), la consulta es un select de SQLAlchemy o un texto SQL
+- Se ejecutan en paralelo con HILOS conexiones, todas sobre la misma instantánea exportada con pg_export_snapshot,
+  así los archivos son consistentes entre sí aunque la base de datos reciba cambios mientras se respalda
+- Si se pide compresión gzip o zstd, se comprime mientras se escribe; zstd requiere el paquete zstandard
+
+Ejemplo
+
+    respaldar_en_paralelo([respaldar_autoridades(), respaldar_tabla("cit_citas", RESPALDOS_DIR)], "gzip", 4)
+"""
+
+import gzip
+import importlib
+import importlib.util
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import NamedTuple
+
+import click
+from sqlalchemy.dialects import postgresql
+
+from citas_admin.extensions import database
+
+COMPRESIONES = {"ninguna": "", "gzip": ".gz", "zstd": ".zst"}  # Extensión que se agrega a la ruta
+HILOS = 4  # Conexiones en paralelo
+RESPALDOS_DIR = "respaldos"  # Directorio para los respaldos de las tablas transaccionales
+TABLAS_TRANSACCIONALES = ["cit_clientes", "cit_citas", "pag_pagos"]
+
+
+class Respaldo(NamedTuple):
+    """Respaldo de una tabla o consulta a un archivo CSV"""
+
+    nombre: str
+    ruta: str
+    consulta: object
+
+
+def respaldar_tabla(tabla: str, directorio: str) -> Respaldo:
+    """Respaldo completo de una tabla, el archivo lleva la fecha y hora para no sobreescribir los anteriores"""
+    momento = datetime.now().strftime("%Y-%m-%d-%H%M")
+    return Respaldo(tabla, str(Path(directorio, f"{tabla}-{momento}.csv")), f"SELECT * FROM {tabla} ORDER BY id")
+
+
+def respaldar_en_paralelo(respaldos: list, compresion: str = "ninguna", hilos: int = HILOS) -> None:
+    """Respaldar en paralelo sobre la misma instantánea de la base de datos"""
+
+    # Validar la compresión y que no existan los archivos antes de empezar
+    if compresion not in COMPRESIONES:
+        click.echo(click.style(f"  AVISO: La compresión {compresion} no es válida", fg="red"))
+        sys.exit(1)
+    if compresion == "zstd" and importlib.util.find_spec("zstandard") is None:
+        click.echo(click.style("  AVISO: Para comprimir con zstd falta instalar zstandard", fg="red"))
+        sys.exit(1)
+    respaldos = [respaldo._replace(ruta=respaldo.ruta + COMPRESIONES[compresion]) for respaldo in respaldos]
+    for respaldo in respaldos:
+        if Path(respaldo.ruta).exists():
+            click.echo(f"AVISO: {respaldo.ruta} ya existe, no voy a sobreescribirlo.")
+            sys.exit(1)
+
+    # La conexión coordinadora exporta su instantánea y la mantiene abierta hasta que terminen todos los respaldos
+    coordinadora = database.engine.raw_connection()
+    try:
+        with coordinadora.cursor() as cursor:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            cursor.execute("SELECT pg_export_snapshot()")
+            instantanea = cursor.fetchone()[0]
+        with ThreadPoolExecutor(max_workers=hilos) as ejecutor:
+            futuros = {
+                ejecutor.submit(_respaldar_consulta, instantanea, respaldo, compresion): respaldo for respaldo in respaldos
+            }
+            for futuro in as_completed(futuros):
+                respaldo = futuros[futuro]
+                click.echo(click.style(f"  {futuro.result()} {respaldo.nombre} respaldados en {respaldo.ruta}", fg="green"))
+    finally:
+        coordinadora.rollback()
+        coordinadora.close()
+
+
+def _respaldar_consulta(instantanea: str, respaldo: Respaldo, compresion: str) -> int:
+    """Respaldar una consulta con su propia conexión sobre la instantánea, entrega la cantidad de registros"""
+    consulta = respaldo.consulta
+    if not isinstance(consulta, str):
+        consulta = str(consulta.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+    Path(respaldo.ruta).parent.mkdir(parents=True, exist_ok=True)
+    conexion = database.engine.raw_connection()
+    try:
+        with conexion.cursor() as cursor, _abrir(respaldo.ruta, compresion) as archivo:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            cursor.execute("SET TRANSACTION SNAPSHOT %s", (instantanea,))
+            cursor.copy_expert(f"COPY ({consulta}) TO STDOUT WITH (FORMAT csv, HEADER)", archivo)
+            cantidad = cursor.rowcount
+        conexion.rollback()
+    finally:
+        conexion.close()
+    return cantidad
+
+
+def _abrir(ruta: str, compresion: str):
+    """Abrir el archivo en binario, comprimiendo al escribir si se pide"""
+    if compresion == "gzip":
+        return gzip.open(ruta, "wb")
+    if compresion == "zstd":
+        zstandard = importlib.import_module("zstandard")
+        return zstandard.ZstdCompressor().stream_writer(open(ruta, "wb"), closefd=True)
+    return open(ruta, "wb")
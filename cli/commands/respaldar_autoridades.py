@@ -2,57 +2,26 @@
 Respaldar Autoridades
 """
 
-import csv
-import sys
-from pathlib import Path
-
-import click
+from sqlalchemy import Integer, select
 
 from citas_admin.blueprints.autoridades.models import Autoridad
+from cli.commands.respaldar import Respaldo
 
 AUTORIDADES_CSV = "seed/autoridades.csv"
 
 
-def respaldar_autoridades():
+def respaldar_autoridades() -> Respaldo:
     """Respaldar Autoridades"""
-    ruta = Path(AUTORIDADES_CSV)
-    if ruta.exists():
-        click.echo(f"AVISO: {AUTORIDADES_CSV} ya existe, no voy a sobreescribirlo.")
-        sys.exit(1)
-    click.echo("Respaldando autoridades: ", nl=False)
-    contador = 0
-    with open(ruta, "w", encoding="utf8") as puntero:
-        respaldo = csv.writer(puntero)
-        respaldo.writerow(
-            [
-                "autoridad_id",
-                "distrito_id",
-                "materia_id",
-                "clave",
-                "descripcion",
-                "descripcion_corta",
-                "es_jurisdiccional",
-                "es_notaria",
-                "organo_jurisdiccional",
-                "estatus",
-            ]
-        )
-        for autoridad in Autoridad.query.order_by(Autoridad.id).all():
-            respaldo.writerow(
-                [
-                    autoridad.id,
-                    autoridad.distrito_id,
-                    autoridad.materia_id,
-                    autoridad.clave,
-                    autoridad.descripcion,
-                    autoridad.descripcion_corta,
-                    int(autoridad.es_jurisdiccional),
-                    int(autoridad.es_notaria),
-                    autoridad.organo_jurisdiccional,
-                    autoridad.estatus,
-                ]
-            )
-            contador += 1
-            click.echo(click.style(".", fg="green"), nl=False)
-    click.echo()
-    click.echo(click.style(f"  {contador} autoridades respaldadas.", fg="green"))
+    consulta = select(
+        Autoridad.id.label("autoridad_id"),
+        Autoridad.distrito_id,
+        Autoridad.materia_id,
+        Autoridad.clave,
+        Autoridad.descripcion,
+        Autoridad.descripcion_corta,
+        Autoridad.es_jurisdiccional.cast(Integer).label("es_jurisdiccional"),
+        Autoridad.es_notaria.cast(Integer).label("es_notaria"),
+        Autoridad.organo_jurisdiccional,
+        Autoridad.estatus,
+    ).order_by(Autoridad.id)
+    return Respaldo("autoridades", AUTORIDADES_CSV, consulta)
@@ -2,49 +2,22 @@
 Respaldar Distritos
 """
 
-import csv
-import sys
-from pathlib import Path
-
-import click
+from sqlalchemy import Integer, select
 
 from citas_admin.blueprints.distritos.models import Distrito
+from cli.commands.respaldar import Respaldo
 
 DISTRITOS_CSV = "seed/distritos.csv"
 
 
-def respaldar_distritos():
+def respaldar_distritos() -> Respaldo:
     """Respaldar Distritos"""
-    ruta = Path(DISTRITOS_CSV)
-    if ruta.exists():
-        click.echo(f"AVISO: {DISTRITOS_CSV} ya existe, no voy a sobreescribirlo.")
-        sys.exit(1)
-    click.echo("Respaldando distritos: ", nl=False)
-    contador = 0
-    with open(ruta, "w", encoding="utf8") as puntero:
-        respaldo = csv.writer(puntero)
-        respaldo.writerow(
-            [
-                "distrito_id",
-                "clave",
-                "nombre",
-                "nombre_corto",
-                "es_distrito_judicial",
-                "estatus",
-            ]
-        )
-        for distrito in Distrito.query.order_by(Distrito.id).all():
-            respaldo.writerow(
-                [
-                    distrito.id,
-                    distrito.clave,
-                    distrito.nombre,
-                    distrito.nombre_corto,
-                    int(distrito.es_distrito_judicial),
-                    distrito.estatus,
-                ]
-            )
-            contador += 1
-            click.echo(click.style(".", fg="green"), nl=False)
-    click.echo()
-    click.echo(click.style(f"  {contador} distritos respaldados.", fg="green"))
+    consulta = select(
+        Distrito.id.label("distrito_id"),
+        Distrito.clave,
+        Distrito.nombre,
+        Distrito.nombre_corto,
+        Distrito.es_distrito_judicial.cast(Integer).label("es_distrito_judicial"),
+        Distrito.estatus,
+    ).order_by(Distrito.id)
+    return Respaldo("distritos", DISTRITOS_CSV, consulta)
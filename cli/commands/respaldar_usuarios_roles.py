@@ -2,59 +2,37 @@
 Respaldar Usuarios-Roles
 """
 
-import csv
-import sys
-from pathlib import Path
-
-import click
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 
+from citas_admin.blueprints.autoridades.models import Autoridad
+from citas_admin.blueprints.roles.models import Rol
 from citas_admin.blueprints.usuarios.models import Usuario
+from citas_admin.blueprints.usuarios_roles.models import UsuarioRol
+from cli.commands.respaldar import Respaldo
 
 USUARIOS_ROLES_CSV = "seed/usuarios_roles.csv"
 
 
-def respaldar_usuarios_roles():
-    """Respaldar Usuarios-Roles"""
-    ruta = Path(USUARIOS_ROLES_CSV)
-    if ruta.exists():
-        click.echo(f"AVISO: {USUARIOS_ROLES_CSV} ya existe, no voy a sobreescribirlo.")
-        sys.exit(1)
-    click.echo("Respaldando usuarios-roles: ", nl=False)
-    contador = 0
-    with open(ruta, "w", encoding="utf8") as puntero:
-        respaldo = csv.writer(puntero)
-        respaldo.writerow(
-            [
-                "usuario_id",
-                "autoridad_clave",
-                "oficina_id",
-                "email",
-                "nombres",
-                "apellido_paterno",
-                "apellido_materno",
-                "roles",
-                "estatus",
-            ]
+def respaldar_usuarios_roles() -> Respaldo:
+    """Respaldar Usuarios-Roles, los nombres de los roles activos van separados por comas"""
+    roles = func.string_agg(Rol.nombre, aggregate_order_by(literal_column("','"), UsuarioRol.id))
+    consulta = (
+        select(
+            Usuario.id.label("usuario_id"),
+            Autoridad.clave.label("autoridad_clave"),
+            Usuario.oficina_id,
+            Usuario.email,
+            Usuario.nombres,
+            Usuario.apellido_paterno,
+            Usuario.apellido_materno,
+            func.coalesce(roles.filter(UsuarioRol.estatus == "A"), "").label("roles"),
+            Usuario.estatus,
         )
-        for usuario in Usuario.query.order_by(Usuario.id).all():
-            roles_list = []
-            for usuario_rol in usuario.usuarios_roles:
-                if usuario_rol.estatus == "A":
-                    roles_list.append(usuario_rol.rol.nombre)
-            respaldo.writerow(
-                [
-                    usuario.id,
-                    usuario.autoridad.clave,
-                    usuario.oficina_id,
-                    usuario.email,
-                    usuario.nombres,
-                    usuario.apellido_paterno,
-                    usuario.apellido_materno,
-                    ",".join(roles_list),
-                    usuario.estatus,
-                ]
-            )
-            contador += 1
-            click.echo(click.style(".", fg="green"), nl=False)
-    click.echo()
-    click.echo(click.style(f"  {contador} usuarios-roles respaldados.", fg="green"))
+        .join(Autoridad, Usuario.autoridad_id == Autoridad.id)
+        .outerjoin(UsuarioRol, UsuarioRol.usuario_id == Usuario.id)
+        .outerjoin(Rol, UsuarioRol.rol_id == Rol.id)
+        .group_by(Usuario.id, Autoridad.clave)
+        .order_by(Usuario.id)
+    )
+    return Respaldo("usuarios-roles", USUARIOS_ROLES_CSV, consulta)
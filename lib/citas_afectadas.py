@@ -0,0 +1,132 @@
+"""
+Citas afectadas
+
+Al agregar una hora bloqueada o un día inhábil, las citas PENDIENTES que caen en ese tiempo quedan afectadas.
+
+- condiciones_afectadas arma un solo rango sobre inicio, que usa el índice (oficina_id, inicio) de cit_citas
+- Antes de guardar se muestran con consultar_afectadas para elegir si se cancelan o se reagendan
+- cancelar_afectadas y reagendar_afectadas cambian todas con un solo UPDATE ... RETURNING en la sesión, así se
+  confirman en la misma transacción que la hora bloqueada o el día inhábil
+- Después de confirmar, notificar_afectadas descarta los días de la disponibilidad, marca los días de cit_citas_diarias
+  y encola los mensajes en un solo envío a Redis
+
+Ejemplo
+
+    condiciones = condiciones_afectadas(fecha, oficina_id, inicio, termino)
+    cambios = cancelar_afectadas(condiciones)
+    cit_hora_bloqueada.save()
+    notificar_afectadas(cambios, "cancelar", [fecha])
+"""
+
+from datetime import date, datetime, time, timedelta
+
+from flask import current_app
+from rq import Queue
+from sqlalchemy import select, update
+from sqlalchemy.orm import joinedload
+
+from citas_admin.blueprints.cit_citas.models import CitCita
+from citas_admin.blueprints.cit_citas_diarias.models import CitCitaDiaria
+from citas_admin.blueprints.oficinas.models import Oficina
+from citas_admin.extensions import database
+from lib.disponibilidad import caben, descartar_dias, es_dia_inhabil
+from lib.exceptions import MyNotValidParamError
+
+AFECTADAS_ACCIONES = [
+    ("", "Revisar las citas afectadas"),
+    ("cancelar", "Cancelarlas"),
+    ("reagendar", "Reagendarlas a la misma hora en otro día"),
+]
+AFECTADAS_MENSAJES = {
+    "cancelar": "citas_admin.blueprints.cit_citas.tasks.enviar_cancelado",
+    "reagendar": "citas_admin.blueprints.cit_citas.tasks.enviar_pendiente",
+}
+
+
+def condiciones_afectadas(fecha: date, oficina_id: int = None, inicio: time = None, termino: time = None) -> list:
+    """Condiciones de las citas pendientes que caen en el día o en el horario, de una oficina o de todas"""
+    desde = datetime.combine(fecha, time.min)
+    hasta = datetime.combine(fecha, termino) if termino is not None else desde + timedelta(days=1)
+    condiciones = [
+        CitCita.inicio >= desde,
+        CitCita.inicio < hasta,
+        CitCita.estado == "PENDIENTE",
+        CitCita.estatus == "A",
+    ]
+    if inicio is not None:
+        condiciones.append(CitCita.termino > datetime.combine(fecha, inicio))
+    if oficina_id is not None:
+        condiciones.append(CitCita.oficina_id == oficina_id)
+    return condiciones
+
+
+def consultar_afectadas(condiciones: list) -> list:
+    """Consultar las citas afectadas con su cliente, servicio y oficina para mostrarlas"""
+    return (
+        CitCita.query.options(joinedload(CitCita.cit_cliente), joinedload(CitCita.cit_servicio), joinedload(CitCita.oficina))
+        .filter(*condiciones)
+        .order_by(CitCita.oficina_id, CitCita.inicio)
+        .all()
+    )
+
+
+def revisar_reagendar(condiciones: list, fecha: date, nueva_fecha: date) -> None:
+    """Validar que las citas afectadas caben a la misma hora en el nuevo día, si no, causa MyNotValidParamError"""
+    if nueva_fecha is None or nueva_fecha == fecha:
+        raise MyNotValidParamError("Para reagendar debe elegir un día distinto")
+    if nueva_fecha < date.today():
+        raise MyNotValidParamError("No se puede reagendar a un día que ya pasó")
+    if nueva_fecha.weekday() >= 5 or es_dia_inhabil(nueva_fecha):
+        raise MyNotValidParamError(f"El día {nueva_fecha} no es hábil")
+
+    # Sumar las citas que llegan a la ocupación del nuevo día de cada oficina
+    diferencia = nueva_fecha - fecha
+    llegan = {}
+    for oficina_id, inicio, termino in database.session.execute(
+        select(CitCita.oficina_id, CitCita.inicio, CitCita.termino).filter(*condiciones)
+    ):
+        llegan.setdefault(oficina_id, []).append((inicio + diferencia, termino + diferencia))
+    for oficina_id, intervalos in llegan.items():
+        if not caben(oficina_id, nueva_fecha, intervalos):
+            oficina = database.session.get(Oficina, oficina_id)
+            raise MyNotValidParamError(f"No caben las citas de {oficina.clave} a la misma hora del {nueva_fecha}")
+
+
+def cancelar_afectadas(condiciones: list) -> list:
+    """Cancelar las citas afectadas con un solo UPDATE, sin confirmar, entrega (id, oficina_id) de cada una"""
+    sentencia = (
+        update(CitCita)
+        .where(*condiciones)
+        .values(estado="CANCELO")
+        .returning(CitCita.id, CitCita.oficina_id)
+        .execution_options(synchronize_session=False)
+    )
+    return [tuple(renglon) for renglon in database.session.execute(sentencia)]
+
+
+def reagendar_afectadas(condiciones: list, fecha: date, nueva_fecha: date) -> list:
+    """Mover las citas afectadas a la misma hora del nuevo día con un solo UPDATE, sin confirmar"""
+    diferencia = nueva_fecha - fecha
+    sentencia = (
+        update(CitCita)
+        .where(*condiciones)
+        .values(
+            inicio=CitCita.inicio + diferencia,
+            termino=CitCita.termino + diferencia,
+            cancelar_antes=CitCita.cancelar_antes + diferencia,
+        )
+        .returning(CitCita.id, CitCita.oficina_id)
+        .execution_options(synchronize_session=False)
+    )
+    return [tuple(renglon) for renglon in database.session.execute(sentencia)]
+
+
+def notificar_afectadas(cambios: list, accion: str, fechas: list) -> None:
+    """Después de confirmar, actualizar los índices en Redis y encolar los mensajes de todas las citas a la vez"""
+    if len(cambios) == 0:
+        return
+    descartar_dias([(oficina_id, fecha) for _, oficina_id in cambios for fecha in fechas])
+    CitCitaDiaria.marcar_fechas(fechas)
+    current_app.task_queue.enqueue_many(
+        [Queue.prepare_data(AFECTADAS_MENSAJES[accion], kwargs={"cit_cita_id": cit_cita_id}) for cit_cita_id, _ in cambios]
+    )
@@ -0,0 +1,71 @@
+"""
+Conciliar pagos
+
+Comparar lo que respondió el banco en pag_pagos.resultado_xml con el estado, el folio y el total guardados.
+
+- comparar_lote recibe renglones (id, estado, folio, total, resultado_xml) y entrega cuántos revisó y las diferencias
+- No usa la base de datos ni la aplicación, así se puede ejecutar en otros procesos con ProcessPoolExecutor
+- Cada diferencia es un renglón para el reporte con CONCILIAR_CABECERAS
+
+Ejemplo
+
+    revisados, diferencias = comparar_lote([(1, "PAGADO", "12345", Decimal("100.00"), resultado_xml)])
+"""
+
+from decimal import Decimal, InvalidOperation
+
+from lib.wpp import get_responses
+
+CONCILIAR_CABECERAS = ["ID", "ESTADO", "FOLIO", "TOTAL", "WPP RESPUESTA", "WPP FOLIO", "WPP TOTAL", "DIFERENCIAS"]
+CONCILIAR_ESTADOS = {  # Respuesta del banco: estados que puede tener el pago
+    "approved": ("PAGADO", "ENTREGADO"),
+    "denied": ("FALLIDO", "CANCELADO"),
+    "error": ("FALLIDO", "CANCELADO"),
+}
+
+
+def comparar_lote(renglones: list) -> tuple[int, list]:
+    """Comparar un lote de pagos con las respuestas del banco, entrega la cantidad revisada y las diferencias"""
+    diferencias = []
+    for (pag_pago_id, estado, folio, total, _), (respuesta, error) in zip(
+        renglones, get_responses(renglon[4] for renglon in renglones)
+    ):
+        if error is not None:
+            diferencias.append((pag_pago_id, estado, folio, total, None, None, None, error))
+            continue
+        problemas = _comparar(pag_pago_id, estado, folio, total, respuesta)
+        if problemas:
+            diferencias.append(
+                (
+                    pag_pago_id,
+                    estado,
+                    folio,
+                    total,
+                    respuesta["response"],
+                    respuesta["foliocpagos"],
+                    respuesta["amount"],
+                    "; ".join(problemas),
+                )
+            )
+    return len(renglones), diferencias
+
+
+def _comparar(pag_pago_id: int, estado: str, folio: str, total: Decimal, respuesta: dict) -> list:
+    """Entregar la lista de problemas de un pago, vacía si coincide con la respuesta del banco"""
+    problemas = []
+    if respuesta["pago_id"] is not None and respuesta["pago_id"].strip() != str(pag_pago_id):
+        problemas.append(f"La referencia {respuesta['pago_id']} no es el ID del pago")
+    estados = CONCILIAR_ESTADOS.get((respuesta["response"] or "").strip().lower())
+    if estados is None:
+        problemas.append(f"Respuesta desconocida {respuesta['response']}")
+    elif estado not in estados:
+        problemas.append(f"El estado debe ser {' o '.join(estados)}")
+    if estados is not None and "PAGADO" in estados and (respuesta["foliocpagos"] or "").strip() != (folio or "").strip():
+        problemas.append("El folio no coincide")
+    if respuesta["amount"] is not None:
+        try:
+            if Decimal(respuesta["amount"].strip()) != total:
+                problemas.append("El total no coincide")
+        except InvalidOperation:
+            problemas.append(f"El total {respuesta['amount']} no es válido")
+    return problemas
@@ -1,8 +1,55 @@
 """
 Datatables
+
+Paginar por llave (keyset) es opcional. El cliente envía la llave de la última fila de la página anterior
+en keyset_start y keyset_valores; si keyset_start coincide con start se filtra por esa llave en lugar de usar OFFSET.
+De lo contrario, por ejemplo al saltar a una página lejana, se pagina con OFFSET como siempre.
+
+    # Ordenar y paginar
+    registros, keyset = paginate_datatable(consulta, [CitCita.id], start, rows_per_page)
+    total, estimado = count_datatable(consulta)
+    ...
+    # Entregar JSON
+    return output_datatable_json(draw, total, data, keyset, estimado)
+
+Y en la plantilla, después de elaborar la configuración
+
+    configDTCitCitas = constructorDataTable.keyset(configDTCitCitas);
+
+El total se cuenta con count_datatable, que guarda en Redis el conteo exacto por cada consulta (mismo SQL y parámetros)
+durante TOTAL_CACHE_TTL segundos. En PostgreSQL, si el planeador estima más de TOTAL_ESTIMADO_UMBRAL filas,
+se entrega esa estimación (EXPLAIN, que se basa en pg_class.reltuples) y el JSON lo indica con estimado en verdadero.
+
+Para listados grandes conviene consultar sólo las columnas que se entregan con with_entities, recorrer las tuplas
+y elaborar los URL con url_template una sola vez por petición, en lugar de llamar a url_for en cada fila.
+
+    detalle_url = url_template("cit_citas.detail", "cit_cita_id")
+    ...
+    "url": detalle_url.format(cit_cita_id),
+
+Si el listado muestra columnas de otras tablas, pase sus relaciones con joinedload a la consulta antes de paginar para
+que se traigan en la misma consulta y no una por una en cada fila. Las opciones se elaboran dentro de datatable_json,
+no al importar la vista, porque joinedload configura los mappers y en ese momento aún no se han cargado todos los modelos.
+
+    registros, keyset = paginate_datatable(consulta.options(joinedload(Bitacora.usuario)), [Bitacora.id], start, rows_per_page)
 """
 
-from flask import request
+import hashlib
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from uuid import UUID
+
+from flask import current_app, request, url_for
+from redis.exceptions import RedisError
+from sqlalchemy import tuple_
+from sqlalchemy.exc import SQLAlchemyError
+
+from citas_admin.extensions import database
+
+TOTAL_CACHE_TTL = 60  # Segundos que se conserva en Redis el total de una consulta
+TOTAL_ESTIMADO_UMBRAL = 100000  # A partir de esta cantidad de filas estimadas no se cuenta, se entrega la estimación
+URL_TEMPLATE_ID = 2147483647  # Id ficticio que url_template reemplaza por {}
 
 
 def get_datatable_parameters():
@@ -18,11 +65,147 @@ def get_datatable_parameters():
     return draw, start, rows_per_page
 
 
-def output_datatable_json(draw, total, data):
+def get_datatable_keyset(start: int, columnas: list):
+    """Tomar la llave de la última fila de la página anterior, entrega None si no viene o no corresponde a start"""
+    try:
+        keyset_start = int(request.form["keyset_start"])
+        valores = json.loads(request.form["keyset_valores"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if keyset_start != start or not isinstance(valores, list) or len(valores) != len(columnas):
+        return None
+    try:
+        return [_convertir_valor(columna, valor) for columna, valor in zip(columnas, valores)]
+    except (TypeError, ValueError):
+        return None
+
+
+def paginate_datatable(consulta, columnas: list, start: int, rows_per_page: int, descendente: bool = True):
+    """Ordenar y paginar por las columnas dadas, entrega los registros y la llave para la página siguiente"""
+    # Ordenar por las columnas, la última debe ser única (por ejemplo el id) para que la llave no se repita
+    if descendente:
+        consulta = consulta.order_by(*[columna.desc() for columna in columnas])
+    else:
+        consulta = consulta.order_by(*columnas)
+    # Si viene la llave de la página anterior, filtrar por ella en lugar de usar OFFSET
+    valores = get_datatable_keyset(start, columnas)
+    if valores is None:
+        registros = consulta.offset(start).limit(rows_per_page).all()
+    else:
+        if len(columnas) == 1:
+            llave, valor = columnas[0], valores[0]
+        else:
+            llave, valor = tuple_(*columnas), tuple_(*valores)
+        if descendente:
+            consulta = consulta.filter(llave < valor)
+        else:
+            consulta = consulta.filter(llave > valor)
+        registros = consulta.limit(rows_per_page).all()
+    # Elaborar la llave de la última fila para que el cliente pida la página siguiente
+    keyset = None
+    if len(registros) > 0:
+        ultimo = registros[-1]
+        keyset = {
+            "start": start + len(registros),
+            "valores": [_exportar_valor(getattr(ultimo, columna.key)) for columna in columnas],
+        }
+    return registros, keyset
+
+
+def count_datatable(consulta, ttl: int = TOTAL_CACHE_TTL, umbral: int = TOTAL_ESTIMADO_UMBRAL) -> tuple[int, bool]:
+    """Contar los registros de la consulta, entrega el total y si es estimado"""
+    # La firma de la consulta es el SQL compilado con sus parámetros
+    compilado = consulta.statement.compile(dialect=database.engine.dialect, compile_kwargs={"render_postcompile": True})
+    firma = hashlib.sha1(f"{compilado}|{sorted(compilado.params.items())!r}".encode("utf8")).hexdigest()
+    llave = f"datatables:total:{firma}"
+    # Si está en Redis, entregarlo
+    try:
+        guardado = current_app.redis.get(llave)
+    except RedisError:
+        guardado = None
+    if guardado is not None:
+        total, estimado = json.loads(guardado)
+        return total, estimado
+    # En PostgreSQL, si el planeador estima demasiadas filas, entregar la estimación
+    total, estimado = None, False
+    if database.engine.dialect.name == "postgresql":
+        estimacion = _estimate_rows(compilado)
+        if estimacion is not None and estimacion >= umbral:
+            total, estimado = estimacion, True
+    # De lo contrario, contar
+    if total is None:
+        total = consulta.count()
+    # Guardar en Redis
+    try:
+        current_app.redis.setex(llave, ttl, json.dumps([total, estimado]))
+    except RedisError:
+        pass
+    return total, estimado
+
+
+def output_datatable_json(draw, total, data, keyset=None, estimado=False):
     """Entregar JSON"""
-    return {
+    salida = {
         "draw": draw,
         "iTotalRecords": total,
         "iTotalDisplayRecords": total,
         "aaData": data,
+        "estimado": estimado,
     }
+    if keyset is not None:
+        salida["keyset"] = keyset
+    return current_app.response_class(
+        json.dumps(salida, ensure_ascii=False, separators=(",", ":"), default=_exportar_json),
+        mimetype="application/json",
+    )
+
+
+def url_template(endpoint: str, parametro: str) -> str:
+    """Elaborar la plantilla del URL con {} en el lugar del id, para usar format en cada fila"""
+    url = url_for(endpoint, **{parametro: URL_TEMPLATE_ID})
+    return url.replace("{", "{{").replace("}", "}}").replace(str(URL_TEMPLATE_ID), "{}")
+
+
+def _convertir_valor(columna, valor):
+    """Convertir el valor recibido en JSON al tipo de la columna"""
+    if valor is None:
+        return None
+    tipo = columna.type.python_type
+    if tipo is datetime:
+        return datetime.fromisoformat(valor)
+    if tipo is date:
+        return date.fromisoformat(valor)
+    if tipo is time:
+        return time.fromisoformat(valor)
+    return tipo(valor)
+
+
+def _estimate_rows(compilado):
+    """Estimar la cantidad de filas de la consulta compilada con EXPLAIN, entrega None si no se puede"""
+    try:
+        with database.engine.connect() as conexion:
+            resultado = conexion.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compilado}", compilado.params).scalar()
+    except SQLAlchemyError:
+        return None
+    if isinstance(resultado, str):
+        resultado = json.loads(resultado)
+    try:
+        return int(resultado[0]["Plan"]["Plan Rows"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def _exportar_json(valor):
+    """Convertir los valores que json no sabe serializar"""
+    if isinstance(valor, (Decimal, UUID)):
+        return str(valor)
+    if isinstance(valor, (datetime, date, time)):
+        return valor.isoformat()
+    raise TypeError(f"No se puede serializar {type(valor).__name__}")
+
+
+def _exportar_valor(valor):
+    """Convertir el valor de la columna a uno que se pueda entregar en JSON"""
+    if isinstance(valor, (datetime, date, time)):
+        return valor.isoformat()
+    return valor
@@ -0,0 +1,320 @@
+"""
+Disponibilidad
+
+Índice de ocupación por oficina y día en Redis, para saber si hay lugar sin consultar cit_citas en cada revisión.
+
+- El día se divide en SLOTS_POR_DIA espacios de SLOT_MINUTOS contados desde las 00:00, así el índice no depende del
+  horario de la oficina
+- disponibilidad:{oficina_id}:{fecha} guarda un contador u16 por espacio con las personas citadas (PENDIENTE o ASISTIO),
+  se lee y se incrementa con BITFIELD, un espacio en O(1)
+- disponibilidad:{oficina_id}:{fecha}:bloqueos es un mapa de bits con los espacios de las horas bloqueadas, GETBIT
+- disponibilidad:dias_inhabiles es un conjunto con las fechas inhábiles, SISMEMBER
+- Si una llave no existe se construye desde la base de datos con una consulta y expira en DISPONIBILIDAD_TTL
+
+Al confirmar cambios en citas con la sesión, los contadores del día se ajustan en el mismo momento (sólo si el día ya
+está en Redis). Los cambios en horas bloqueadas descartan el día y los de días inhábiles descartan el conjunto, se
+vuelven a construir en la siguiente consulta. Las actualizaciones masivas que no pasan por la sesión deben llamar a
+descartar_dias.
+
+Ejemplo
+
+    if hay_lugar(oficina_id, cit_servicio_id, inicio):
+        ...
+    horarios = horarios_disponibles(oficina_id, cit_servicio_id, fecha)
+"""
+
+import struct
+from datetime import date, datetime, time, timedelta
+from itertools import chain
+
+from flask import current_app, has_app_context
+from redis.exceptions import RedisError
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from citas_admin.blueprints.cit_citas.models import CitCita
+from citas_admin.blueprints.cit_dias_inhabiles.models import CitDiaInhabil
+from citas_admin.blueprints.cit_horas_bloqueadas.models import CitHoraBloqueada
+from citas_admin.blueprints.cit_servicios.models import CitServicio
+from citas_admin.blueprints.oficinas.models import Oficina
+from citas_admin.extensions import database
+
+DISPONIBILIDAD_TTL = 3600  # Segundos que se conserva en Redis el índice de un día
+DIAS_INHABILES_KEY = "disponibilidad:dias_inhabiles"
+DIAS_INHABILES_CONSTRUIDO = "-"  # Miembro que indica que el conjunto ya se construyó, aunque no haya días inhábiles
+ESTADOS_OCUPAN = ("ASISTIO", "PENDIENTE")  # Estados de las citas que ocupan lugar
+SLOT_MINUTOS = 15
+SLOTS_POR_DIA = 24 * 60 // SLOT_MINUTOS
+
+# Incrementar los contadores sólo si el día ya está construido, para no crear un día en ceros que parezca completo
+AJUSTAR_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('BITFIELD', KEYS[1], unpack(ARGV))
+end
+return nil
+"""
+
+
+def slot(momento: time) -> int:
+    """Número de espacio del día al que pertenece la hora"""
+    return (momento.hour * 60 + momento.minute) // SLOT_MINUTOS
+
+
+def slots_de(inicio: datetime, termino: datetime) -> range:
+    """Espacios que ocupa un intervalo dentro del día de inicio, al menos uno"""
+    primero = slot(inicio.time())
+    if termino.date() > inicio.date():
+        return range(primero, SLOTS_POR_DIA)
+    ultimo = -(-(termino.hour * 60 + termino.minute) // SLOT_MINUTOS)  # Redondear hacia arriba
+    return range(primero, max(ultimo, primero + 1))
+
+
+def ocupacion(oficina_id: int, fecha: date) -> tuple[list, bytes]:
+    """Entregar los contadores y el mapa de bits de bloqueos del día, construye el día si no está en Redis"""
+    llave = _llave(oficina_id, fecha)
+    guardado, bloqueos = current_app.redis.mget(llave, f"{llave}:bloqueos")
+    if guardado is None or bloqueos is None:
+        return construir_dia(oficina_id, fecha)
+    return list(struct.unpack(f">{SLOTS_POR_DIA}H", guardado)), bloqueos
+
+
+def personas_en(oficina_id: int, fecha: date, numero: int) -> int:
+    """Personas citadas en un espacio, en O(1)"""
+    llave = _llave(oficina_id, fecha)
+    tuberia = current_app.redis.pipeline()
+    tuberia.exists(llave)
+    tuberia.execute_command("BITFIELD", llave, "GET", "u16", f"#{numero}")
+    existe, conteo = tuberia.execute()
+    if not existe:
+        conteos, _ = construir_dia(oficina_id, fecha)
+        return conteos[numero]
+    return conteo[0]
+
+
+def es_dia_inhabil(fecha: date) -> bool:
+    """¿Es día inhábil?, en O(1)"""
+    redis = current_app.redis
+    tuberia = redis.pipeline()
+    tuberia.exists(DIAS_INHABILES_KEY)
+    tuberia.sismember(DIAS_INHABILES_KEY, fecha.isoformat())
+    existe, es_miembro = tuberia.execute()
+    if existe:
+        return bool(es_miembro)
+    fechas = database.session.execute(select(CitDiaInhabil.fecha).filter(CitDiaInhabil.estatus == "A")).scalars()
+    miembros = [DIAS_INHABILES_CONSTRUIDO] + [dia_inhabil.isoformat() for dia_inhabil in fechas]
+    tuberia = redis.pipeline()
+    tuberia.delete(DIAS_INHABILES_KEY)
+    tuberia.sadd(DIAS_INHABILES_KEY, *miembros)
+    tuberia.expire(DIAS_INHABILES_KEY, DISPONIBILIDAD_TTL)
+    tuberia.execute()
+    return fecha.isoformat() in miembros
+
+
+def hay_lugar(oficina_id: int, cit_servicio_id: int, inicio: datetime) -> bool:
+    """¿Se puede agendar el servicio en la oficina a esa hora?"""
+    oficina = database.session.get(Oficina, oficina_id)
+    ventana = _ventana(oficina, database.session.get(CitServicio, cit_servicio_id), inicio.date())
+    if ventana is None:
+        return False
+    desde, hasta, duracion = ventana
+    if inicio < desde or inicio + duracion > hasta:
+        return False
+    conteos, bloqueos = ocupacion(oficina_id, inicio.date())
+    return _cabe(conteos, bloqueos, oficina.limite_personas, inicio, duracion)
+
+
+def horarios_disponibles(oficina_id: int, cit_servicio_id: int, fecha: date) -> list[datetime]:
+    """Horarios de inicio en los que cabe el servicio, cada SLOT_MINUTOS dentro del horario de la oficina y del servicio"""
+    oficina = database.session.get(Oficina, oficina_id)
+    ventana = _ventana(oficina, database.session.get(CitServicio, cit_servicio_id), fecha)
+    if ventana is None:
+        return []
+    desde, hasta, duracion = ventana
+    conteos, bloqueos = ocupacion(oficina_id, fecha)
+    horarios = []
+    inicio = desde
+    while inicio + duracion <= hasta:
+        if _cabe(conteos, bloqueos, oficina.limite_personas, inicio, duracion):
+            horarios.append(inicio)
+        inicio += timedelta(minutes=SLOT_MINUTOS)
+    return horarios
+
+
+def caben(oficina_id: int, fecha: date, intervalos: list) -> bool:
+    """¿Caben todos los intervalos (inicio, termino) en el día, además de las citas que ya tiene?"""
+    oficina = database.session.get(Oficina, oficina_id)
+    conteos, bloqueos = ocupacion(oficina_id, fecha)
+    for inicio, termino in intervalos:
+        if not _cabe(conteos, bloqueos, oficina.limite_personas, inicio, termino - inicio):
+            return False
+        for numero in slots_de(inicio, termino):
+            conteos[numero] += 1
+    return True
+
+
+def construir_dia(oficina_id: int, fecha: date) -> tuple[list, bytes]:
+    """Construir el índice del día desde la base de datos y guardarlo en Redis"""
+    desde = datetime.combine(fecha, time.min)
+    hasta = desde + timedelta(days=1)
+
+    # Contar las personas citadas por espacio
+    conteos = [0] * SLOTS_POR_DIA
+    citas = database.session.execute(
+        select(CitCita.inicio, CitCita.termino)
+        .filter(CitCita.oficina_id == oficina_id)
+        .filter(CitCita.inicio >= desde, CitCita.inicio < hasta)
+        .filter(CitCita.estado.in_(ESTADOS_OCUPAN))
+        .filter(CitCita.estatus == "A")
+    )
+    for inicio, termino in citas:
+        for numero in slots_de(inicio, termino):
+            conteos[numero] += 1
+
+    # Marcar los espacios de las horas bloqueadas
+    bloqueos = bytearray(SLOTS_POR_DIA // 8)
+    horas_bloqueadas = database.session.execute(
+        select(CitHoraBloqueada.inicio, CitHoraBloqueada.termino)
+        .filter(CitHoraBloqueada.oficina_id == oficina_id)
+        .filter(CitHoraBloqueada.fecha == fecha)
+        .filter(CitHoraBloqueada.estatus == "A")
+    )
+    for inicio, termino in horas_bloqueadas:
+        for numero in slots_de(datetime.combine(fecha, inicio), datetime.combine(fecha, termino)):
+            bloqueos[numero // 8] |= 0x80 >> (numero % 8)  # El mismo orden de bits de GETBIT y SETBIT
+
+    # Guardar
+    llave = _llave(oficina_id, fecha)
+    tuberia = current_app.redis.pipeline()
+    tuberia.set(llave, struct.pack(f">{SLOTS_POR_DIA}H", *conteos), ex=DISPONIBILIDAD_TTL)
+    tuberia.set(f"{llave}:bloqueos", bytes(bloqueos), ex=DISPONIBILIDAD_TTL)
+    tuberia.execute()
+    return conteos, bytes(bloqueos)
+
+
+def descartar_dias(dias) -> None:
+    """Descartar de Redis los índices de los días (oficina_id, fecha), se vuelven a construir en la siguiente consulta"""
+    llaves = []
+    for oficina_id, fecha in set(dias):
+        llaves += [_llave(oficina_id, fecha), f"{_llave(oficina_id, fecha)}:bloqueos"]
+    if llaves:
+        current_app.redis.delete(*llaves)
+
+
+def _ventana(oficina: Oficina, cit_servicio: CitServicio, fecha: date):
+    """Entregar (desde, hasta, duracion) del servicio en la oficina ese día, o None si ese día no se atiende"""
+    if oficina is None or cit_servicio is None:
+        return None
+
+    # Días habilitados del servicio con 0 para domingo, si no tiene son de lunes a viernes
+    if cit_servicio.dias_habilitados == "":
+        if fecha.weekday() >= 5:
+            return None
+    elif str(fecha.isoweekday() % 7) not in cit_servicio.dias_habilitados:
+        return None
+    if es_dia_inhabil(fecha):
+        return None
+
+    # La ventana más estrecha entre el horario de la oficina y el del servicio
+    desde = datetime.combine(fecha, max(oficina.apertura, cit_servicio.desde or time.min))
+    hasta = datetime.combine(fecha, min(oficina.cierre, cit_servicio.hasta or time.max))
+    duracion = timedelta(hours=cit_servicio.duracion.hour, minutes=cit_servicio.duracion.minute)
+    return desde, hasta, duracion
+
+
+def _cabe(conteos: list, bloqueos: bytes, limite_personas: int, inicio: datetime, duracion: timedelta) -> bool:
+    """¿Todos los espacios que ocupa el intervalo tienen lugar y no están bloqueados?"""
+    for numero in slots_de(inicio, inicio + duracion):
+        if conteos[numero] >= limite_personas or _bit(bloqueos, numero):
+            return False
+    return True
+
+
+def _llave(oficina_id: int, fecha: date) -> str:
+    """Llave del índice de un día"""
+    return f"disponibilidad:{oficina_id}:{fecha.isoformat()}"
+
+
+def _bit(bloqueos: bytes, numero: int) -> bool:
+    """Leer un bit del mapa de bloqueos"""
+    return bool(bloqueos[numero // 8] & (0x80 >> (numero % 8)))
+
+
+def _valor_anterior(registro, atributo: str):
+    """Valor del atributo antes de los cambios en la sesión"""
+    historia = inspect(registro).attrs[atributo].history
+    if historia.deleted:
+        return historia.deleted[0]
+    return getattr(registro, atributo)
+
+
+def _ocupa(oficina_id, inicio, termino, estado, estatus):
+    """Entregar (oficina_id, inicio, termino) si la cita ocupa lugar, None si no"""
+    if oficina_id is None or inicio is None or termino is None:
+        return None
+    if estado not in ESTADOS_OCUPAN or estatus != "A":
+        return None
+    return oficina_id, inicio, termino
+
+
+@event.listens_for(Session, "after_flush")
+def _registrar_cambios_disponibilidad(session, flush_context):
+    """Anotar en la sesión los ajustes a la disponibilidad, se aplican al confirmar"""
+    ajustes = session.info.setdefault("disponibilidad_ajustes", [])
+    descartes = session.info.setdefault("disponibilidad_descartes", set())
+    for registro in chain(session.new, session.dirty, session.deleted):
+        if isinstance(registro, CitCita):
+            columnas = ("oficina_id", "inicio", "termino", "estado", "estatus")
+            antes = None
+            if registro not in session.new:
+                antes = _ocupa(*[_valor_anterior(registro, columna) for columna in columnas])
+            despues = None
+            if registro not in session.deleted:
+                despues = _ocupa(*[getattr(registro, columna) for columna in columnas])
+            if antes != despues:
+                if antes is not None:
+                    ajustes.append((*antes, -1))
+                if despues is not None:
+                    ajustes.append((*despues, 1))
+        elif isinstance(registro, CitHoraBloqueada):
+            descartes.add((_valor_anterior(registro, "oficina_id"), _valor_anterior(registro, "fecha")))
+            descartes.add((registro.oficina_id, registro.fecha))
+        elif isinstance(registro, CitDiaInhabil):
+            session.info["disponibilidad_dias_inhabiles"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _aplicar_cambios_disponibilidad(session):
+    """Al confirmar, ajustar los contadores y descartar los días y el conjunto de días inhábiles que cambiaron"""
+    ajustes = session.info.pop("disponibilidad_ajustes", [])
+    descartes = session.info.pop("disponibilidad_descartes", set())
+    dias_inhabiles = session.info.pop("disponibilidad_dias_inhabiles", False)
+    if not (ajustes or descartes or dias_inhabiles) or not has_app_context():
+        return
+    try:
+        ajustar = current_app.redis.register_script(AJUSTAR_SCRIPT)
+        tuberia = current_app.redis.pipeline()
+        for oficina_id, inicio, termino, cambio in ajustes:
+            argumentos = []
+            for numero in slots_de(inicio, termino):
+                argumentos += ["OVERFLOW", "SAT", "INCRBY", "u16", f"#{numero}", cambio]
+            ajustar(keys=[_llave(oficina_id, inicio.date())], args=argumentos, client=tuberia)
+        for oficina_id, fecha in descartes:
+            if oficina_id is not None and fecha is not None:
+                tuberia.delete(_llave(oficina_id, fecha), f"{_llave(oficina_id, fecha)}:bloqueos")
+        if dias_inhabiles:
+            tuberia.delete(DIAS_INHABILES_KEY)
+        tuberia.execute()
+    except RedisError:
+        # Si no se pudo ajustar, descartar los días para que se construyan de nuevo
+        try:
+            descartar_dias([(oficina_id, inicio.date()) for oficina_id, inicio, _, _ in ajustes] + list(descartes))
+        except RedisError:
+            pass
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_cambios_disponibilidad(session):
+    """Al revertir, olvidar los ajustes anotados"""
+    session.info.pop("disponibilidad_ajustes", None)
+    session.info.pop("disponibilidad_descartes", None)
+    session.info.pop("disponibilidad_dias_inhabiles", None)
@@ -0,0 +1,194 @@
+"""
+Exports
+
+Exportar consultas grandes a archivos sin cargarlas en memoria.
+
+- Consulte sólo las columnas que va a exportar con with_entities y los join necesarios
+- stream_rows recorre la consulta por lotes con un cursor del lado del servidor
+- write_xlsx escribe un libro en modo write_only, fila por fila
+- write_csv escribe un archivo CSV, fila por fila
+- write_parquet escribe un archivo Parquet por lotes de EXPORTAR_LOTE filas, requiere pyarrow
+- write_export elige el escritor según el formato, que debe estar en FORMATOS
+- column_types entrega los tipos de las columnas de la consulta; con ellos Parquet arma su esquema desde el inicio y
+  no depende de los valores del primer lote
+- upload_export sube el archivo a Google Cloud Storage por partes, si está configurado el depósito
+
+Ejemplo
+
+    consulta = PagPago.query.with_entities(PagPago.creado, PagPago.folio).filter(...)
+    ruta_local, ruta_gcs = export_paths(LOCAL_BASE_DIRECTORY, GCS_BASE_DIRECTORY, nombre_archivo_xlsx)
+    with TaskProgress(0, "Exportando pagos") as progreso:
+        contador = write_xlsx(ruta_local, ["CREADO", "FOLIO"], progreso.iterate(stream_rows(consulta)))
+    public_url = upload_export(ruta_local, ruta_gcs, XLSX_CONTENT_TYPE)
+"""
+
+import csv
+from datetime import date, datetime, time
+from decimal import Decimal
+from pathlib import Path
+
+import pytz
+from openpyxl import Workbook
+
+from config.settings import get_settings
+from lib.exceptions import MyMissingConfigurationError, MyNotValidParamError
+from lib.google_cloud_storage import upload_filename_to_gcs
+
+EXPORTAR_LOTE = 1000  # Filas por lote que se traen de la base de datos
+TIMEZONE = "America/Mexico_City"
+CSV_CONTENT_TYPE = "text/csv"
+PARQUET_CONTENT_TYPE = "application/vnd.apache.parquet"
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def stream_rows(consulta, lote: int = EXPORTAR_LOTE):
+    """Recorrer la consulta por lotes con un cursor del lado del servidor"""
+    return consulta.yield_per(lote)
+
+
+def column_types(consulta) -> list:
+    """Tipos de SQLAlchemy de las columnas de la consulta, en el mismo orden"""
+    return [descripcion["type"] for descripcion in consulta.column_descriptions]
+
+
+def export_paths(local_base_directory: str, gcs_base_directory: str, nombre_archivo: str) -> tuple[str, str]:
+    """Elaborar las rutas local y en el depósito con directorios del año y mes, crea el directorio local"""
+    ahora = datetime.now(tz=pytz.timezone(TIMEZONE))
+    ruta_local = Path(local_base_directory, ahora.strftime("%Y"), ahora.strftime("%m"))
+    ruta_local.mkdir(parents=True, exist_ok=True)
+    ruta_gcs = Path(gcs_base_directory, ahora.strftime("%Y"), ahora.strftime("%m"))
+    return str(Path(ruta_local, nombre_archivo)), f"{ruta_gcs}/{nombre_archivo}"
+
+
+def write_xlsx(ruta: str, cabeceras: list, filas) -> int:
+    """Escribir las filas en un libro XLSX en modo write_only, entrega la cantidad de filas"""
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet()
+    hoja.append(cabeceras)
+    contador = 0
+    for fila in filas:
+        hoja.append(list(fila))
+        contador += 1
+    libro.save(ruta)
+    return contador
+
+
+def write_csv(ruta: str, cabeceras: list, filas) -> int:
+    """Escribir las filas en un archivo CSV, entrega la cantidad de filas"""
+    contador = 0
+    with open(ruta, "w", encoding="utf-8", newline="") as archivo:
+        escritor = csv.writer(archivo)
+        escritor.writerow(cabeceras)
+        for fila in filas:
+            escritor.writerow(fila)
+            contador += 1
+    return contador
+
+
+def write_parquet(ruta: str, cabeceras: list, filas, lote: int = EXPORTAR_LOTE, tipos: list = None) -> int:
+    """Escribir las filas en un archivo Parquet por lotes, con tipos el esquema sale de ellos, entrega la cantidad de filas"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as error:
+        raise MyMissingConfigurationError("Para exportar a Parquet falta instalar pyarrow") from error
+    esquema = None
+    if tipos is not None:
+        esquema = pa.schema([pa.field(cabecera, _tipo_parquet(pa, tipo)) for cabecera, tipo in zip(cabeceras, tipos)])
+    contador = 0
+    escritor = None
+    columnas = [[] for _ in cabeceras]
+    try:
+        for fila in filas:
+            for columna, valor in zip(columnas, fila):
+                columna.append(valor)
+            contador += 1
+            if len(columnas[0]) >= lote:
+                escritor = _escribir_lote_parquet(pa, pq, ruta, escritor, esquema, cabeceras, columnas)
+                columnas = [[] for _ in cabeceras]
+        if escritor is None or len(columnas[0]) > 0:
+            escritor = _escribir_lote_parquet(pa, pq, ruta, escritor, esquema, cabeceras, columnas)
+    finally:
+        if escritor is not None:
+            escritor.close()
+    return contador
+
+
+FORMATOS = {
+    "csv": (CSV_CONTENT_TYPE, write_csv),
+    "parquet": (PARQUET_CONTENT_TYPE, write_parquet),
+    "xlsx": (XLSX_CONTENT_TYPE, write_xlsx),
+}
+
+
+def write_export(formato: str, ruta: str, cabeceras: list, filas, tipos: list = None) -> int:
+    """Escribir las filas en el formato dado, los tipos de SQLAlchemy sólo los usa Parquet, entrega la cantidad de filas"""
+    if formato not in FORMATOS:
+        raise MyNotValidParamError(f"Formato de exportación no válido: {formato}")
+    _, escritor = FORMATOS[formato]
+    if formato == "parquet":
+        return escritor(ruta, cabeceras, filas, tipos=tipos)
+    return escritor(ruta, cabeceras, filas)
+
+
+def upload_export(ruta_local: str, ruta_gcs: str, content_type: str) -> str:
+    """Subir el archivo al depósito por partes, entrega el URL público o texto vacío si no está configurado"""
+    settings = get_settings()
+    if settings.CLOUD_STORAGE_DEPOSITO == "":
+        return ""
+    return upload_filename_to_gcs(
+        bucket_name=settings.CLOUD_STORAGE_DEPOSITO,
+        blob_name=ruta_gcs,
+        content_type=content_type,
+        filename=ruta_local,
+    )
+
+
+def _escribir_lote_parquet(pa, pq, ruta: str, escritor, esquema, cabeceras: list, columnas: list):
+    """Escribir un lote; sin esquema lo define el primero y las columnas sin valores en él se toman como texto"""
+    if escritor is None:
+        if esquema is None:
+            tabla = pa.table(dict(zip(cabeceras, columnas)))
+            esquema = pa.schema(
+                [pa.field(campo.name, pa.string()) if pa.types.is_null(campo.type) else campo for campo in tabla.schema]
+            )
+        escritor = pq.ParquetWriter(ruta, esquema)
+    # Las columnas de texto aceptan cualquier valor, por ejemplo un UUID o un número en un lote posterior
+    for posicion, campo in enumerate(escritor.schema):
+        if pa.types.is_string(campo.type):
+            columnas[posicion] = [_texto(valor) for valor in columnas[posicion]]
+    tabla = pa.table(dict(zip(cabeceras, columnas)), schema=escritor.schema)
+    escritor.write_table(tabla)
+    return escritor
+
+
+def _texto(valor):
+    """Convertir a texto, conserva None"""
+    if valor is None or isinstance(valor, str):
+        return valor
+    return str(valor)
+
+
+def _tipo_parquet(pa, tipo):
+    """Tipo de pyarrow para un tipo de SQLAlchemy, si no tiene equivalente se guarda como texto"""
+    try:
+        python_type = tipo.python_type
+    except NotImplementedError:
+        return pa.string()
+    if python_type is bool:
+        return pa.bool_()
+    if python_type is int:
+        return pa.int64()
+    if python_type is float:
+        return pa.float64()
+    if python_type is Decimal:
+        if getattr(tipo, "precision", None) is not None:
+            return pa.decimal128(tipo.precision, tipo.scale or 0)
+        return pa.string()
+    if python_type is datetime:
+        return pa.timestamp("us", tz="UTC" if getattr(tipo, "timezone", False) else None)
+    if python_type is date:
+        return pa.date32()
+    if python_type is time:
+        return pa.time64("us")
+    return pa.string()
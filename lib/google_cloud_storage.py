@@ -201,3 +201,43 @@ def upload_file_to_gcs(
 
     # Return public URL
     return blob.public_url
+
+
+def upload_filename_to_gcs(
+    bucket_name: str,
+    blob_name: str,
+    content_type: str,
+    filename: str,
+    chunk_size: int = 8 * 1024 * 1024,
+) -> str:
+    """
+    Upload a local file to Google Cloud Storage in chunks, without reading it all into memory
+
+    :param bucket_name: Name of the bucket
+    :param blob_name: Path to the file
+    :param content_type: Content type of the file
+    :param filename: Path to the local file
+    :param chunk_size: Size of each chunk of the resumable upload, must be a multiple of 256 KB
+    :return: Public URL
+    """
+
+    # Get bucket
+    storage_client = storage.Client()
+    try:
+        bucket = storage_client.get_bucket(bucket_name)
+    except NotFound as error:
+        raise MyBucketNotFoundError("Bucket not found") from error
+
+    # Create blob, with chunk_size the upload is resumable and sent in chunks
+    blob = bucket.blob(blob_name, chunk_size=chunk_size)
+
+    # Upload file
+    try:
+        blob.upload_from_filename(filename, content_type=content_type)
+    except FileNotFoundError as error:
+        raise MyFileNotFoundError("File not found") from error
+    except Exception as error:
+        raise MyUploadError("Error uploading file") from error
+
+    # Return public URL
+    return blob.public_url
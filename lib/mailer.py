@@ -0,0 +1,225 @@
+"""
+Mailer
+
+Enviar mensajes por email desde las tareas en el fondo, reutilizando las plantillas compiladas y las conexiones.
+
+El transporte se elige con la variable de entorno MAILER_TRANSPORTE
+
+- sendgrid: por defecto, usa el API de SendGrid con una sesión HTTP persistente por hilo
+- archivo: guarda cada mensaje como .eml en MAILER_DIRECTORIO, para desarrollo y pruebas
+- smtp: entrega a un servidor SMTP local en MAILER_SMTP_HOST y MAILER_SMTP_PORT, por ejemplo MailHog
+
+Ejemplo
+
+    plantilla = get_template(JINJA2_TEMPLATES_DIR, "email_pending.jinja2")
+    contenidos = plantilla.render(cit_cita=cit_cita)
+    send_email(to_email, "PJECZ Sistema de Citas: Cita agendada", contenidos)
+
+Para muchos mensajes, send_many recibe tuplas (to_email, asunto, contenidos) y entrega la cantidad enviada y los errores.
+Si se necesita saber cuáles se enviaron, send_each recibe tuplas (clave, to_email, asunto, contenidos) y entrega
+(clave, error) de cada uno, donde error es None si se envió. Ambas aceptan hilos y un límite de mensajes por segundo
+
+    for clave, error in send_each(mensajes, hilos=8, por_segundo=20):
+        ...
+
+Para enviar por lotes sin perder las conexiones de cada hilo entre un lote y otro, pase el mismo ejecutor a cada llamada
+
+    with ThreadPoolExecutor(max_workers=8) as ejecutor:
+        for lote in lotes:
+            for clave, error in send_each(lote, hilos=8, por_segundo=20, ejecutor=ejecutor):
+                ...
+
+Las plantillas y las conexiones viven en el proceso. Como RQ ejecuta cada tarea en un proceso hijo, se aprovechan
+dentro de una misma tarea (por ejemplo al reenviar) y entre tareas cuando el worker es SimpleWorker.
+"""
+
+import os
+import smtplib
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.message import EmailMessage
+from functools import lru_cache
+from pathlib import Path
+from uuid import uuid4
+
+import requests
+from dotenv import load_dotenv
+from jinja2 import Environment, FileSystemLoader, Template
+from sendgrid.helpers.mail import Content, Email, Mail, To
+
+from lib.exceptions import MyAnyError, MyConnectionError, MyNotExistsError
+
+# Cargar variables de entorno
+load_dotenv()
+MAILER_TRANSPORTE = os.getenv("MAILER_TRANSPORTE", "sendgrid")
+MAILER_DIRECTORIO = os.getenv("MAILER_DIRECTORIO", "exports/mensajes")
+MAILER_SMTP_HOST = os.getenv("MAILER_SMTP_HOST", "localhost")
+MAILER_SMTP_PORT = int(os.getenv("MAILER_SMTP_PORT", "1025"))
+SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY", "")
+SENDGRID_FROM_EMAIL = os.getenv("SENDGRID_FROM_EMAIL", "citas@pjecz.gob.mx")
+
+# Constantes
+LAYOUTS_DIR = "citas_admin/templates"  # Para que las plantillas puedan extender layouts/email.jinja2
+SENDGRID_URL = "https://api.sendgrid.com/v3/mail/send"
+TIMEOUT = 30  # Segundos
+
+# Conexiones por hilo, para que send_email se pueda usar desde varios hilos a la vez
+_conexiones = threading.local()
+
+
+@lru_cache(maxsize=None)
+def get_environment(templates_dir: str) -> Environment:
+    """Entorno de Jinja2 por directorio, conserva las plantillas compiladas sin revisar si cambiaron los archivos"""
+    return Environment(
+        loader=FileSystemLoader([templates_dir, LAYOUTS_DIR]),
+        trim_blocks=True,
+        lstrip_blocks=True,
+        auto_reload=False,
+    )
+
+
+def get_template(templates_dir: str, template_name: str) -> Template:
+    """Obtener la plantilla compilada"""
+    return get_environment(templates_dir).get_template(template_name)
+
+
+def is_configured() -> bool:
+    """¿Está configurado el transporte?"""
+    if MAILER_TRANSPORTE == "sendgrid":
+        return SENDGRID_API_KEY != ""
+    return MAILER_TRANSPORTE in ("archivo", "smtp")
+
+
+def send_email(to_email: str, asunto: str, contenidos: str) -> None:
+    """Enviar un mensaje en HTML"""
+    if MAILER_TRANSPORTE == "archivo":
+        _enviar_archivo(to_email, asunto, contenidos)
+    elif MAILER_TRANSPORTE == "smtp":
+        _enviar_smtp(to_email, asunto, contenidos)
+    else:
+        _enviar_sendgrid(to_email, asunto, contenidos)
+
+
+def send_many(mensajes, hilos: int = 1, por_segundo: float = 0) -> tuple[int, list[str]]:
+    """Enviar varios mensajes (to_email, asunto, contenidos), entrega la cantidad enviada y los errores"""
+    enviados = 0
+    errores = []
+    for _, error in send_each(((None, *mensaje) for mensaje in mensajes), hilos, por_segundo):
+        if error is None:
+            enviados += 1
+        else:
+            errores.append(error)
+    return enviados, errores
+
+
+def send_each(mensajes, hilos: int = 1, por_segundo: float = 0, ejecutor: ThreadPoolExecutor = None):
+    """Enviar varios mensajes (clave, to_email, asunto, contenidos), entrega (clave, error) de cada uno al terminar"""
+    limitador = _Limitador(por_segundo)
+    if ejecutor is not None:
+        yield from _enviar_en(ejecutor, limitador, mensajes, hilos)
+        return
+    if hilos <= 1:
+        for mensaje in mensajes:
+            yield _enviar_con_clave(limitador, *mensaje)
+        return
+    with ThreadPoolExecutor(max_workers=hilos) as ejecutor:
+        yield from _enviar_en(ejecutor, limitador, mensajes, hilos)
+
+
+def _enviar_en(ejecutor: ThreadPoolExecutor, limitador, mensajes, hilos: int):
+    """Enviar con los hilos del ejecutor, toma de mensajes sólo los que caben en la cola para no cargarlos todos en memoria"""
+    pendientes = set()
+    for mensaje in mensajes:
+        if len(pendientes) >= 2 * max(hilos, 1):
+            terminados, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+            for terminado in terminados:
+                yield terminado.result()
+        pendientes.add(ejecutor.submit(_enviar_con_clave, limitador, *mensaje))
+    for terminado in wait(pendientes).done:
+        yield terminado.result()
+
+
+class _Limitador:
+    """Espaciar los envíos para no rebasar una cantidad por segundo, compartido entre hilos"""
+
+    def __init__(self, por_segundo: float):
+        self.intervalo = 1 / por_segundo if por_segundo > 0 else 0
+        self.siguiente = time.monotonic()
+        self.candado = threading.Lock()
+
+    def esperar(self):
+        """Esperar el turno del siguiente envío"""
+        if self.intervalo == 0:
+            return
+        with self.candado:
+            ahora = time.monotonic()
+            turno = max(self.siguiente, ahora)
+            self.siguiente = turno + self.intervalo
+        if turno > ahora:
+            time.sleep(turno - ahora)
+
+
+def _enviar_con_clave(limitador: _Limitador, clave, to_email: str, asunto: str, contenidos: str):
+    """Esperar el turno y enviar, entrega la clave y el error o None"""
+    limitador.esperar()
+    try:
+        send_email(to_email, asunto, contenidos)
+    except MyAnyError as error:
+        return clave, str(error)
+    return clave, None
+
+
+def _elaborar_mensaje(to_email: str, asunto: str, contenidos: str) -> EmailMessage:
+    """Elaborar el mensaje para los transportes archivo y smtp"""
+    mensaje = EmailMessage()
+    mensaje["From"] = SENDGRID_FROM_EMAIL
+    mensaje["To"] = to_email
+    mensaje["Subject"] = asunto
+    mensaje.set_content(contenidos, subtype="html")
+    return mensaje
+
+
+def _enviar_archivo(to_email: str, asunto: str, contenidos: str) -> None:
+    """Guardar el mensaje como archivo .eml"""
+    directorio = Path(MAILER_DIRECTORIO)
+    directorio.mkdir(parents=True, exist_ok=True)
+    ruta = directorio / f"{uuid4().hex}.eml"
+    ruta.write_bytes(_elaborar_mensaje(to_email, asunto, contenidos).as_bytes())
+
+
+def _enviar_sendgrid(to_email: str, asunto: str, contenidos: str) -> None:
+    """Enviar por el API de SendGrid con la sesión HTTP del hilo"""
+    if SENDGRID_API_KEY == "":
+        raise MyNotExistsError("No está configurado el API Key de SendGrid")
+    sesion = getattr(_conexiones, "sesion", None)
+    if sesion is None:
+        sesion = requests.Session()
+        sesion.headers.update({"Authorization": f"Bearer {SENDGRID_API_KEY}"})
+        _conexiones.sesion = sesion
+    mail = Mail(Email(SENDGRID_FROM_EMAIL), To(to_email), asunto, Content("text/html", contenidos))
+    try:
+        respuesta = sesion.post(SENDGRID_URL, json=mail.get(), timeout=TIMEOUT)
+    except requests.RequestException as error:
+        raise MyConnectionError(f"No se pudo enviar el mensaje a {to_email}: {error}") from error
+    if respuesta.status_code >= 400:
+        raise MyConnectionError(f"SendGrid rechazó el mensaje a {to_email}: {respuesta.status_code} {respuesta.text}")
+
+
+def _enviar_smtp(to_email: str, asunto: str, contenidos: str) -> None:
+    """Enviar por SMTP con la conexión del hilo, si el servidor la cerró se abre otra"""
+    mensaje = _elaborar_mensaje(to_email, asunto, contenidos)
+    for _ in range(2):
+        try:
+            smtp = getattr(_conexiones, "smtp", None)
+            if smtp is None:
+                smtp = smtplib.SMTP(MAILER_SMTP_HOST, MAILER_SMTP_PORT, timeout=TIMEOUT)
+                _conexiones.smtp = smtp
+            smtp.send_message(mensaje)
+            return
+        except smtplib.SMTPServerDisconnected:
+            _conexiones.smtp = None
+        except (smtplib.SMTPException, OSError) as error:
+            _conexiones.smtp = None
+            raise MyConnectionError(f"No se pudo enviar el mensaje a {to_email}: {error}") from error
+    raise MyConnectionError(f"No se pudo enviar el mensaje a {to_email}: el servidor SMTP cerró la conexión")
@@ -1,10 +1,38 @@
 """
 Tareas en el fondo
+
+El progreso y el mensaje se guardan siempre en el meta del job en Redis. El registro en la tabla tareas sólo se actualiza
+cuando han pasado TAREA_GUARDAR_INTERVALO segundos desde la última vez, cuando cambian archivo o url y al terminar.
+Se actualiza con su propia conexión, así que no confirma la sesión de la tarea ni cierra sus cursores abiertos.
+
+Para informar el avance de un bucle como "n de total" use TaskProgress
+
+    with TaskProgress(len(cit_citas), "Enviando mensajes") as progreso:
+        for cit_cita in progreso.iterate(cit_citas):
+            ...
+
+O sin conocer el total de antemano
+
+    progreso = TaskProgress(total, "Exportando")
+    for fila in consulta.yield_per(500):
+        ...
+        progreso.advance()
 """
 
+import time
+from uuid import UUID
+
 from rq import get_current_job
+from sqlalchemy import update
 
 from citas_admin.blueprints.tareas.models import Tarea
+from citas_admin.extensions import database
+
+TAREA_GUARDAR_INTERVALO = 10  # Segundos mínimos entre escrituras del progreso en la tabla tareas
+TAREA_META_INTERVALO = 0.5  # Segundos mínimos entre escrituras del avance de TaskProgress en Redis
+
+# Momento de la última escritura en la tabla tareas por cada job
+_ultima_escritura = {}
 
 
 def set_task_progress(progress: int, message: str, archivo: str = "", url: str = "") -> None:
@@ -12,27 +40,24 @@ def set_task_progress(progress: int, message: str, archivo: str = "", url: str =
     job = get_current_job()
     if job:
         job.meta["progress"] = progress
+        job.meta["message"] = message
         job.save_meta()
-        tarea = Tarea.query.get(job.get_id())
-        if tarea:
-            hay_cambios = False
-            if archivo != "" and archivo != tarea.archivo:
-                tarea.archivo = archivo
-                hay_cambios = True
-            if url != "" and url != tarea.url:
-                tarea.url = url
-                hay_cambios = True
-            if progress < 100 and tarea.ha_terminado is True:
-                tarea.ha_terminado = False
-                hay_cambios = True
-            if progress >= 100 and tarea.ha_terminado is False:
-                tarea.ha_terminado = True
-                hay_cambios = True
-            if message != tarea.mensaje:
-                tarea.mensaje = message
-                hay_cambios = True
-            if hay_cambios:
-                tarea.save()
+        # Guardar en la base de datos sólo al iniciar, al cambiar archivo o url, al terminar o cada cierto intervalo
+        ahora = time.monotonic()
+        ultima = _ultima_escritura.get(job.get_id())
+        if ultima is not None and progress < 100 and archivo == "" and url == "":
+            if ahora - ultima < TAREA_GUARDAR_INTERVALO:
+                return
+        if progress >= 100:
+            _ultima_escritura.pop(job.get_id(), None)
+        else:
+            _ultima_escritura[job.get_id()] = ahora
+        cambios = {"mensaje": message, "ha_terminado": progress >= 100}
+        if archivo != "":
+            cambios["archivo"] = archivo
+        if url != "":
+            cambios["url"] = url
+        _actualizar_tarea(job.get_id(), cambios)
 
 
 def set_task_error(message: str) -> str:
@@ -40,10 +65,55 @@ def set_task_error(message: str) -> str:
     job = get_current_job()
     if job:
         job.meta["progress"] = 100
+        job.meta["message"] = message
         job.save_meta()
-        tarea = Tarea.query.get(job.get_id())
-        if tarea:
-            tarea.ha_terminado = True
-            tarea.mensaje = message
-            tarea.save()
+        _ultima_escritura.pop(job.get_id(), None)
+        _actualizar_tarea(job.get_id(), {"mensaje": message, "ha_terminado": True})
     return message
+
+
+def _actualizar_tarea(tarea_id: str, cambios: dict) -> None:
+    """Actualizar la tarea con una sola sentencia en su propia transacción, sin confirmar la sesión de la tarea en curso"""
+    with database.engine.begin() as conexion:
+        conexion.execute(update(Tarea).where(Tarea.id == UUID(tarea_id)).values(**cambios))
+
+
+class TaskProgress:
+    """Informar el avance de un bucle como n de total, sin escribir en Redis ni en la base de datos en cada vuelta"""
+
+    def __init__(self, total: int, message: str, intervalo: float = TAREA_META_INTERVALO):
+        self.total = total
+        self.message = message
+        self.intervalo = intervalo
+        self.cantidad = 0
+        self.ultimo = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Al salir del bloque sin errores, informar la última cantidad
+        if exc_type is None:
+            self.report()
+        return False
+
+    def advance(self, cantidad: int = 1) -> None:
+        """Avanzar, sólo se informa si ya pasó el intervalo"""
+        self.cantidad += cantidad
+        if time.monotonic() - self.ultimo >= self.intervalo:
+            self.report()
+
+    def iterate(self, iterable):
+        """Recorrer el iterable avanzando en cada elemento"""
+        for elemento in iterable:
+            yield elemento
+            self.advance()
+
+    def report(self) -> None:
+        """Informar el avance, el porcentaje se queda en 99 hasta que la tarea llame a set_task_progress con 100"""
+        self.ultimo = time.monotonic()
+        if self.total > 0:
+            porcentaje = min(int(self.cantidad * 100 / self.total), 99)
+            set_task_progress(porcentaje, f"{self.message}: {self.cantidad} de {self.total}")
+        else:
+            set_task_progress(0, f"{self.message}: {self.cantidad}")
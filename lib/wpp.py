@@ -1,17 +1,114 @@
 """
 Web Pay Plus
+
+Cliente para crear los links de pago. Las conexiones a WPP_URL se reutilizan entre peticiones.
+
+- send_chain y create_pay_link son síncronas, usan una sesión de requests compartida con hasta WPP_CONEXIONES
+  conexiones abiertas y reintentos sólo cuando no se pudo conectar o cuando WPP responde 503
+- send_chain_async y create_pay_link_async son para asyncio, usan un httpx.AsyncClient por ciclo de eventos si está
+  instalado httpx (poetry install --extras async); si no, ejecutan la versión síncrona en un hilo sin bloquear el
+  ciclo de eventos
+- Si WPP no responde en WPP_TIMEOUT segundos o falla después de los reintentos, causa MyConnectionError
+
+No se reintenta cuando la petición ya se envió y no llegó la respuesta, para no crear dos links del mismo pago.
+
+Las cadenas se cifran y descifran con WPPCodec, uno por llave, que valida la llave y prepara el algoritmo una sola vez.
+Las respuestas se descifran a bytes y se analizan en una sola pasada, la declaración <?xml ...?> no estorba. Para
+procesar muchos resultado_xml a la vez use get_responses, que entrega cada respuesta o su error sin detenerse; acepta
+tanto las respuestas cifradas como las que ya se guardaron descifradas.
+
+Para medir el rendimiento sin conectarse a WPP use el servidor simulado de cli/commands/cmd_wpp.py
+
+    python -m cli.app wpp simular --puerto 8081
+    WPP_URL=http://localhost:8081 python -m cli.app wpp medir --cantidad 500 --concurrencia 20
+    python -m cli.app wpp medir-codec --cantidad 10000
 """
 
+import asyncio
+import base64
 import os
+import threading
 import xml.etree.ElementTree as ET
+from functools import lru_cache
 
 import requests
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
 
-from lib.AESEncryption import AES128Encryption
+from lib.exceptions import MyConnectionError, MyMissingConfigurationError, MyNotValidParamError, MyStatusCodeError
 
 load_dotenv()  # Take environment variables from .env
 
+# Constantes
+WPP_CONEXIONES = int(os.getenv("WPP_CONEXIONES", "20"))  # Conexiones abiertas que se conservan
+WPP_REINTENTOS = int(os.getenv("WPP_REINTENTOS", "3"))
+WPP_TIMEOUT = float(os.getenv("WPP_TIMEOUT", "30"))  # Segundos
+WPP_ESPERA_BASE = 0.5  # Segundos de espera antes del primer reintento, se duplica en cada uno
+WPP_ESTADOS_REINTENTAR = (503,)  # Sólo servicio no disponible, con 502 y 504 WPP pudo haber creado el link
+WPP_HEADERS = {"Content-Type": "application/x-www-form-urlencoded"}
+WPP_RESPUESTA_NODOS = {  # Llave en la respuesta procesada: nodo del XML
+    "pago_id": "reference",
+    "response": "response",
+    "foliocpagos": "foliocpagos",
+    "auth": "auth",
+    "email": "email",
+    "amount": "amount",
+}
+
+# Sesión síncrona compartida entre hilos y clientes asíncronos por ciclo de eventos
+_sesion = None
+_sesion_candado = threading.Lock()
+_clientes_async = {}
+
+
+class WPPCodec:
+    """Cifrar y descifrar cadenas de WPP con AES-128 CBC, el IV va al inicio y todo en base64"""
+
+    TAMANO_BLOQUE = 16  # Bytes
+
+    def __init__(self, hex_key: str):
+        try:
+            llave = bytes.fromhex(hex_key)
+        except ValueError as error:
+            raise MyNotValidParamError("La llave de WPP debe ser hexadecimal") from error
+        if len(llave) != self.TAMANO_BLOQUE:
+            raise MyNotValidParamError("La llave de WPP debe tener 32 caracteres hexadecimales")
+        self.algoritmo = algorithms.AES(llave)
+
+    def encrypt(self, plaintext: str) -> bytes:
+        """Cifrar, entrega el IV y el texto cifrado en base64"""
+        iv = os.urandom(self.TAMANO_BLOQUE)
+        relleno = padding.PKCS7(self.TAMANO_BLOQUE * 8).padder()
+        datos = relleno.update(plaintext.encode("utf-8")) + relleno.finalize()
+        cifrador = Cipher(self.algoritmo, modes.CBC(iv)).encryptor()
+        return base64.b64encode(iv + cifrador.update(datos) + cifrador.finalize())
+
+    def decrypt_bytes(self, ciphertext) -> bytes:
+        """Descifrar el base64 con el IV al inicio, entrega los bytes sin relleno"""
+        crudo = base64.b64decode(ciphertext)
+        descifrador = Cipher(self.algoritmo, modes.CBC(crudo[: self.TAMANO_BLOQUE])).decryptor()
+        datos = descifrador.update(crudo[self.TAMANO_BLOQUE :]) + descifrador.finalize()
+        sin_relleno = padding.PKCS7(self.TAMANO_BLOQUE * 8).unpadder()
+        return sin_relleno.update(datos) + sin_relleno.finalize()
+
+    def decrypt(self, ciphertext) -> str:
+        """Descifrar a texto"""
+        return self.decrypt_bytes(ciphertext).decode("utf-8")
+
+
+@lru_cache(maxsize=4)
+def get_codec(hex_key: str) -> WPPCodec:
+    """WPPCodec de la llave, se crea una sola vez por llave"""
+    return WPPCodec(hex_key)
+
 
 def create_chain_xml(amount, email, description, cit_client_id):
     """Crear cadena XML"""
@@ -52,9 +149,7 @@ def encrypt_chain(chain: str):
     key = os.getenv("WPP_KEY")
     if key is None:
         return None
-    aes_encryptor = AES128Encryption()
-    ciphertext = aes_encryptor.encrypt(chain, key)
-    return ciphertext
+    return get_codec(key).encrypt(chain)
 
 
 def decrypt_chain(chain_encrypted: str):
@@ -62,100 +157,185 @@ def decrypt_chain(chain_encrypted: str):
     key = os.getenv("WPP_KEY")
     if key is None:
         return None
-    aes_encryptor = AES128Encryption()
-    plaintext = aes_encryptor.decrypt(key, chain_encrypted)
-    return plaintext
-
+    return get_codec(key).decrypt(chain_encrypted)
 
-async def send_chain(chain: str):
-    """Send to WPP"""
-
-    # Get the commerce ID
-    commerce_id = os.getenv("WPP_COMMERCE_ID")
-    if commerce_id is None:
-        raise ValueError("No se ha definido el WPP_COMMERCE_ID")
-
-    # Get the WPP URL
-    wpp_url = os.getenv("WPP_URL")
-    if wpp_url is None:
-        raise ValueError("No se ha definido el WPP_URL")
 
-    # Pack the chain
-    root = ET.Element("pgs")
-    ET.SubElement(root, "data0").text = commerce_id
-    ET.SubElement(root, "data").text = chain
-
-    chain_bytes = ET.tostring(root, encoding="unicode")
+def send_chain(chain: str) -> str:
+    """Enviar la cadena cifrada a WPP con la sesión compartida, entrega el texto de la respuesta"""
+    wpp_url, payload = _elaborar_peticion(chain)
+    try:
+        response = _obtener_sesion().post(wpp_url, headers=WPP_HEADERS, data=payload, timeout=WPP_TIMEOUT)
+    except requests.RequestException as error:
+        raise MyConnectionError(f"No se pudo enviar a WPP: {error}") from error
+    if response.status_code >= 400:
+        raise MyStatusCodeError(f"WPP respondió {response.status_code}")
+    return response.text
 
-    # Se prepara el envío del xml vía POST a la url de WPP
-    payload = "xml=" + chain_bytes
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    response = requests.request("POST", wpp_url, headers=headers, data=payload)
 
-    # Return
+async def send_chain_async(chain: str) -> str:
+    """Enviar la cadena cifrada a WPP sin bloquear el ciclo de eventos, entrega el texto de la respuesta"""
+    if httpx is None:
+        return await asyncio.to_thread(send_chain, chain)
+    wpp_url, payload = _elaborar_peticion(chain)
+    cliente = _obtener_cliente_async()
+    for intento in range(WPP_REINTENTOS + 1):
+        try:
+            response = await cliente.post(wpp_url, headers=WPP_HEADERS, content=payload)
+        except httpx.ConnectError as error:
+            # No se pudo conectar, la petición no llegó a WPP y se puede reintentar
+            if intento == WPP_REINTENTOS:
+                raise MyConnectionError(f"No se pudo conectar a WPP: {error}") from error
+        except httpx.HTTPError as error:
+            raise MyConnectionError(f"No se pudo enviar a WPP: {error}") from error
+        else:
+            if response.status_code not in WPP_ESTADOS_REINTENTAR or intento == WPP_REINTENTOS:
+                break
+        await asyncio.sleep(WPP_ESPERA_BASE * 2**intento)
+    if response.status_code >= 400:
+        raise MyStatusCodeError(f"WPP respondió {response.status_code}")
     return response.text
 
 
 def get_url_from_xml_encrypt(xml_encrypt: str):
     """Extrae la url del xml de respuesta"""
-    xml = decrypt_chain(xml_encrypt)
-    root = ET.fromstring(xml)
-    return root.find("nb_url").text
+    return _parse_xml(_obtener_codec().decrypt_bytes(xml_encrypt)).findtext("nb_url")
 
 
 def create_pay_link(email: str, service_detail: str, cit_client_id: int, amount: float):
     """Regresa el link para mostrar el formulario de pago"""
+    respuesta = send_chain(_elaborar_cadena(email, service_detail, cit_client_id, amount))
+    if respuesta:
+        return get_url_from_xml_encrypt(respuesta)  # URL del link de formulario de pago
+    return None
+
+
+async def create_pay_link_async(email: str, service_detail: str, cit_client_id: int, amount: float):
+    """Regresa el link para mostrar el formulario de pago, para usarse con asyncio"""
+    respuesta = await send_chain_async(_elaborar_cadena(email, service_detail, cit_client_id, amount))
+    if respuesta:
+        return get_url_from_xml_encrypt(respuesta)  # URL del link de formulario de pago
+    return None
 
+
+def get_response(xml_encrypt_str: str):
+    """Entrega una respuesta procesada"""
+    return _respuesta(_parse_xml(_obtener_codec().decrypt_bytes(xml_encrypt_str)))
+
+
+def get_responses(xml_encrypt_strs):
+    """Procesar muchas respuestas, cifradas o ya descifradas, entrega (respuesta, None) o (None, error) de cada una en orden"""
+    codec = None
+    for xml_encrypt_str in xml_encrypt_strs:
+        try:
+            if _es_xml(xml_encrypt_str):
+                xml = xml_encrypt_str.encode("utf-8") if isinstance(xml_encrypt_str, str) else xml_encrypt_str
+            else:
+                codec = codec or _obtener_codec()
+                xml = codec.decrypt_bytes(xml_encrypt_str)
+            yield _respuesta(_parse_xml(xml)), None
+        except (ValueError, TypeError, ET.ParseError) as error:
+            yield None, f"No se pudo procesar la respuesta de WPP: {error}"
+
+
+def _respuesta(root: ET.Element) -> dict:
+    """Tomar los nodos de la respuesta, los que falten quedan en None"""
+    return {llave: root.findtext(nodo) for llave, nodo in WPP_RESPUESTA_NODOS.items()}
+
+
+def _es_xml(texto) -> bool:
+    """Verdadero si el texto ya es XML, es decir, no viene cifrado en base64"""
+    return texto.lstrip()[:1] in ("<", b"<")
+
+
+def _parse_xml(xml: bytes) -> ET.Element:
+    """Analizar el XML en una sola pasada, expat acepta la declaración si está al inicio"""
+    if xml[:1].isspace():
+        xml = xml.lstrip()
+    return ET.fromstring(xml)
+
+
+def _obtener_codec() -> WPPCodec:
+    """WPPCodec con la llave WPP_KEY"""
+    key = os.getenv("WPP_KEY")
+    if key is None:
+        raise MyMissingConfigurationError("No se ha definido el WPP_KEY")
+    return get_codec(key)
+
+
+def _elaborar_cadena(email: str, service_detail: str, cit_client_id: int, amount: float) -> str:
+    """Elaborar y cifrar la cadena XML del link de pago"""
     chain = create_chain_xml(
         amount=amount,
         email=email,
         description=service_detail,
         cit_client_id=cit_client_id,
     )
+    chain_encrypt = encrypt_chain(chain)
+    if chain_encrypt is None:
+        raise MyMissingConfigurationError("No se ha definido el WPP_KEY")
+    return chain_encrypt.decode()  # bytes
 
-    chain_encrypt = encrypt_chain(chain).decode()  # bytes
-    respuesta = None
-    try:
-        respuesta = send_chain(chain_encrypt)
-    except Exception as err:
-        raise BaseException(f"ERROR: Algo a salido mal en el envío. {err}")
 
-    if respuesta:
-        url_pay = get_url_from_xml_encrypt(respuesta)
-        return url_pay  # URL del link de formulario de pago
+def _elaborar_peticion(chain: str) -> tuple[str, str]:
+    """Entregar el URL de WPP y el contenido del POST con la cadena empaquetada"""
 
-    return None
+    # Get the commerce ID
+    commerce_id = os.getenv("WPP_COMMERCE_ID")
+    if commerce_id is None:
+        raise MyMissingConfigurationError("No se ha definido el WPP_COMMERCE_ID")
+
+    # Get the WPP URL
+    wpp_url = os.getenv("WPP_URL")
+    if wpp_url is None:
+        raise MyMissingConfigurationError("No se ha definido el WPP_URL")
 
+    # Pack the chain
+    root = ET.Element("pgs")
+    ET.SubElement(root, "data0").text = commerce_id
+    ET.SubElement(root, "data").text = chain
 
-def get_response(xml_encrypt_str: str):
-    """Entrega una respuesta procesada"""
-    respuesta = {
-        "pago_id": None,
-        "response": None,
-        "auth": None,
-        "email": None,
-    }
-
-    # procesar el xml encriptado
-    xml = decrypt_chain(xml_encrypt_str)
-    xml = _clean_xml(xml)
-    root = ET.fromstring(xml)
-
-    # Obtener nodos de respuesta
-    respuesta["pago_id"] = root.find("reference").text
-    respuesta["response"] = root.find("response").text
-    respuesta["foliocpagos"] = root.find("foliocpagos").text
-    respuesta["auth"] = root.find("auth").text
-    respuesta["email"] = root.find("email").text
-
-    return respuesta
-
-
-def _clean_xml(xml_str: str):
-    """Quita los comentarios del archivo XML que no puede procesar la clase XML"""
-    xml_limpio = ""
-    for line in xml_str.split("\n"):
-        if "<?" not in line:
-            xml_limpio += line
-
-    return xml_limpio
+    # Se prepara el envío del xml vía POST a la url de WPP
+    return wpp_url, "xml=" + ET.tostring(root, encoding="unicode")
+
+
+def _obtener_sesion() -> requests.Session:
+    """Sesión de requests compartida, se crea la primera vez"""
+    global _sesion
+    with _sesion_candado:
+        if _sesion is None:
+            reintentos = Retry(
+                total=WPP_REINTENTOS,
+                connect=WPP_REINTENTOS,
+                read=0,  # Si ya se envió la petición no se reintenta
+                status=WPP_REINTENTOS,
+                status_forcelist=WPP_ESTADOS_REINTENTAR,
+                allowed_methods=frozenset(["POST"]),
+                backoff_factor=WPP_ESPERA_BASE,
+                raise_on_status=False,
+            )
+            adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=WPP_CONEXIONES, max_retries=reintentos)
+            sesion = requests.Session()
+            sesion.mount("http://", adaptador)
+            sesion.mount("https://", adaptador)
+            _sesion = sesion
+    return _sesion
+
+
+def _obtener_cliente_async():
+    """Cliente de httpx del ciclo de eventos en curso, se crea la primera vez en cada ciclo"""
+    ciclo = asyncio.get_running_loop()
+    cliente = _clientes_async.get(ciclo)
+    if cliente is None or cliente.is_closed:
+        cliente = httpx.AsyncClient(
+            timeout=WPP_TIMEOUT,
+            limits=httpx.Limits(max_connections=WPP_CONEXIONES, max_keepalive_connections=WPP_CONEXIONES),
+        )
+        _clientes_async[ciclo] = cliente
+    return cliente
+
+
+async def close_async_client() -> None:
+    """Cerrar el cliente asíncrono del ciclo de eventos en curso, llamar antes de terminar el ciclo"""
+    cliente = _clientes_async.pop(asyncio.get_running_loop(), None)
+    if cliente is not None:
+        await cliente.aclose()
@@ -0,0 +1,45 @@
+"""
+Pruebas, configuración
+
+Las pruebas usan SQLite en memoria. Si Redis no está disponible, lo que se guarda en él se omite.
+"""
+
+import os
+
+# Definir la configuración antes de cargar la aplicación, Settings la lee al importarse
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/15")
+os.environ.setdefault("SALT", "pruebas")
+os.environ.setdefault("SECRET_KEY", "pruebas")
+os.environ.setdefault("SQLALCHEMY_DATABASE_URI", "sqlite://")
+os.environ.setdefault("TASK_QUEUE", "pruebas")
+
+import pytest
+from sqlalchemy import event
+
+from citas_admin.app import create_app
+from citas_admin.extensions import database
+
+
+@pytest.fixture(name="app")
+def app_fixture():
+    """Aplicación con las tablas creadas en una base de datos vacía"""
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with app.app_context():
+        database.create_all()
+        yield app
+        database.session.remove()
+        database.drop_all()
+
+
+@pytest.fixture(name="contar_consultas")
+def contar_consultas_fixture(app):
+    """Entrega una lista a la que se agrega cada sentencia que se ejecuta en la base de datos"""
+    sentencias = []
+
+    def agregar(conn, cursor, statement, parameters, context, executemany):
+        sentencias.append(statement)
+
+    event.listen(database.engine, "before_cursor_execute", agregar)
+    yield sentencias
+    event.remove(database.engine, "before_cursor_execute", agregar)
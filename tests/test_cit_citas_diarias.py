@@ -0,0 +1,109 @@
+"""
+Pruebas de cit_citas_diarias
+
+Al cambiar una cita de día o eliminarla con la sesión, el día anterior se marca para recalcularse. Cada día se
+recalcula con las citas que inician desde las 00:00 y antes del día siguiente.
+"""
+
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from citas_admin.blueprints.cit_citas.models import CitCita
+from citas_admin.blueprints.cit_citas_diarias import tasks
+from citas_admin.blueprints.cit_citas_diarias.models import CitCitaDiaria
+from citas_admin.extensions import database
+
+
+@pytest.fixture(name="marcadas")
+def marcadas_fixture(monkeypatch):
+    """Entrega una lista con los días que se marcan, en lugar de guardarlos en Redis"""
+    fechas = []
+    monkeypatch.setattr(CitCitaDiaria, "marcar_fechas", classmethod(lambda cls, nuevas: fechas.extend(nuevas)))
+    return fechas
+
+
+class RedisPrueba:
+    """Lo que usa actualizar de Redis, sin marca ni días marcados"""
+
+    def get(self, llave):
+        """Sin marca se reconstruye toda la tabla"""
+        return None
+
+    def smembers(self, llave):
+        """Sin días marcados"""
+        return set()
+
+    def pipeline(self):
+        """Las escrituras se omiten"""
+        return self
+
+    def set(self, llave, valor):
+        """Omitir"""
+
+    def srem(self, llave, *miembros):
+        """Omitir"""
+
+    def execute(self):
+        """Omitir"""
+
+
+def agregar_cita(inicio: datetime) -> CitCita:
+    """Agregar una cita, SQLite no revisa las claves foráneas"""
+    cit_cita = CitCita(
+        cit_cliente_id=1,
+        cit_servicio_id=1,
+        oficina_id=1,
+        inicio=inicio,
+        termino=inicio.replace(minute=30),
+        notas="",
+        estado="PENDIENTE",
+    )
+    database.session.add(cit_cita)
+    database.session.commit()
+    return cit_cita
+
+
+def test_cambiar_de_dia_marca_el_anterior(app, marcadas):
+    """Mover la cita a otro día marca el día que deja"""
+    cit_cita = agregar_cita(datetime(2024, 3, 4, 9, 0))
+    assert marcadas == []
+    cit_cita.inicio = datetime(2024, 3, 5, 9, 0)
+    cit_cita.termino = datetime(2024, 3, 5, 9, 30)
+    database.session.commit()
+    assert marcadas == [date(2024, 3, 4)]
+
+
+def test_cambiar_de_hora_no_marca(app, marcadas):
+    """Cambiar la hora en el mismo día no marca, el día se toma por modificado"""
+    cit_cita = agregar_cita(datetime(2024, 3, 4, 9, 0))
+    cit_cita.inicio = datetime(2024, 3, 4, 10, 0)
+    database.session.commit()
+    assert marcadas == []
+
+
+def test_eliminar_marca_el_dia(app, marcadas):
+    """Eliminar la cita marca su día"""
+    cit_cita = agregar_cita(datetime(2024, 3, 4, 9, 0))
+    database.session.delete(cit_cita)
+    database.session.commit()
+    assert marcadas == [date(2024, 3, 4)]
+
+
+def test_rangos_de_dias_consecutivos():
+    """Los días consecutivos se juntan en un solo rango"""
+    dias = [date(2024, 3, 4), date(2024, 3, 5), date(2024, 3, 7)]
+    assert tasks._rangos(dias) == [
+        (datetime(2024, 3, 4), datetime(2024, 3, 6)),
+        (datetime(2024, 3, 7), datetime(2024, 3, 8)),
+    ]
+
+
+def test_actualizar_cuenta_por_dia(app, marcadas, monkeypatch):
+    """Las citas a las 00:00 y a las 23:30 cuentan en su propio día"""
+    monkeypatch.setattr(tasks.app, "redis", RedisPrueba())
+    for inicio in (datetime(2024, 3, 4, 0, 0), datetime(2024, 3, 4, 23, 30), datetime(2024, 3, 5, 0, 0)):
+        agregar_cita(inicio)
+    tasks.actualizar()
+    cantidades = {cit_cita_diaria.fecha: cit_cita_diaria.cantidad for cit_cita_diaria in CitCitaDiaria.query.all()}
+    assert cantidades == {date(2024, 3, 4): 2, date(2024, 3, 5): 1}
@@ -0,0 +1,299 @@
+"""
+Pruebas de los listados DataTables
+
+Cada página del listado debe consultar la base de datos la misma cantidad de veces sin importar cuántas filas entrega,
+las relaciones que se muestran en cada fila se traen en la misma consulta.
+"""
+
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+
+import pytest
+from flask import g
+
+from citas_admin.blueprints.autoridades.models import Autoridad
+from citas_admin.blueprints.bitacoras.models import Bitacora
+from citas_admin.blueprints.cit_categorias.models import CitCategoria
+from citas_admin.blueprints.cit_citas.models import CitCita
+from citas_admin.blueprints.cit_citas.views import exportar_datatable
+from citas_admin.blueprints.cit_clientes.models import CitCliente
+from citas_admin.blueprints.cit_horas_bloqueadas.models import CitHoraBloqueada
+from citas_admin.blueprints.cit_servicios.models import CitServicio
+from citas_admin.blueprints.distritos.models import Distrito
+from citas_admin.blueprints.domicilios.models import Domicilio
+from citas_admin.blueprints.materias.models import Materia
+from citas_admin.blueprints.modulos.models import Modulo
+from citas_admin.blueprints.oficinas.models import Oficina
+from citas_admin.blueprints.pag_pagos.models import PagPago
+from citas_admin.blueprints.pag_tramites_servicios.models import PagTramiteServicio
+from citas_admin.blueprints.usuarios.models import Usuario
+from citas_admin.extensions import database
+
+FILAS = 10  # Se compara una página con FILAS contra otra con el doble
+
+
+class UsuarioPrueba:
+    """Usuario que puede ver todos los módulos, para las vistas que elaboran enlaces según los permisos"""
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def can_view(self, modulo: str) -> bool:
+        """Puede ver"""
+        return True
+
+    def get_id(self) -> str:
+        """Identificador"""
+        return "1"
+
+
+def alimentar_autoridades(desde: int, hasta: int):
+    """Agregar autoridades, cada una en su propio distrito"""
+    materia = Materia.query.first() or Materia(nombre="MATERIA")
+    for numero in range(desde, hasta):
+        distrito = Distrito(clave=f"D{numero}", nombre=f"DISTRITO {numero}", nombre_corto=f"D {numero}")
+        database.session.add(
+            Autoridad(
+                distrito=distrito,
+                materia=materia,
+                clave=f"A{numero}",
+                descripcion=f"AUTORIDAD {numero}",
+                descripcion_corta=f"A {numero}",
+                organo_jurisdiccional="NO DEFINIDO",
+            )
+        )
+    database.session.commit()
+
+
+def alimentar_cit_servicios(desde: int, hasta: int):
+    """Agregar servicios, cada uno en su propia categoría"""
+    for numero in range(desde, hasta):
+        database.session.add(
+            CitServicio(
+                cit_categoria=CitCategoria(nombre=f"CATEGORIA {numero}"),
+                clave=f"S{numero}",
+                descripcion=f"SERVICIO {numero}",
+                duracion=time(0, 30),
+            )
+        )
+    database.session.commit()
+
+
+def nueva_oficina(numero: int) -> Oficina:
+    """Oficina con su propio distrito y domicilio"""
+    distrito = Distrito(clave=f"O{numero}", nombre=f"DISTRITO {numero}", nombre_corto=f"D {numero}")
+    domicilio = Domicilio(
+        distrito=distrito,
+        edificio=f"EDIFICIO {numero}",
+        estado="COAHUILA",
+        municipio="SALTILLO",
+        calle="CALLE",
+        num_ext="1",
+        num_int="",
+        colonia="CENTRO",
+        cp=25000,
+        completo="CALLE 1, CENTRO",
+    )
+    return Oficina(
+        distrito=distrito,
+        domicilio=domicilio,
+        clave=f"O{numero}",
+        descripcion=f"OFICINA {numero}",
+        descripcion_corta=f"O {numero}",
+        apertura=time(8, 0),
+        cierre=time(15, 0),
+        limite_personas=2,
+    )
+
+
+def alimentar_bitacoras(desde: int, hasta: int):
+    """Agregar bitácoras, cada una con su propio módulo y usuario"""
+    for numero in range(desde, hasta):
+        database.session.add(
+            Bitacora(
+                modulo=Modulo(nombre=f"MODULO {numero}", nombre_corto=f"M {numero}", icono="", ruta=""),
+                usuario=Usuario(
+                    autoridad_id=1,
+                    oficina_id=1,
+                    email=f"usuario{numero}@correo.com",
+                    nombres="NOMBRES",
+                    apellido_paterno="PATERNO",
+                    apellido_materno="MATERNO",
+                ),
+                descripcion=f"BITACORA {numero}",
+                url="",
+            )
+        )
+    database.session.commit()
+
+
+def alimentar_cit_clientes(desde: int, hasta: int):
+    """Agregar clientes"""
+    for numero in range(desde, hasta):
+        database.session.add(
+            CitCliente(
+                nombres="NOMBRES",
+                apellido_primero="PRIMERO",
+                apellido_segundo="SEGUNDO",
+                curp=f"CURP{numero}",
+                telefono="8440000000",
+                email=f"cliente{numero:02d}@correo.com",
+                contrasena_md5="",
+                contrasena_sha256="",
+                renovacion=date(2030, 1, 1),
+                limite_citas_pendientes=3,
+            )
+        )
+    database.session.commit()
+
+
+def alimentar_cit_citas(desde: int, hasta: int):
+    """Agregar citas, cada una con su propio cliente, servicio y oficina"""
+    for numero in range(desde, hasta):
+        database.session.add(
+            CitCita(
+                cit_cliente=CitCliente(
+                    nombres="NOMBRES",
+                    apellido_primero="PRIMERO",
+                    apellido_segundo="SEGUNDO",
+                    curp=f"CURP{numero}",
+                    telefono="8440000000",
+                    email=f"cliente{numero}@correo.com",
+                    contrasena_md5="",
+                    contrasena_sha256="",
+                    renovacion=date(2030, 1, 1),
+                    limite_citas_pendientes=3,
+                ),
+                cit_servicio=CitServicio(
+                    cit_categoria=CitCategoria(nombre=f"CATEGORIA {numero}"),
+                    clave=f"S{numero}",
+                    descripcion=f"SERVICIO {numero}",
+                    duracion=time(0, 30),
+                ),
+                oficina=nueva_oficina(numero),
+                inicio=datetime(2024, 3, 4, 9, 0),
+                termino=datetime(2024, 3, 4, 9, 30),
+                notas="",
+                estado="PENDIENTE",
+            )
+        )
+    database.session.commit()
+
+
+def alimentar_cit_horas_bloqueadas(desde: int, hasta: int):
+    """Agregar horas bloqueadas, cada una en su propia oficina"""
+    for numero in range(desde, hasta):
+        database.session.add(
+            CitHoraBloqueada(
+                oficina=nueva_oficina(numero),
+                fecha=date(2024, 3, 4),
+                inicio=time(9, 0),
+                termino=time(10, 0),
+                descripcion=f"BLOQUEO {numero}",
+            )
+        )
+    database.session.commit()
+
+
+def alimentar_pag_pagos(desde: int, hasta: int):
+    """Agregar pagos de un mismo cliente, trámite y autoridad"""
+    alimentar_autoridades(desde, desde + 1)
+    alimentar_cit_clientes(desde, desde + 1)
+    autoridad = Autoridad.query.filter_by(clave=f"A{desde}").one()
+    cit_cliente = CitCliente.query.filter_by(curp=f"CURP{desde}").one()
+    pag_tramite_servicio = PagTramiteServicio(clave=f"T{desde}", descripcion="TRAMITE", costo=Decimal("100.00"), url="")
+    for numero in range(desde, hasta):
+        database.session.add(
+            PagPago(
+                autoridad=autoridad,
+                distrito=autoridad.distrito,
+                cit_cliente=cit_cliente,
+                pag_tramite_servicio=pag_tramite_servicio,
+                caducidad=date(2030, 1, 1),
+                descripcion=f"PAGO {numero}",
+                estado="PAGADO",
+                folio=f"F{numero}",
+                total=Decimal("100.00"),
+            )
+        )
+    database.session.commit()
+
+
+def consultar_pagina(app, endpoint: str, contar_consultas: list) -> tuple[int, int]:
+    """Pedir una página del listado con todas las filas, entrega las sentencias y las filas"""
+    database.session.expunge_all()  # Que las relaciones no estén ya cargadas en la sesión
+    with app.test_request_context(f"/{endpoint}", method="POST", data={"draw": 1, "start": 0, "length": 4 * FILAS}):
+        g._login_user = UsuarioPrueba()
+        contar_consultas.clear()
+        respuesta = app.view_functions[endpoint]()
+        cantidad = len(contar_consultas)
+    assert respuesta.status_code == 200
+    return cantidad, len(respuesta.get_json()["aaData"])
+
+
+@pytest.mark.parametrize(
+    "endpoint, alimentar",
+    [
+        ("autoridades.datatable_json", alimentar_autoridades),
+        ("bitacoras.datatable_json", alimentar_bitacoras),
+        ("cit_citas.datatable_json", alimentar_cit_citas),
+        ("cit_horas_bloqueadas.admin_datatable_json", alimentar_cit_horas_bloqueadas),
+        ("cit_servicios.datatable_json", alimentar_cit_servicios),
+    ],
+)
+def test_consultas_por_pagina_constantes(app, contar_consultas, endpoint, alimentar):
+    """Con el doble de filas la página se elabora con las mismas consultas"""
+    alimentar(0, FILAS)
+    consultas, filas = consultar_pagina(app, endpoint, contar_consultas)
+    assert filas == FILAS
+    alimentar(FILAS, 2 * FILAS)
+    consultas_doble, filas_doble = consultar_pagina(app, endpoint, contar_consultas)
+    assert filas_doble == 2 * FILAS
+    assert consultas_doble == consultas
+
+
+def test_cit_citas_filtrado_por_cliente_une_una_vez(app, contar_consultas):
+    """Al filtrar por el cliente, la página y la exportación unen cit_clientes una sola vez"""
+    alimentar_cit_citas(0, FILAS)
+    with app.test_request_context(
+        "/cit_citas", method="POST", data={"draw": 1, "start": 0, "length": FILAS, "cit_cliente_email": "cliente1"}
+    ):
+        g._login_user = UsuarioPrueba()
+        respuesta = app.view_functions["cit_citas.datatable_json"]()
+    assert len(respuesta.get_json()["aaData"]) == 1
+    pagina = [sentencia for sentencia in contar_consultas if "LIMIT" in sentencia][0]
+    assert pagina.count("JOIN cit_clientes") == 1
+    _, consulta = exportar_datatable({"cit_cliente_email": "cliente1"})
+    assert str(consulta.statement).count("JOIN cit_clientes") == 1
+
+
+@pytest.mark.parametrize(
+    "endpoint, alimentar",
+    [
+        ("cit_clientes.datatable_json", alimentar_cit_clientes),
+        ("cit_horas_bloqueadas.admin_datatable_json", alimentar_cit_horas_bloqueadas),
+        ("pag_pagos.datatable_json", alimentar_pag_pagos),
+    ],
+)
+def test_pagina_siguiente_por_llave(app, contar_consultas, endpoint, alimentar):
+    """La página siguiente con la llave de la anterior es la misma que con OFFSET"""
+    alimentar(0, FILAS)
+    formulario = {"draw": 1, "start": 0, "length": 4}
+    with app.test_request_context(f"/{endpoint}", method="POST", data=formulario):
+        g._login_user = UsuarioPrueba()
+        keyset = app.view_functions[endpoint]().get_json()["keyset"]
+    formulario["start"] = 4
+    with app.test_request_context(f"/{endpoint}", method="POST", data=formulario):
+        g._login_user = UsuarioPrueba()
+        por_offset = app.view_functions[endpoint]().get_json()["aaData"]
+    formulario.update(keyset_start=keyset["start"], keyset_valores=json.dumps(keyset["valores"]))
+    with app.test_request_context(f"/{endpoint}", method="POST", data=formulario):
+        g._login_user = UsuarioPrueba()
+        contar_consultas.clear()
+        por_llave = app.view_functions[endpoint]().get_json()["aaData"]
+    assert len(por_llave) == 4
+    assert por_llave == por_offset
+    # SQLite siempre escribe OFFSET, lo que indica la llave es la comparación con la última fila
+    assert any(" > ?" in sentencia or " < ?" in sentencia for sentencia in contar_consultas)
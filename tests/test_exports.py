@@ -0,0 +1,47 @@
+"""
+Pruebas de las exportaciones
+"""
+
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import DateTime, Integer, Numeric, String
+
+from lib.exports import write_parquet
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+CABECERAS = ["ID", "EMAIL", "TOTAL", "CREADO"]
+TIPOS = [Integer(), String(256), Numeric(precision=8, scale=2), DateTime()]
+
+
+def filas_con_nulos_al_inicio(cantidad: int, lote: int):
+    """El primer lote no tiene EMAIL, TOTAL ni CREADO; los siguientes sí"""
+    for numero in range(cantidad):
+        if numero < lote:
+            yield numero, None, None, None
+        else:
+            yield numero, f"persona{numero}@correo.com", Decimal("10.50"), datetime(2024, 1, 1, 12, 0)
+
+
+def test_parquet_con_tipos_de_la_consulta(tmp_path):
+    """Con los tipos de SQLAlchemy el esquema no depende del primer lote"""
+    ruta = str(tmp_path / "exportar.parquet")
+    contador = write_parquet(ruta, CABECERAS, filas_con_nulos_al_inicio(25, 10), lote=10, tipos=TIPOS)
+    assert contador == 25
+    tabla = pq.read_table(ruta)
+    assert str(tabla.schema.field("TOTAL").type) == "decimal128(8, 2)"
+    assert str(tabla.schema.field("CREADO").type) == "timestamp[us]"
+    assert tabla.column("EMAIL").to_pylist()[24] == "persona24@correo.com"
+    assert tabla.column("TOTAL").to_pylist()[24] == Decimal("10.50")
+
+
+def test_parquet_sin_tipos(tmp_path):
+    """Sin tipos, las columnas vacías del primer lote quedan como texto y los valores posteriores se convierten"""
+    ruta = str(tmp_path / "exportar.parquet")
+    contador = write_parquet(ruta, CABECERAS, filas_con_nulos_al_inicio(25, 10), lote=10)
+    assert contador == 25
+    tabla = pq.read_table(ruta)
+    assert str(tabla.schema.field("TOTAL").type) == "string"
+    assert tabla.column("TOTAL").to_pylist()[24] == "10.50"
@@ -0,0 +1,79 @@
+"""
+Pruebas de las tareas de pag_pagos
+
+Los comprobantes se envían por lotes, cada lote se toma de nuevo después de los pagos del lote anterior.
+"""
+
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from citas_admin.blueprints.autoridades.models import Autoridad
+from citas_admin.blueprints.cit_clientes.models import CitCliente
+from citas_admin.blueprints.distritos.models import Distrito
+from citas_admin.blueprints.materias.models import Materia
+from citas_admin.blueprints.pag_pagos.models import PagPago
+from citas_admin.blueprints.pag_pagos.tasks import enviar_comprobantes
+from citas_admin.blueprints.pag_tramites_servicios.models import PagTramiteServicio
+from citas_admin.extensions import database
+
+PAGOS = 5  # Con lotes de 2 se toman tres lotes
+
+
+@pytest.fixture(name="mensajes")
+def mensajes_fixture(monkeypatch, tmp_path):
+    """Guardar los mensajes como archivos en un directorio temporal, entrega el directorio"""
+    monkeypatch.setattr("lib.mailer.MAILER_TRANSPORTE", "archivo")
+    monkeypatch.setattr("lib.mailer.MAILER_DIRECTORIO", str(tmp_path))
+    return tmp_path
+
+
+def alimentar_pag_pagos(cantidad: int):
+    """Agregar pagos PAGADOS sin comprobante enviado"""
+    distrito = Distrito(clave="D1", nombre="DISTRITO 1", nombre_corto="D 1")
+    autoridad = Autoridad(
+        distrito=distrito,
+        materia=Materia(nombre="MATERIA"),
+        clave="A1",
+        descripcion="AUTORIDAD 1",
+        descripcion_corta="A 1",
+        organo_jurisdiccional="NO DEFINIDO",
+    )
+    cit_cliente = CitCliente(
+        nombres="NOMBRES",
+        apellido_primero="PRIMERO",
+        apellido_segundo="SEGUNDO",
+        curp="CURP",
+        telefono="8440000000",
+        email="cliente@correo.com",
+        contrasena_md5="",
+        contrasena_sha256="",
+        renovacion=date(2030, 1, 1),
+        limite_citas_pendientes=3,
+    )
+    pag_tramite_servicio = PagTramiteServicio(clave="T1", descripcion="TRAMITE 1", costo=Decimal("100.00"), url="")
+    for numero in range(cantidad):
+        database.session.add(
+            PagPago(
+                autoridad=autoridad,
+                distrito=distrito,
+                cit_cliente=cit_cliente,
+                pag_tramite_servicio=pag_tramite_servicio,
+                caducidad=date(2030, 1, 1),
+                descripcion=f"PAGO {numero}",
+                estado="PAGADO",
+                folio=f"F{numero}",
+                total=Decimal("100.00"),
+            )
+        )
+    database.session.commit()
+
+
+def test_enviar_comprobantes_por_lotes(app, mensajes):
+    """Con varios lotes se envían y se marcan todos los pagos una sola vez"""
+    alimentar_pag_pagos(PAGOS)
+    mensaje = enviar_comprobantes(lote=2)
+    assert mensaje == f"Se enviaron {PAGOS} comprobantes de pago"
+    assert PagPago.query.filter(PagPago.ya_se_envio_comprobante.is_(False)).count() == 0
+    assert len(list(mensajes.glob("*.eml"))) == PAGOS